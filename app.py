@@ -22,6 +22,7 @@ from data import get_batch_data
 from data import namespace_utils
 
 from utils import logger_utils
+from utils import metrics_utils
 from collections import OrderedDict
 
 data_cleaner_api = data_clean.DataCleaner({})
@@ -54,6 +55,27 @@ class Eval(object):
         self.embedding_mat = self.embedding_info["embedding_matrix"]
         self.extral_symbol = self.embedding_info["extra_symbol"]
 
+        self.batch_size = self.config.get("batch_size", 1024)
+        self.trace_rate = self.config.get("trace_rate", 0.0)
+        self.trace_dir = self.config.get("trace_dir", None)
+        self.init_metrics()
+
+    def init_metrics(self):
+        self.metrics = metrics_utils.Registry()
+        self.stage_seconds = self.metrics.histogram("classifynet_stage_seconds",
+                                    "time spent per serving stage")
+        self.request_size = self.metrics.histogram("classifynet_request_questions",
+                                    "questions per request", metrics_utils.SIZE_BUCKETS)
+        self.batch_fill = self.metrics.histogram("classifynet_batch_fill_ratio",
+                                    "sess.run batch size over max batch size", 
+                                    metrics_utils.RATIO_BUCKETS)
+        self.requests_total = self.metrics.counter("classifynet_requests_total",
+                                    "requests served")
+        self.errors_total = self.metrics.counter("classifynet_request_errors_total",
+                                    "requests that raised")
+        self.traces_total = self.metrics.counter("classifynet_traces_total",
+                                    "sampled sess.run traces written")
+
     def init_model(self, model_config):
 
         model_name = model_config["model_name"]
@@ -76,6 +98,7 @@ class Eval(object):
         FLAGS.char_vocab_size = 0
         FLAGS.emb_size = self.embedding_mat.shape[1]
         FLAGS.extra_symbol = self.extral_symbol
+        FLAGS.appended_symbol = self.embedding_info.get("appended_symbol", [])
 
         model.build_placeholder(FLAGS)
         model.build_op()
@@ -91,35 +114,69 @@ class Eval(object):
                 self.model[model_name] = self.init_model(model_config_lst[model_name])
 
     def prepare_data(self, question_lst):
-        question_lst = [cut_tool.cut(data_cleaner_api.clean(question)) for question in question_lst]
+        with self.stage_seconds.time(stage="clean"):
+            question_lst = [data_cleaner_api.clean(question) for question in question_lst]
+        with self.stage_seconds.time(stage="segment"):
+            question_lst = [cut_tool.cut(question) for question in question_lst]
         return question_lst
 
+    def run_model(self, model_name, batch):
+        if self.trace_rate > 0 and self.trace_dir and random() < self.trace_rate:
+            from tensorflow.python.client import timeline
+            run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+            run_metadata = tf.RunMetadata()
+            result = self.model[model_name].infer(batch, mode="infer", is_training=False,
+                                        run_options=run_options, 
+                                        run_metadata=run_metadata)
+            trace = timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format()
+            trace_path = os.path.join(self.trace_dir, 
+                            "{}_{}.json".format(model_name, int(time.time()*1000)))
+            with open(trace_path, "w") as fwobj:
+                fwobj.write(trace)
+            self.traces_total.inc(model=model_name)
+            return result
+        return self.model[model_name].infer(batch, mode="infer", is_training=False)
+
     def model_eval(self, model_name, question_lst):
 
         eval_batch = get_batch_data.get_eval_classify_batches(question_lst,
-                                                              1024,
+                                                              self.batch_size,
                                                               self.token2id,
                                                               is_training=False)
 
         eval_probs = []
         sent_repres = []
         eval_labels = []
-        for batch in eval_batch:
-            [logits, preds, repres] = self.model[model_name].infer(batch, mode="infer", is_training=False)
+        batch_sizes = []
+        while True:
+            # batches are built lazily, so time each next() as the batching stage
+            with self.stage_seconds.time(stage="batch"):
+                batch = next(eval_batch, None)
+            if batch is None:
+                break
+            self.batch_fill.observe(batch[0].shape[0] / float(self.batch_size))
+            with self.stage_seconds.time(stage="sess_run"):
+                [logits, preds, repres] = self.run_model(model_name, batch)
+            preds = data_utils.restore_pruned_classes(preds, self.embedding_info)
+            batch_sizes.append(batch[0].shape[0])
             eval_probs.extend(list(np.max(preds, axis=-1)))
             eval_labels.extend(list(np.argmax(preds, axis=-1)))
             sent_repres.extend(repres)
-        return eval_probs, eval_labels, sent_repres
+        return eval_probs, eval_labels, sent_repres, batch_sizes
 
     def infer(self, question_lst):
+        self.request_size.observe(len(question_lst))
         question_lst = self.prepare_data(question_lst)
+        # sizes of the sess.run batches served for this request
+        batch_sizes = []
         eval_probs, eval_labels, sent_repres = {}, {}, {}
         for model_name in self.model:
-            probs, labels, repres = self.model_eval(model_name, question_lst)
+            probs, labels, repres, sizes = self.model_eval(model_name, question_lst)
             eval_probs[model_name] = probs
             sent_repres[model_name] = repres
             eval_labels[model_name] = labels
-        return eval_probs, eval_labels, sent_repres
+            batch_sizes.extend(sizes)
+        return eval_probs, eval_labels, sent_repres, batch_sizes
 
 
 if __name__ == "__main__":
@@ -155,8 +212,17 @@ if __name__ == "__main__":
         "model_str": "esim_1536802315_1.5706811535432106_0.821129990798319",
         "model_dir": "./data/xuht/test/classify_tianfeng_speech_command_big_focal_loss/esim/models"
     }
+    # all served models share one inter-op pool instead of one pool each
+    os.environ.setdefault("CLASSIFYNET_INTER_OP_POOL_NAME", "classifynet")
+    config["trace_rate"] = float(os.environ.get("CLASSIFYNET_TRACE_RATE", 0.0))
+    config["trace_dir"] = os.environ.get("CLASSIFYNET_TRACE_DIR", None)
     eval_api = Eval(config)
     eval_api.init(model_config_lst)
+    # opt-in: one request at a time in the model, time waiting here is queue wait
+    model_lock = None
+    if os.environ.get("CLASSIFYNET_SERIALIZE_INFERENCE", "0") == "1":
+        import threading
+        model_lock = threading.Lock()
 
 
     def infer(data):
@@ -168,7 +234,7 @@ if __name__ == "__main__":
         else:
             question_lst = [question]
 
-        preds, labels, sent_repres = eval_api.infer(question_lst)
+        preds, labels, sent_repres, batch_sizes = eval_api.infer(question_lst)
         for key in preds:
             for index, item in enumerate(preds[key]):
                 preds[key][index] = str(preds[key][index])
@@ -195,19 +261,39 @@ if __name__ == "__main__":
                 score=str(pr)
             res.append({'question':ques,'intent':intent,'score':score})
 
-        return {'mod':0,'data':res}
+        return {'mod':0,'data':res}, batch_sizes
 
         # return preds, labels, sent_repres
 
 
     @app.route('/classifynet', methods=['POST'])
     def classifynet():
+        start = time.time()
         data = request.get_json(force=True)
-        print("=====data=====", data)
-        return jsonify(infer(data))
-
-
-    app.run(debug=False, host="0.0.0.0", port=8011)
+        eval_api.requests_total.inc()
+        try:
+            if model_lock is None:
+                result, batch_sizes = infer(data)
+            else:
+                with model_lock:
+                    eval_api.stage_seconds.observe(time.time() - start, stage="queue_wait")
+                    result, batch_sizes = infer(data)
+        except Exception:
+            eval_api.errors_total.inc()
+            raise
+        with eval_api.stage_seconds.time(stage="serialize"):
+            response = jsonify(result)
+        response.headers["X-Batch-Sizes"] = ",".join([str(size) for size in batch_sizes])
+        eval_api.stage_seconds.observe(time.time() - start, stage="request")
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return flask.Response(eval_api.metrics.expose(), 
+                    mimetype="text/plain; version=0.0.4")
+
+
+    app.run(debug=False, host="0.0.0.0", port=8011, threaded=True)
 
     # preds, sent_repres = eval_api.infer([
     #             "广州客运站的数目",
@@ -2,23 +2,21 @@ import tensorflow as tf
 import numpy as np
 from abc import ABCMeta, abstractmethod
 from model.utils.embed import integration_func
+from model.utils.quantization import quantization_utils
+from model.utils.pruning import pruning_utils
+from loss import point_wise_loss
+from utils import session_utils
 import os
 
 class ModelTemplate(object):
     __metaclass__ = ABCMeta
     def __init__(self):
         self.graph = tf.Graph()
-        gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=0.95)
-
-        session_conf = tf.ConfigProto(
-          allow_soft_placement=True,
-          log_device_placement=True,
-          gpu_options=gpu_options)
-        self.sess = tf.Session(config=session_conf,
-                                graph=self.graph)
 
     def build_placeholder(self, config):
         self.config = config
+        # thread pools, optimizer level and memory options come from the config
+        self.sess = session_utils.create_session(self.graph, self.config)
         with self.graph.as_default():
             self.token_emb_mat = self.config["token_emb_mat"]
             self.char_emb_mat = self.config["char_emb_mat"]
@@ -27,12 +25,20 @@ class ModelTemplate(object):
             self.max_length = int(self.config["max_length"])
             self.emb_size = int(self.config["emb_size"])
             self.extra_symbol = self.config["extra_symbol"]
+            self.appended_size = len(self.config.get("appended_symbol", None) or [])
             self.scope = self.config["scope"]
             self.num_classes = int(self.config["num_classes"])
             self.batch_size = int(self.config["batch_size"])
             self.grad_clipper = float(self.config.get("grad_clipper", 10.0))
             self.char_limit = self.config.get("char_limit", 10)
             self.char_dim = self.config.get("char_emb_size", 300)
+            self.int8_inference = self.config.get("int8_inference", False)
+
+            if self.int8_inference:
+                # model weights are read from int8 variables and dequantized on the fly
+                tf.get_variable_scope().set_custom_getter(
+                    quantization_utils.int8_dequant_getter(
+                        self.config.get("int8_min_size", 1024)))
 
             # ---- place holder -----
             self.sent_token = tf.placeholder(tf.int32, [None, None], name='sent_token')
@@ -53,12 +59,14 @@ class ModelTemplate(object):
                 self.char_mat = integration_func.generate_embedding_mat(self.vocab_size, emb_len=self.emb_size,
                                      init_mat=self.token_emb_mat, 
                                      extra_symbol=self.extra_symbol, 
-                                     scope='gene_char_emb_mat')
+                                     scope='gene_char_emb_mat',
+                                     appended_size=self.appended_size)
 
             self.emb_mat = integration_func.generate_embedding_mat(self.vocab_size, emb_len=self.emb_size,
                                      init_mat=self.token_emb_mat, 
                                      extra_symbol=self.extra_symbol, 
-                                     scope='gene_token_emb_mat')
+                                     scope='gene_token_emb_mat',
+                                     appended_size=self.appended_size)
 
             
 
@@ -100,6 +108,20 @@ class ModelTemplate(object):
     def build_accuracy(self, *args, **kargs):
         pass
 
+    def build_distillation_loss(self, *args, **kargs):
+        alpha = self.config.get("distillation_alpha", 0.5)
+        # cached teacher logits are only fed while training, elsewhere the
+        # student stands in for its teacher so loss can still be evaluated
+        self.teacher_logits = tf.placeholder_with_default(
+                                    tf.stop_gradient(self.logits), 
+                                    [None, self.num_classes], 
+                                    name="teacher_logits")
+        self.hard_loss = self.loss
+        self.soft_loss, _ = point_wise_loss.distillation_loss(self.logits, 
+                                        self.teacher_logits, 
+                                        self.config)
+        self.loss = (1 - alpha) * self.hard_loss + alpha * self.soft_loss
+
     def apply_ema(self, *args, **kargs):
         decay = self.config.get("with_moving_average", None)
         if decay:
@@ -126,8 +148,14 @@ class ModelTemplate(object):
         
             self.build_model(*args, **kargs)
             self.build_loss(*args, **kargs)
+            if self.config.get("distillation", False):
+                self.build_distillation_loss(*args, **kargs)
             self.build_accuracy(*args, **kargs)
 
+            if self.int8_inference:
+                # keep optimizer slots and ema shadows in float
+                tf.get_variable_scope().set_custom_getter(None)
+
             self.apply_ema(*args, **kargs)
 
             # ---------- optimization ---------
@@ -168,8 +196,105 @@ class ModelTemplate(object):
             if self.config.get("with_moving_average", None):
                 self.sess.run(self.assign_vars)
         
+    def warm_start_model(self, model_dir, model_str):
+        """
+        restore a checkpoint whose embedding rows are a prefix of the
+        current ones, e.g. after the vocab was grown incrementally
+        """
+        with self.graph.as_default():
+            model_path = os.path.join(model_dir, model_str+".ckpt")
+            reader = tf.train.NewCheckpointReader(model_path)
+            ckpt_shape_map = reader.get_variable_to_shape_map()
+
+            restore_vars, grow_vars = [], []
+            for var in tf.global_variables():
+                var_name = var.op.name
+                if var_name not in ckpt_shape_map:
+                    continue
+                var_shape = var.get_shape().as_list()
+                ckpt_shape = ckpt_shape_map[var_name]
+                if var_shape == ckpt_shape:
+                    restore_vars.append(var)
+                elif var_shape[1:] == ckpt_shape[1:] and var_shape[0] > ckpt_shape[0]:
+                    grow_vars.append(var)
+
+            if len(restore_vars) >= 1:
+                tf.train.Saver(restore_vars).restore(self.sess, model_path)
+
+            for var in grow_vars:
+                old_value = reader.get_tensor(var.op.name)
+                old_value_ph = tf.placeholder(var.dtype.base_dtype, old_value.shape)
+                grow_op = var[:old_value.shape[0]].assign(old_value_ph)
+                self.sess.run(grow_op, feed_dict={old_value_ph:old_value})
+
+            if self.config.get("with_moving_average", None):
+                self.sess.run(self.assign_vars)
+
+    def quantize_model(self, model_dir, model_str):
+        """
+        fill an int8_inference graph from a float checkpoint saved by
+        save_model, quantizing every matrix the int8 getter replaced.
+        matrices are quantized from their ema shadows, the remaining
+        weights are set to their shadows as in load_model
+        """
+        with self.graph.as_default():
+            model_path = os.path.join(model_dir, model_str+".ckpt")
+            reader = tf.train.NewCheckpointReader(model_path)
+
+            var_dict = dict([(var.op.name, var) for var in tf.global_variables()])
+            quantized, missing = [], []
+            for var_name in var_dict:
+                if var_name.endswith(quantization_utils.SCALE_SUFFIX):
+                    continue
+                elif var_name.endswith(quantization_utils.INT8_SUFFIX):
+                    float_name = var_name[:-len(quantization_utils.INT8_SUFFIX)]
+                    value = quantization_utils.read_float_tensor(reader, float_name)
+                    q, scale = quantization_utils.quantize_rows(value)
+                    var_dict[var_name].load(q, self.sess)
+                    var_dict[float_name+quantization_utils.SCALE_SUFFIX].load(scale, self.sess)
+                    quantized.append(float_name)
+                elif reader.has_tensor(var_name):
+                    var_dict[var_name].load(reader.get_tensor(var_name), self.sess)
+                else:
+                    missing.append(var_name)
+            if self.config.get("with_moving_average", None):
+                self.sess.run(self.assign_vars)
+            return quantized, missing
+
+    def prune_model(self, model_dir, model_str, token_index, label_index, 
+                    old_vocab_size, old_extra_size, old_appended_size=0):
+        """
+        fill a graph built with a pruned vocab and label set from the
+        unpruned checkpoint, gathering kept embedding rows and kept
+        output classes, optimizer slots and ema shadows included.
+        with moving average the weights are then set to their shadows,
+        as in load_model
+        """
+        with self.graph.as_default():
+            model_path = os.path.join(model_dir, model_str+".ckpt")
+            reader = tf.train.NewCheckpointReader(model_path)
+
+            missing = []
+            for var in tf.global_variables():
+                var_name = var.op.name
+                if not reader.has_tensor(var_name):
+                    missing.append(var_name)
+                    continue
+                value = pruning_utils.prune_value(var_name, 
+                                    reader.get_tensor(var_name),
+                                    var.get_shape().as_list(), 
+                                    token_index, label_index,
+                                    old_vocab_size, old_extra_size,
+                                    old_appended_size)
+                var.load(value, self.sess)
+            if self.config.get("with_moving_average", None):
+                self.sess.run(self.assign_vars)
+            return missing
+
     def step(self, batch_samples, *args, **kargs):
         feed_dict = self.get_feed_dict(batch_samples, *args, **kargs)
+        if kargs.get("teacher_logits", None) is not None:
+            feed_dict[self.teacher_logits] = kargs["teacher_logits"]
         with self.graph.as_default():
             [loss, train_op, global_step, 
             accuracy, preds] = self.sess.run([self.loss, self.train_op, 
@@ -183,17 +308,24 @@ class ModelTemplate(object):
 
     def infer(self, batch_samples, mode, *args, **kargs):
         feed_dict = self.get_feed_dict(batch_samples, *args, **kargs)
+        # optional RunOptions/RunMetadata for sampled traces
+        run_options = kargs.get("run_options", None)
+        run_metadata = kargs.get("run_metadata", None)
         if mode == "test":
             with self.graph.as_default():
                 [loss, logits, pred_probs, accuracy] = self.sess.run([self.loss, self.logits, 
                                                             self.pred_probs, 
                                                             self.accuracy], 
-                                                            feed_dict=feed_dict)
+                                                            feed_dict=feed_dict,
+                                                            options=run_options,
+                                                            run_metadata=run_metadata)
             return loss, logits, pred_probs, accuracy
         elif mode == "infer":
             with self.graph.as_default():
                 [logits, pred_probs, sent_repres] = self.sess.run([self.logits, 
                                                 self.pred_probs,
                                                 self.sent_repres], 
-                                            feed_dict=feed_dict)
+                                            feed_dict=feed_dict,
+                                            options=run_options,
+                                            run_metadata=run_metadata)
             return logits, pred_probs, sent_repres
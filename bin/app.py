@@ -73,6 +73,7 @@ class Eval(object):
         FLAGS.char_vocab_size = 0
         FLAGS.emb_size = self.embedding_mat.shape[1]
         FLAGS.extra_symbol = self.extral_symbol
+        FLAGS.appended_symbol = self.embedding_info.get("appended_symbol", [])
 
         model.build_placeholder(FLAGS)
         model.build_op()
@@ -101,22 +102,28 @@ class Eval(object):
         eval_probs = []
         sent_repres = []
         eval_labels = []
+        batch_sizes = []
         for batch in eval_batch:
             [logits, preds, repres] = self.model[model_name].infer(batch, mode="infer", is_training=False)
+            preds = data_utils.restore_pruned_classes(preds, self.embedding_info)
+            batch_sizes.append(batch[0].shape[0])
             eval_probs.extend(list(np.max(preds, axis=-1)))
             eval_labels.extend(list(np.argmax(preds, axis=-1)))
             sent_repres.extend(repres)
-        return eval_probs, eval_labels, sent_repres
+        return eval_probs, eval_labels, sent_repres, batch_sizes
 
     def infer(self, question_lst):
         question_lst = self.prepare_data(question_lst)
+        # sizes of the sess.run batches served for this request
+        batch_sizes = []
         eval_probs, eval_labels, sent_repres = {}, {}, {}
         for model_name in self.model:
-            probs, labels, repres = self.model_eval(model_name, question_lst)
+            probs, labels, repres, sizes = self.model_eval(model_name, question_lst)
             eval_probs[model_name] = probs
             sent_repres[model_name] = repres
             eval_labels[model_name] = labels
-        return eval_probs, eval_labels, sent_repres
+            batch_sizes.extend(sizes)
+        return eval_probs, eval_labels, sent_repres, batch_sizes
 
 if __name__ == "__main__":
 
@@ -160,7 +167,7 @@ if __name__ == "__main__":
         else:
             question_lst = [question]
         
-        preds, labels, sent_repres = eval_api.infer(question_lst)
+        preds, labels, sent_repres, batch_sizes = eval_api.infer(question_lst)
         for key in preds:
             for index, item in enumerate(preds[key]):
                 preds[key][index] = str(preds[key][index])
@@ -172,13 +179,16 @@ if __name__ == "__main__":
         for key in labels:
             for index, item in enumerate(labels[key]):
                 labels[key][index] = str(labels[key][index].tolist())
-        return preds, labels, sent_repres
+        return (preds, labels, sent_repres), batch_sizes
 
     @app.route('/classifynet', methods=['POST'])
     def classifynet():
         data = request.get_json(force=True)
         print("=====data=====", data)
-        return jsonify(infer(data))
+        result, batch_sizes = infer(data)
+        response = jsonify(result)
+        response.headers["X-Batch-Sizes"] = ",".join([str(size) for size in batch_sizes])
+        return response
 
     app.run(debug=False, host="0.0.0.0", port=8011)
 
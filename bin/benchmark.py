@@ -0,0 +1,198 @@
+import tensorflow as tf
+import numpy as np
+import time, json
+import argparse
+
+import sys,os
+
+sys.path.append("..")
+
+from model.esim.esim import ESIM
+from model.biblosa.biblosa import BiBLOSA
+from model.transformer.base_transformer import BaseTransformer
+from model.transformer.universal_transformer import UniversalTransformer
+
+from data import data_clean
+from data import data_utils
+from data import get_batch_data
+from data import namespace_utils
+
+from collections import OrderedDict
+
+if sys.version_info < (3, ):
+    chr = unichr
+
+MODEL_CLASSES = {
+    "ESIM":ESIM,
+    "BiBLOSA":BiBLOSA,
+    "BaseTransformer":BaseTransformer,
+    "UniversalTransformer":UniversalTransformer
+}
+
+def synthetic_vocab(vocab_size, emb_size):
+    """pad/unk symbols plus vocab_size single cjk chars, as cut_tool splits cjk words into chars"""
+    pad_unk = ["<PAD>", "<UNK>", "<S>", "</S>"]
+    chars = [chr(0x4e00 + index) for index in range(vocab_size)]
+    token2id = OrderedDict([(token, index) for index, token in enumerate(pad_unk+chars)])
+    id2token = OrderedDict([(index, token) for token, index in token2id.items()])
+    embedding_mat = np.random.uniform(low=-0.01, high=0.01,
+                            size=(len(token2id), emb_size)).astype(np.float32)
+    return {"token2id":token2id, "id2token":id2token,
+            "embedding_matrix":embedding_mat, "extra_symbol":pad_unk}, chars
+
+def synthetic_corpus(chars, num_sents, max_length):
+    corpus = []
+    for _ in range(num_sents):
+        length = np.random.randint(1, max_length+1)
+        sent = u"".join([chars[index] for index in np.random.randint(0, len(chars), size=length)])
+        # full width digits and upper case latin exercise the cleaner
+        corpus.append(sent + u"１２ABC")
+    return corpus
+
+def latency_stats(durations):
+    durations = np.asarray(durations) * 1000.0
+    return OrderedDict([
+        ("mean_ms", float(np.mean(durations))),
+        ("p50_ms", float(np.percentile(durations, 50))),
+        ("p90_ms", float(np.percentile(durations, 90))),
+        ("p99_ms", float(np.percentile(durations, 99)))
+    ])
+
+def benchmark_preprocess(raw_corpus, token2id, batch_size):
+    data_cleaner_api = data_clean.DataCleaner({})
+    cut_tool = data_utils.cut_tool_api()
+
+    start = time.time()
+    clean_corpus = [data_cleaner_api.clean(sent) for sent in raw_corpus]
+    clean_time = time.time() - start
+
+    start = time.time()
+    cut_corpus = [cut_tool.cut(sent) for sent in clean_corpus]
+    cut_time = time.time() - start
+
+    label = [0]*len(cut_corpus)
+    start = time.time()
+    batch_num = 0
+    for batch in get_batch_data.get_classify_batch(cut_corpus, label, batch_size,
+                                        token2id, is_training=True):
+        batch_num += 1
+    batch_time = time.time() - start
+
+    return OrderedDict([
+        ("clean_sents_per_sec", len(raw_corpus) / max(clean_time, 1e-8)),
+        ("cut_sents_per_sec", len(raw_corpus) / max(cut_time, 1e-8)),
+        ("batches_per_sec", batch_num / max(batch_time, 1e-8)),
+        ("batch_sents_per_sec", len(raw_corpus) / max(batch_time, 1e-8))
+    ])
+
+def benchmark_model(config_path, embedding_info, config):
+    FLAGS = namespace_utils.load_namespace(config_path)
+    embedding_mat = embedding_info["embedding_matrix"]
+    FLAGS.token_emb_mat = embedding_mat
+    FLAGS.char_emb_mat = 0
+    FLAGS.vocab_size = embedding_mat.shape[0]
+    FLAGS.char_vocab_size = 0
+    FLAGS.emb_size = embedding_mat.shape[1]
+    FLAGS.extra_symbol = embedding_info["extra_symbol"]
+
+    model = MODEL_CLASSES[FLAGS.scope]()
+    start = time.time()
+    model.build_placeholder(FLAGS)
+    model.build_op()
+    model.init_step()
+    build_time = time.time() - start
+
+    results = OrderedDict()
+    results["scope"] = FLAGS.scope
+    results["build_sec"] = build_time
+    results["train"] = []
+    results["infer"] = []
+    for batch_size in config["batch_sizes"]:
+        for seq_len in config["seq_lens"]:
+            sent_token = np.random.randint(4, FLAGS.vocab_size,
+                                size=(batch_size, seq_len)).astype(np.int32)
+            gold_label = np.random.randint(0, int(FLAGS.num_classes),
+                                size=(batch_size,)).astype(np.int32)
+
+            for _ in range(config["warmup"]):
+                model.step([sent_token, gold_label], is_training=True)
+            start = time.time()
+            for _ in range(config["steps"]):
+                model.step([sent_token, gold_label], is_training=True)
+            train_time = time.time() - start
+            results["train"].append(OrderedDict([
+                ("batch_size", batch_size), ("seq_len", seq_len),
+                ("steps_per_sec", config["steps"] / max(train_time, 1e-8)),
+                ("examples_per_sec", config["steps"] * batch_size / max(train_time, 1e-8))
+            ]))
+
+            for _ in range(config["warmup"]):
+                model.infer([sent_token, gold_label], mode="infer", is_training=False)
+            durations = []
+            for _ in range(config["steps"]):
+                start = time.time()
+                model.infer([sent_token, gold_label], mode="infer", is_training=False)
+                durations.append(time.time() - start)
+            infer_stats = OrderedDict([("batch_size", batch_size), ("seq_len", seq_len)])
+            infer_stats.update(latency_stats(durations))
+            results["infer"].append(infer_stats)
+
+    model.sess.close()
+    return results
+
+def run(config):
+    np.random.seed(config["seed"])
+    embedding_info, chars = synthetic_vocab(config["vocab_size"], config["emb_size"])
+
+    report = OrderedDict()
+    report["config"] = config
+    raw_corpus = synthetic_corpus(chars, config["num_sents"], max(config["seq_lens"]))
+    report["preprocess"] = benchmark_preprocess(raw_corpus, embedding_info["token2id"],
+                                                max(config["batch_sizes"]))
+
+    with open(config["model_config"], "r") as frobj:
+        model_config = json.load(frobj)
+
+    report["models"] = OrderedDict()
+    for model_name in config["models"] or sorted(model_config.keys()):
+        config_path = os.path.join(config["config_prefix"], model_config[model_name])
+        with open(config_path, "r") as frobj:
+            scope = json.load(frobj).get("scope", None)
+        if scope not in MODEL_CLASSES:
+            report["models"][model_name] = {"skipped":"no ModelTemplate for scope %s" % scope}
+            continue
+        try:
+            report["models"][model_name] = benchmark_model(config_path, embedding_info, config)
+        except Exception as e:
+            report["models"][model_name] = {"error":repr(e)}
+
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_config', type=str, default="../model_config.json",
+                        help='model config path')
+    parser.add_argument('--config_prefix', type=str, default="../configs", help='config path')
+    parser.add_argument('--models', type=str, default="",
+                        help='comma separated model names, default all in model_config')
+    parser.add_argument('--batch_sizes', type=str, default="1,16,100", help='comma separated batch sizes')
+    parser.add_argument('--seq_lens', type=str, default="20,50", help='comma separated sequence lengths')
+    parser.add_argument('--steps', type=int, default=20, help='timed steps per setting')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed steps per setting')
+    parser.add_argument('--vocab_size', type=int, default=5000, help='synthetic vocab size')
+    parser.add_argument('--emb_size', type=int, default=300, help='synthetic embedding size')
+    parser.add_argument('--num_sents', type=int, default=2000, help='synthetic sentences for preprocessing')
+    parser.add_argument('--seed', type=int, default=1234, help='random seed')
+    parser.add_argument('--output', type=str, default=None, help='json output path')
+
+    args, unparsed = parser.parse_known_args()
+    config = vars(args)
+    config["models"] = [model for model in args.models.split(",") if model]
+    config["batch_sizes"] = [int(size) for size in args.batch_sizes.split(",")]
+    config["seq_lens"] = [int(size) for size in args.seq_lens.split(",")]
+
+    report = json.dumps(run(config), indent=4)
+    if args.output:
+        with open(args.output, "w") as fwobj:
+            fwobj.write(report)
+    print(report)
@@ -0,0 +1,83 @@
+import tensorflow as tf
+import numpy as np
+import time, json
+import argparse
+
+import sys,os
+
+sys.path.append("..")
+
+from model.utils.biblosa.self_attn import bi_directional_simple_block_attention
+
+def peak_bytes(run_metadata):
+    peak = 0
+    for dev_stats in run_metadata.step_stats.dev_stats:
+        for node_stats in dev_stats.node_stats:
+            for memory in node_stats.memory:
+                peak = max(peak, memory.peak_bytes)
+    return peak
+
+def benchmark(memory_efficient, rep_tensor, rep_mask, config, init_values=None):
+    graph = tf.Graph()
+    with graph.as_default():
+        rep_ph = tf.placeholder(tf.float32, [None, None, rep_tensor.shape[-1]])
+        mask_ph = tf.placeholder(tf.bool, [None, None])
+        is_train = tf.placeholder(tf.bool, [])
+        output = bi_directional_simple_block_attention(
+            rep_ph, mask_ph, config["block_len"], 'ct_block_attn',
+            1.0, is_train, 0., 'elu', config["hidden"], memory_efficient)
+        loss = tf.reduce_sum(output)
+        train_op = tf.train.GradientDescentOptimizer(0.0).minimize(loss)
+
+        sess = tf.Session(graph=graph)
+        sess.run(tf.global_variables_initializer())
+        # both paths share variable names, so reuse the same weights to compare outputs
+        if init_values:
+            for var in tf.global_variables():
+                var.load(init_values[var.op.name], sess)
+        var_values = dict([(var.op.name, value) for var, value in 
+                    zip(tf.global_variables(), sess.run(tf.global_variables()))])
+        feed_dict = {rep_ph:rep_tensor, mask_ph:rep_mask, is_train:False}
+
+        result = sess.run(output, feed_dict=feed_dict)
+
+        run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        run_metadata = tf.RunMetadata()
+        sess.run(train_op, feed_dict=feed_dict, 
+                options=run_options, run_metadata=run_metadata)
+
+        start = time.time()
+        for _ in range(config["steps"]):
+            sess.run(train_op, feed_dict=feed_dict)
+        step_time = (time.time() - start) / config["steps"]
+        sess.close()
+
+    return result, var_values, {"peak_bytes":peak_bytes(run_metadata), "step_time":step_time}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=100, help='batch size')
+    parser.add_argument('--seq_len', type=int, default=50, help='sequence length')
+    parser.add_argument('--emb_size', type=int, default=300, help='input dim')
+    parser.add_argument('--hidden', type=int, default=256, help='block attention hidden size')
+    parser.add_argument('--block_len', type=int, default=5, help='block length')
+    parser.add_argument('--steps', type=int, default=20, help='timed train steps')
+    parser.add_argument('--seed', type=int, default=1234, help='random seed')
+
+    args, unparsed = parser.parse_known_args()
+    config = vars(args)
+
+    np.random.seed(args.seed)
+    rep_tensor = np.random.normal(size=(args.batch_size, args.seq_len, args.emb_size)).astype(np.float32)
+    lengths = np.random.randint(1, args.seq_len+1, size=(args.batch_size,))
+    rep_mask = np.arange(args.seq_len)[None, :] < lengths[:, None]
+
+    tile_output, var_values, tile_stats = benchmark(False, rep_tensor, rep_mask, config)
+    efficient_output, _, efficient_stats = benchmark(True, rep_tensor, rep_mask, config, 
+                                                var_values)
+
+    print(json.dumps({"config":config,
+                    "tile":tile_stats,
+                    "memory_efficient":efficient_stats,
+                    "max_abs_diff":float(np.max(np.abs(tile_output - efficient_output)))}, 
+                    indent=4))
@@ -52,10 +52,18 @@ class Eval(object):
 
     def init_model(self, model_config):
 
-        model_name = model_config["model_name"]
         model_str = model_config["model_str"]
         model_dir = model_config["model_dir"]
 
+        model = self.build_model(model_config)
+        model.load_model(model_dir, model_str)
+
+        return model
+
+    def build_model(self, model_config):
+
+        model_name = model_config["model_name"]
+
         FLAGS = namespace_utils.load_namespace(os.path.join(self.model_config_path, model_name+".json"))
         if FLAGS.scope == "ESIM":
             model = ESIM()
@@ -72,11 +80,13 @@ class Eval(object):
         FLAGS.char_vocab_size = 0
         FLAGS.emb_size = self.embedding_mat.shape[1]
         FLAGS.extra_symbol = self.extral_symbol
+        FLAGS.appended_symbol = self.embedding_info.get("appended_symbol", [])
+        FLAGS.int8_inference = model_config.get("int8_inference", 
+                                    FLAGS.get("int8_inference", False))
 
         model.build_placeholder(FLAGS)
         model.build_op()
         model.init_step()
-        model.load_model(model_dir, model_str)
 
         return model
 
@@ -101,10 +111,72 @@ class Eval(object):
         sent_repres = []
         for batch in eval_batch:
             [logits, preds, repres] = self.model[model_name].infer(batch, mode="infer", is_training=False)
+            preds = data_utils.restore_pruned_classes(preds, self.embedding_info)
             eval_probs.extend(list(preds[:,1]))
             sent_repres.extend(repres)
         return eval_probs, sent_repres
 
+    def model_accuracy(self, model_name, corpus, gold_label, batch_size=100):
+        eval_batch = get_batch_data.get_classify_batch(corpus, gold_label, 
+                                    batch_size, 
+                                    self.token2id, 
+                                    is_training=False)
+        eval_probs, eval_label = [], []
+        start = time.time()
+        for batch in eval_batch:
+            [logits, preds, repres] = self.model[model_name].infer(batch, mode="infer", is_training=False)
+            preds = data_utils.restore_pruned_classes(preds, self.embedding_info)
+            eval_probs.append(preds)
+            eval_label.append(batch[1])
+        duration = time.time() - start
+
+        eval_probs = np.concatenate(eval_probs, axis=0)
+        eval_label = np.concatenate(eval_label, axis=0)
+        accuracy = np.mean(np.argmax(eval_probs, axis=-1) == eval_label)
+        return accuracy, eval_probs, duration
+
+    def early_exit_report(self, model_name, question_lst, batch_size=1, threshold=None):
+        """
+        the recurrence stops once every example of a batch is confident,
+        batch_steps is the number of steps actually run per batch and
+        avg_steps the step each example exited at
+        """
+        model = self.model[model_name]
+        eval_batch = get_batch_data.get_eval_classify_batches(question_lst, 
+                                    batch_size, 
+                                    self.token2id, 
+                                    is_training=False)
+        full_time, early_exit_time = 0.0, 0.0
+        total_steps, cnt, agree = 0, 0, 0
+        batch_steps, num_batches = 0, 0
+        for batch in eval_batch:
+            start = time.time()
+            [logits, preds, repres] = model.infer(batch, mode="infer", is_training=False)
+            full_time += time.time() - start
+
+            start = time.time()
+            [early_exit_preds, steps] = model.infer_early_exit(batch, threshold, 
+                                                    is_training=False)
+            early_exit_time += time.time() - start
+
+            total_steps += np.sum(steps)
+            batch_steps += np.max(steps)
+            num_batches += 1
+            agree += np.sum(np.argmax(preds, axis=-1) == np.argmax(early_exit_preds, axis=-1))
+            cnt += preds.shape[0]
+
+        report = OrderedDict()
+        report["examples"] = cnt
+        report["max_steps"] = model.config.num_rec_steps
+        report["batch_size"] = batch_size
+        report["avg_steps"] = total_steps / float(max(cnt, 1))
+        report["batch_steps"] = batch_steps / float(max(num_batches, 1))
+        report["full_depth_latency"] = full_time / float(max(cnt, 1))
+        report["early_exit_latency"] = early_exit_time / float(max(cnt, 1))
+        report["latency_saved"] = report["full_depth_latency"] - report["early_exit_latency"]
+        report["label_agreement"] = agree / float(max(cnt, 1))
+        return report
+
     def infer(self, question_lst):
         question_lst = self.prepare_data(question_lst)
         eval_probs, sent_repres = {}, {}
@@ -0,0 +1,149 @@
+import numpy as np
+import time, json
+import codecs
+import argparse
+import threading
+import requests
+
+import sys,os
+
+from collections import Counter, OrderedDict
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+def read_payloads(data_path, questions_per_request=1):
+    """
+    a .jsonl file is replayed line by line as request bodies,
+    anything else is read as one question per line
+    """
+    payloads = []
+    with codecs.open(data_path, "r", "utf-8") as frobj:
+        lines = [line.strip() for line in frobj if line.strip()]
+    if data_path.endswith(".jsonl"):
+        for line in lines:
+            payloads.append(json.loads(line))
+    else:
+        for index in range(0, len(lines), questions_per_request):
+            payloads.append({"question":lines[index:index+questions_per_request]})
+    return payloads
+
+def num_questions(payload):
+    question = payload.get("question", [])
+    return len(question) if isinstance(question, list) else 1
+
+def send(session, url, payload, timeout):
+    start = time.time()
+    try:
+        response = session.post(url, data=json.dumps(payload), timeout=timeout)
+        ok = response.status_code == 200
+        batch_sizes = response.headers.get("X-Batch-Sizes", "")
+    except requests.RequestException:
+        ok, batch_sizes = False, ""
+    return ok, time.time() - start, [int(size) for size in batch_sizes.split(",") if size]
+
+def percentiles(latency):
+    latency = np.asarray(latency) * 1000.0
+    if latency.shape[0] == 0:
+        return OrderedDict()
+    return OrderedDict([
+        ("mean_ms", float(np.mean(latency))),
+        ("p50_ms", float(np.percentile(latency, 50))),
+        ("p95_ms", float(np.percentile(latency, 95))),
+        ("p99_ms", float(np.percentile(latency, 99))),
+        ("max_ms", float(np.max(latency)))
+    ])
+
+def run(config):
+    payloads = read_payloads(config["data_path"], config["questions_per_request"])
+    num_requests = config["num_requests"] or len(payloads)
+    tasks = queue.Queue()
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            scheduled, payload = task
+            # open loop latency counts time spent queued behind busy workers
+            queued = time.time() - scheduled if scheduled else 0.0
+            ok, latency, batch_sizes = send(session, config["url"], payload, config["timeout"])
+            with lock:
+                results.append((ok, latency, latency + queued, num_questions(payload), batch_sizes))
+
+    workers = [threading.Thread(target=worker) for _ in range(config["concurrency"])]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+
+    start = time.time()
+    if config["rate"] > 0:
+        # poisson arrivals at the requested rate
+        next_time = start
+        for index in range(num_requests):
+            next_time += np.random.exponential(1.0 / config["rate"])
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            tasks.put((next_time, payloads[index % len(payloads)]))
+    else:
+        for index in range(num_requests):
+            tasks.put((None, payloads[index % len(payloads)]))
+    for _ in workers:
+        tasks.put(None)
+    for thread in workers:
+        thread.join()
+    duration = time.time() - start
+
+    success = [result for result in results if result[0]]
+    batch_sizes = Counter()
+    for result in success:
+        batch_sizes.update(result[4])
+
+    report = OrderedDict()
+    report["config"] = config
+    report["requests"] = len(results)
+    report["errors"] = len(results) - len(success)
+    report["error_rate"] = (len(results) - len(success)) / float(max(len(results), 1))
+    report["duration"] = duration
+    report["requests_per_sec"] = len(success) / max(duration, 1e-8)
+    report["questions_per_sec"] = sum([result[3] for result in success]) / max(duration, 1e-8)
+    report["latency"] = percentiles([result[1] for result in success])
+    if config["rate"] > 0:
+        report["latency_with_queueing"] = percentiles([result[2] for result in success])
+    report["questions_per_request"] = OrderedDict(sorted(Counter(
+                                        [result[3] for result in results]).items()))
+    report["server_batch_sizes"] = OrderedDict(sorted(batch_sizes.items()))
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', type=str, default="http://127.0.0.1:8011/classifynet",
+                        help='classifynet endpoint')
+    parser.add_argument('--data_path', type=str,
+                        help='question corpus, one per line, or a .jsonl request log')
+    parser.add_argument('--questions_per_request', type=int, default=1,
+                        help='questions grouped into one request for a plain corpus')
+    parser.add_argument('--num_requests', type=int, default=0,
+                        help='requests to send, default one pass over the data')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent clients')
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help='open loop arrival rate in requests/sec, 0 for closed loop')
+    parser.add_argument('--timeout', type=float, default=30.0, help='request timeout in seconds')
+    parser.add_argument('--seed', type=int, default=1234, help='random seed')
+    parser.add_argument('--output', type=str, default=None, help='json output path')
+
+    args, unparsed = parser.parse_known_args()
+    config = vars(args)
+    np.random.seed(args.seed)
+
+    report = json.dumps(run(config), indent=4)
+    if args.output:
+        with open(args.output, "w") as fwobj:
+            fwobj.write(report)
+    print(report)
@@ -0,0 +1,126 @@
+import pickle as pkl
+import tensorflow as tf
+import numpy as np
+import time, json
+import argparse
+
+import sys,os
+
+sys.path.append("..")
+
+from bin.eval import Eval, cut_tool, data_cleaner_api
+from data import data_utils
+
+def prune(config):
+    model_name = config["model_name"]
+    eval_api = Eval(config)
+    model_config = {
+        "model_name":model_name,
+        "model_str":config["model_str"],
+        "model_dir":config["model_dir"]
+    }
+    eval_api.model = {model_name:eval_api.init_model(model_config)}
+
+    [train_corpus, _, _] = data_utils.read_classify_data(config["train_path"],
+                                        "train", cut_tool, data_cleaner_api, "tab")
+    [log_corpus, _, _] = data_utils.read_classify_data(config["log_path"],
+                                        "infer", cut_tool, data_cleaner_api, "tab")
+
+    # ---- vocab rows seen in training data or production queries ----
+    used_ids = data_utils.token_usage(train_corpus+log_corpus, eval_api.token2id)
+    pruned_info, token_index = data_utils.prune_vocab(eval_api.embedding_info, used_ids)
+
+    # ---- output classes the deployed model actually predicts ----
+    [_, log_probs, _] = eval_api.model_accuracy(model_name, log_corpus,
+                                            [0]*len(log_corpus))
+    label_index = sorted(set(np.argmax(log_probs, axis=-1).tolist()) |
+                        set(config.get("keep_labels", [])))
+    pruned_info["label_index"] = label_index
+    pruned_info["num_classes"] = int(log_probs.shape[-1])
+
+    if not os.path.exists(config["output_dir"]):
+        os.makedirs(config["output_dir"])
+    vocab_path = os.path.join(config["output_dir"], "emb_mat.pkl")
+    pkl.dump(pruned_info, open(vocab_path, "wb"), protocol=2)
+
+    with open(os.path.join(config["model_config_path"], model_name+".json"), "r") as frobj:
+        model_flags = json.load(frobj)
+    model_flags["num_classes"] = len(label_index)
+    with open(os.path.join(config["output_dir"], model_name+".json"), "w") as fwobj:
+        json.dump(model_flags, fwobj, indent=4)
+
+    pruned_config = dict(config)
+    pruned_config["vocab_path"] = vocab_path
+    pruned_config["model_config_path"] = config["output_dir"]
+    pruned_api = Eval(pruned_config)
+
+    pruned_model = pruned_api.build_model(model_config)
+    missing = pruned_model.prune_model(config["model_dir"], config["model_str"],
+                        token_index, label_index,
+                        len(eval_api.token2id), len(eval_api.extral_symbol),
+                        len(eval_api.embedding_info.get("appended_symbol", [])))
+    pruned_model.save_model(config["output_dir"], config["output_str"])
+    pruned_api.model = {model_name:pruned_model}
+
+    report = {
+        "vocab_size":[len(eval_api.token2id), len(pruned_info["token2id"])],
+        "num_classes":[int(log_probs.shape[-1]), len(label_index)],
+        "label_index":label_index,
+        "missing":missing,
+        "vocab_path":vocab_path,
+        "checkpoint":os.path.join(config["output_dir"], config["output_str"]+".ckpt")
+    }
+
+    if config.get("dev_path", None):
+        [dev_corpus, dev_label, _] = data_utils.read_classify_data(config["dev_path"],
+                                        "test", cut_tool, data_cleaner_api, "tab")
+
+        # the pruned Eval maps its outputs back to the original class ids
+        [acc, probs, _] = eval_api.model_accuracy(model_name, dev_corpus, dev_label)
+        [pruned_acc, pruned_probs, _] = pruned_api.model_accuracy(model_name,
+                                            dev_corpus, dev_label)
+        pruned_preds = np.argmax(pruned_probs, axis=-1)
+        changed = np.where(pruned_preds != np.argmax(probs, axis=-1))[0]
+
+        report["accuracy"] = float(acc)
+        report["pruned_accuracy"] = float(pruned_acc)
+        report["label_agreement"] = 1.0 - len(changed) / float(max(len(pruned_preds), 1))
+        report["changed_predictions"] = changed.tolist()
+
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_config', type=str, help='model config path')
+    parser.add_argument('--config_prefix', type=str, help='config path')
+    parser.add_argument('--vocab_path', type=str, help='vocab_path')
+    parser.add_argument('--model_name', type=str, help='model name')
+    parser.add_argument('--model_dir', type=str, help='model path')
+    parser.add_argument('--model_str', type=str, help='checkpoint name')
+    parser.add_argument('--train_path', type=str, help='train data path')
+    parser.add_argument('--log_path', type=str, help='production query log, one query per line')
+    parser.add_argument('--dev_path', type=str, default=None,
+                        help='validation data used to check predictions are unchanged')
+    parser.add_argument('--keep_labels', type=str, default="",
+                        help='comma separated labels kept even if never predicted')
+    parser.add_argument('--output_dir', type=str, help='pruned vocab, config and checkpoint path')
+    parser.add_argument('--output_str', type=str, default=None,
+                        help='pruned checkpoint name, default model_str+"_pruned"')
+
+    args, unparsed = parser.parse_known_args()
+
+    config = {}
+    config["model_config"] = args.model_config
+    config["model_config_path"] = args.config_prefix
+    config["vocab_path"] = args.vocab_path
+    config["model_name"] = args.model_name
+    config["model_dir"] = args.model_dir
+    config["model_str"] = args.model_str
+    config["train_path"] = args.train_path
+    config["log_path"] = args.log_path
+    config["dev_path"] = args.dev_path
+    config["keep_labels"] = [int(label) for label in args.keep_labels.split(",") if label]
+    config["output_dir"] = args.output_dir
+    config["output_str"] = args.output_str or args.model_str+"_pruned"
+
+    print(json.dumps(prune(config), indent=4))
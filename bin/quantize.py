@@ -0,0 +1,95 @@
+import tensorflow as tf
+import numpy as np
+import time, json
+import argparse
+
+import sys,os
+
+sys.path.append("..")
+
+from bin.eval import Eval, cut_tool, data_cleaner_api
+from data import data_utils
+from model.utils.quantization import quantization_utils
+
+def quantize(config):
+    eval_api = Eval(config)
+
+    float_config = {
+        "model_name":config["model_name"],
+        "model_str":config["model_str"],
+        "model_dir":config["model_dir"]
+    }
+    int8_config = dict(float_config)
+    int8_config["int8_inference"] = True
+
+    int8_model = eval_api.build_model(int8_config)
+    quantized, missing = int8_model.quantize_model(config["model_dir"],
+                                                config["model_str"])
+    int8_model.save_model(config["model_dir"], config["output_str"])
+
+    with int8_model.graph.as_default():
+        int8_bytes = quantization_utils.variable_bytes(tf.global_variables())
+
+    report = {
+        "quantized":quantized,
+        "missing":missing,
+        "int8_checkpoint":os.path.join(config["model_dir"], config["output_str"]+".ckpt"),
+        "int8_bytes":int8_bytes
+    }
+
+    if config.get("eval_path", None):
+        # score the written checkpoint, loaded the way it will be served
+        int8_config["model_str"] = config["output_str"]
+        int8_model = eval_api.init_model(int8_config)
+        float_model = eval_api.init_model(float_config)
+        with float_model.graph.as_default():
+            report["float_bytes"] = quantization_utils.variable_bytes(tf.global_variables())
+
+        eval_api.model = {"float":float_model, "int8":int8_model}
+        [corpus, gold_label, _] = data_utils.read_classify_data(config["eval_path"],
+                                    "test",
+                                    cut_tool,
+                                    data_cleaner_api,
+                                    "tab")
+        [float_acc, float_probs, float_time] = eval_api.model_accuracy("float",
+                                                corpus, gold_label)
+        [int8_acc, int8_probs, int8_time] = eval_api.model_accuracy("int8",
+                                                corpus, gold_label)
+
+        report["float_accuracy"] = float(float_acc)
+        report["int8_accuracy"] = float(int8_acc)
+        report["accuracy_delta"] = float(int8_acc - float_acc)
+        report["label_agreement"] = float(np.mean(np.argmax(float_probs, axis=-1) ==
+                                            np.argmax(int8_probs, axis=-1)))
+        report["max_prob_diff"] = float(np.max(np.abs(float_probs - int8_probs)))
+        report["float_time"] = float_time
+        report["int8_time"] = int8_time
+
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_config', type=str, help='model config path')
+    parser.add_argument('--config_prefix', type=str, help='config path')
+    parser.add_argument('--vocab_path', type=str, help='vocab_path')
+    parser.add_argument('--model_name', type=str, help='model name')
+    parser.add_argument('--model_dir', type=str, help='model path')
+    parser.add_argument('--model_str', type=str, help='float checkpoint name')
+    parser.add_argument('--output_str', type=str, default=None,
+                        help='int8 checkpoint name, default model_str+"_int8"')
+    parser.add_argument('--eval_path', type=str, default=None,
+                        help='held-out file used to report the accuracy delta')
+
+    args, unparsed = parser.parse_known_args()
+
+    config = {}
+    config["model_config"] = args.model_config
+    config["model_config_path"] = args.config_prefix
+    config["vocab_path"] = args.vocab_path
+    config["model_name"] = args.model_name
+    config["model_dir"] = args.model_dir
+    config["model_str"] = args.model_str
+    config["output_str"] = args.output_str or args.model_str+"_int8"
+    config["eval_path"] = args.eval_path
+
+    print(json.dumps(quantize(config), indent=4))
@@ -0,0 +1,190 @@
+import tensorflow as tf
+import numpy as np
+import time, json
+import codecs
+import argparse
+
+import sys,os
+
+sys.path.append("..")
+
+from bin.eval import Eval, cut_tool, data_cleaner_api
+from data import data_utils
+from data import get_batch_data
+from utils import logger_utils
+from collections import OrderedDict
+
+STAGES = ["clean", "segment", "encode", "pad", "sess_run"]
+
+def read_line_batches(data_path, batch_size):
+    """stream raw lines so files of any size never sit in memory"""
+    with codecs.open(data_path, "r", "utf-8") as frobj:
+        batch = []
+        for line in frobj:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            batch.append(line)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if len(batch) >= 1:
+            yield batch
+
+def parse_line(line, split_type="tab"):
+    if split_type == "blank":
+        content = line.split()
+    else:
+        content = line.split("\t")
+    label = None
+    if len(content) >= 2:
+        try:
+            label = int(content[1])
+        except ValueError:
+            label = None
+    return content[0], label
+
+def class_metrics(confusion):
+    """per-class precision/recall/f1 from a [gold, pred] count matrix"""
+    metrics = OrderedDict()
+    for label in range(confusion.shape[0]):
+        tp = float(confusion[label, label])
+        pred_cnt = float(np.sum(confusion[:, label]))
+        gold_cnt = float(np.sum(confusion[label, :]))
+        precision = tp / pred_cnt if pred_cnt > 0 else 0.0
+        recall = tp / gold_cnt if gold_cnt > 0 else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+        metrics[str(label)] = {"precision":precision, "recall":recall,
+                                "f1":f1, "support":int(gold_cnt)}
+    return metrics
+
+def stream_eval(config):
+    logger = logger_utils.get_logger(config["log_path"])
+
+    eval_api = Eval(config)
+    model_name = config["model_name"]
+    model = eval_api.init_model({"model_name":model_name,
+                                "model_str":config["model_str"],
+                                "model_dir":config["model_dir"]})
+    token2id = eval_api.token2id
+    # a class-pruned model is scored in the original class ids
+    num_classes = int(eval_api.embedding_info.get("num_classes", model.num_classes))
+
+    stage_time = OrderedDict([(stage, 0.0) for stage in STAGES])
+    confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+    examples, empty, failed_batches, failed_examples = 0, 0, 0, 0
+    # labels outside [0, num_classes) are counted, not scored
+    invalid_labels = 0
+
+    start = time.time()
+    with codecs.open(config["output_path"], "w", "utf-8") as fwobj:
+        for batch_index, lines in enumerate(read_line_batches(config["test_path"],
+                                                    config["batch_size"])):
+            examples += len(lines)
+            try:
+                stage_start = time.time()
+                parsed = [parse_line(line, config["split_type"]) for line in lines]
+                sents = [data_cleaner_api.clean(sent) for sent, _ in parsed]
+                stage_time["clean"] += time.time() - stage_start
+
+                stage_start = time.time()
+                sents = [cut_tool.cut(sent) for sent in sents]
+                stage_time["segment"] += time.time() - stage_start
+
+                stage_start = time.time()
+                sent_ids = [data_utils.utt2id(sent, token2id, "<PAD>") for sent in sents]
+                stage_time["encode"] += time.time() - stage_start
+
+                # rows without any token are reported, not fed to the model
+                stage_start = time.time()
+                valid = [index for index, ids in enumerate(sent_ids) if len(ids) >= 1]
+                empty += len(lines) - len(valid)
+                preds = np.zeros((len(lines), num_classes), dtype=np.float32)
+                if len(valid) >= 1:
+                    sent_token = np.asarray(get_batch_data.pad_id_lst(
+                                    [sent_ids[index] for index in valid])).astype(np.int32)
+                    stage_time["pad"] += time.time() - stage_start
+
+                    stage_start = time.time()
+                    [logits, pred_probs, _] = model.infer([sent_token,
+                                                np.zeros(len(valid), dtype=np.int32)],
+                                                mode="infer", is_training=False)
+                    stage_time["sess_run"] += time.time() - stage_start
+                    preds[valid] = data_utils.restore_pruned_classes(pred_probs,
+                                                    eval_api.embedding_info)
+                else:
+                    stage_time["pad"] += time.time() - stage_start
+            except Exception as e:
+                failed_batches += 1
+                failed_examples += len(lines)
+                logger.error("batch\t{}\tfailed\t{}\tfirst line\t{}".format(batch_index,
+                                                    repr(e), lines[0]))
+                continue
+
+            valid_set = set(valid)
+            for index, (sent, label) in enumerate(parsed):
+                pred = int(np.argmax(preds[index])) if index in valid_set else -1
+                if label is not None and not 0 <= label < num_classes:
+                    invalid_labels += 1
+                elif label is not None and pred >= 0:
+                    confusion[label, pred] += 1
+                fwobj.write(u"{}\t{}\t{}\t{}\n".format(sent,
+                            "" if label is None else label, pred,
+                            " ".join(["%.6f" % prob for prob in preds[index]])))
+            fwobj.flush()
+
+            if batch_index % config["log_every"] == 0:
+                duration = time.time() - start
+                logger.info("batch\t{}\texamples\t{}\texamples/sec\t{}".format(batch_index,
+                                            examples, examples / max(duration, 1e-8)))
+
+    duration = time.time() - start
+    report = OrderedDict()
+    report["examples"] = examples
+    report["empty_examples"] = empty
+    report["failed_batches"] = failed_batches
+    report["failed_examples"] = failed_examples
+    report["invalid_labels"] = invalid_labels
+    report["duration"] = duration
+    report["examples_per_sec"] = examples / max(duration, 1e-8)
+    report["stage_time"] = stage_time
+    report["stage_ms_per_example"] = OrderedDict([(stage, 1000.0 * stage_time[stage] / max(examples, 1))
+                                                for stage in stage_time])
+    if np.sum(confusion) > 0:
+        report["accuracy"] = float(np.trace(confusion)) / float(np.sum(confusion))
+        report["per_class"] = class_metrics(confusion)
+    logger.info(json.dumps(report))
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_config', type=str, help='model config path')
+    parser.add_argument('--config_prefix', type=str, help='config path')
+    parser.add_argument('--vocab_path', type=str, help='vocab_path')
+    parser.add_argument('--model_name', type=str, help='model name')
+    parser.add_argument('--model_dir', type=str, help='model path')
+    parser.add_argument('--model_str', type=str, help='checkpoint name')
+    parser.add_argument('--test_path', type=str, help='test data path, text\\tlabel or text per line')
+    parser.add_argument('--output_path', type=str, help='prediction output path')
+    parser.add_argument('--log_path', type=str, default="stream_eval.log", help='log path')
+    parser.add_argument('--batch_size', type=int, default=100, help='batch size')
+    parser.add_argument('--split_type', type=str, default="tab", help='tab or blank')
+    parser.add_argument('--log_every', type=int, default=100, help='progress log interval in batches')
+
+    args, unparsed = parser.parse_known_args()
+
+    config = {}
+    config["model_config"] = args.model_config
+    config["model_config_path"] = args.config_prefix
+    config["vocab_path"] = args.vocab_path
+    config["model_name"] = args.model_name
+    config["model_dir"] = args.model_dir
+    config["model_str"] = args.model_str
+    config["test_path"] = args.test_path
+    config["output_path"] = args.output_path
+    config["log_path"] = args.log_path
+    config["batch_size"] = args.batch_size
+    config["split_type"] = args.split_type
+    config["log_every"] = args.log_every
+
+    print(json.dumps(stream_eval(config), indent=4))
@@ -30,19 +30,18 @@ cut_tool = data_utils.cut_tool_api()
 
 def prepare_data(data_path, w2v_path, vocab_path, make_vocab=True):
 
-    [anchor, 
-    check, 
-    label, 
-    anchor_len, 
-    check_len] = data_utils.read_data(data_path, 
+    [sent_table, 
+    anchor_index, 
+    check_index, 
+    label] = data_utils.read_pair_data(data_path, 
                     "train", 
                     cut_tool, 
                     data_clearner_api,
                     "tab")
 
     if make_vocab:
-        dic = data_utils.make_dic(anchor+check)
-        data_utils.read_pretrained_embedding(w2v_path, dic, vocab_path, min_freq=3)
+        corpus = [sent_table[t] for t in anchor_index+check_index]
+        data_utils.build_vocab(corpus, w2v_path, vocab_path, min_freq=3)
 
     if sys.version_info < (3, ):
         embedding_info = pkl.load(open(os.path.join(vocab_path), "rb"))
@@ -50,7 +49,7 @@ def prepare_data(data_path, w2v_path, vocab_path, make_vocab=True):
         embedding_info = pkl.load(open(os.path.join(vocab_path), "rb"), 
                                 encoding="iso-8859-1")
 
-    return [anchor, check, label, anchor_len, check_len, embedding_info]
+    return [sent_table, anchor_index, check_index, label, embedding_info]
 
 def test(config):
     model_config_path = config["model_config_path"]
@@ -77,11 +76,10 @@ def test(config):
     if not os.path.exists(os.path.join(model_dir, model_name, "models")):
         os.mkdir(os.path.join(model_dir, model_name, "models"))
 
-    [test_anchor, 
-    test_check, 
+    [test_sent_table, 
+    test_anchor_index, 
+    test_check_index, 
     test_label, 
-    test_anchor_len, 
-    test_check_len, 
     embedding_info] = prepare_data(test_path, 
                         w2v_path, vocab_path,
                         make_vocab=False)
@@ -97,6 +95,7 @@ def test(config):
     FLAGS.char_vocab_size = 0
     FLAGS.emb_size = embedding_mat.shape[1]
     FLAGS.extra_symbol = extral_symbol
+    FLAGS.appended_symbol = embedding_info.get("appended_symbol", [])
 
     if FLAGS.scope == "BiMPM":
         model = BiMPM()
@@ -115,13 +114,15 @@ def test(config):
     model.load_model(os.path.join(model_dir, model_name, "models"), 
                     model_str)
 
-    test_data = get_batch_data.get_batches(test_anchor, 
-            test_check, 
+    test_sent_ids = data_utils.encode_sent_table(test_sent_table, token2id)
+    test_data = get_batch_data.get_pair_batches(test_sent_ids, 
+            test_anchor_index, 
+            test_check_index, 
             test_label, FLAGS.batch_size, 
             token2id, is_training=False)
 
     test_loss, test_accuracy = 0, 0
-    cnt = 0
+    cnt, failed_cnt = 0, 0
     for index, corpus in enumerate(test_data):
         anchor, check, label = corpus
         try:
@@ -135,13 +136,15 @@ def test(config):
             test_accuracy += accuracy*anchor.shape[0]
             cnt += anchor.shape[0]
             
-        except:
+        except Exception as e:
+            failed_cnt += 1
+            print("batch {} failed: {}".format(index, repr(e)))
             continue
        
-    test_loss /= float(cnt)
-    test_accuracy /= float(cnt)
+    test_loss /= float(max(cnt, 1))
+    test_accuracy /= float(max(cnt, 1))
 
-    print(test_loss, test_accuracy)
+    print(test_loss, test_accuracy, "failed batches", failed_cnt)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -27,7 +27,8 @@ from collections import OrderedDict
 data_clearner_api = data_clean.DataCleaner({})
 cut_tool = data_utils.cut_tool_api()
 
-def prepare_data(data_path, w2v_path, vocab_path, make_vocab=True):
+def prepare_data(data_path, w2v_path, vocab_path, make_vocab=True, 
+                vocab_update_path=None):
 
     [corpus, 
     corpus_label,
@@ -39,9 +40,18 @@ def prepare_data(data_path, w2v_path, vocab_path, make_vocab=True):
 
     print("======max corpus label======", max(corpus_label))
 
-    if make_vocab:
-        dic = data_utils.make_dic(corpus)
-        data_utils.read_pretrained_embedding(w2v_path, dic, vocab_path, min_freq=3)
+    if vocab_update_path and os.path.exists(vocab_path):
+        # only the newly added data is counted, existing token ids are kept
+        [update_corpus, _, _] = data_utils.read_classify_data(vocab_update_path, 
+                    "train", 
+                    cut_tool, 
+                    data_clearner_api,
+                    "tab")
+        data_utils.build_vocab(update_corpus, w2v_path, vocab_path, 
+                    min_freq=3, incremental=True, 
+                    update_id=os.path.abspath(vocab_update_path))
+    elif make_vocab:
+        data_utils.build_vocab(corpus, w2v_path, vocab_path, min_freq=3)
 
     if sys.version_info < (3, ):
         embedding_info = pkl.load(open(os.path.join(vocab_path), "rb"))
@@ -51,6 +61,63 @@ def prepare_data(data_path, w2v_path, vocab_path, make_vocab=True):
 
     return [corpus, corpus_label, corpus_len, embedding_info]
 
+def get_model(FLAGS):
+    if FLAGS.scope == "ESIM":
+        model = ESIM()
+    elif FLAGS.scope == "BiBLOSA":
+        model = BiBLOSA()
+    elif FLAGS.scope == "BaseTransformer":
+        model = BaseTransformer()
+    elif FLAGS.scope == "UniversalTransformer":
+        model = UniversalTransformer()
+    return model
+
+def prepare_teacher_logits(config, corpus, token2id, embedding_info):
+    """
+    run the teacher checkpoint over the training corpus once and cache
+    its logits, rows follow corpus order
+    """
+    cache_path = config["teacher_cache_path"]
+    if os.path.exists(cache_path):
+        teacher_info = pkl.load(open(cache_path, "rb"))
+        if teacher_info["teacher_model_str"] == config["teacher_model_str"] and \
+                teacher_info["num_examples"] == len(corpus):
+            return teacher_info["logits"]
+
+    FLAGS = namespace_utils.load_namespace(config["teacher_model_config_path"])
+    embedding_mat = embedding_info["embedding_matrix"]
+    FLAGS.token_emb_mat = embedding_mat
+    FLAGS.char_emb_mat = 0
+    FLAGS.vocab_size = embedding_mat.shape[0]
+    FLAGS.char_vocab_size = 0
+    FLAGS.emb_size = embedding_mat.shape[1]
+    FLAGS.extra_symbol = embedding_info["extra_symbol"]
+    FLAGS.appended_symbol = embedding_info.get("appended_symbol", [])
+
+    teacher = get_model(FLAGS)
+    teacher.build_placeholder(FLAGS)
+    teacher.build_op()
+    teacher.init_step()
+    teacher.load_model(config["teacher_model_dir"], config["teacher_model_str"])
+
+    # batch example indices in place of labels to keep track of dropped empty rows
+    teacher_logits = np.zeros((len(corpus), FLAGS.num_classes), dtype=np.float32)
+    teacher_data = get_batch_data.get_classify_batch(corpus, 
+                    np.arange(len(corpus)), FLAGS.batch_size, 
+                    token2id, is_training=False)
+    for anchor, index in teacher_data:
+        if anchor.shape[0] == 0:
+            continue
+        [logits, preds, repres] = teacher.infer([anchor, np.zeros_like(index)], 
+                                        mode="infer", is_training=False)
+        teacher_logits[index] = logits
+    teacher.sess.close()
+
+    pkl.dump({"teacher_model_str":config["teacher_model_str"],
+            "num_examples":len(corpus),
+            "logits":teacher_logits}, open(cache_path, "wb"))
+    return teacher_logits
+
 def train(config):
     model_config_path = config["model_config_path"]
     FLAGS = namespace_utils.load_namespace(model_config_path)
@@ -84,7 +151,8 @@ def train(config):
     train_corpus_len, 
     embedding_info] = prepare_data(train_path, 
                         w2v_path, vocab_path,
-                        make_vocab=True)
+                        make_vocab=True,
+                        vocab_update_path=config.get("vocab_update_path", None))
 
     token2id = embedding_info["token2id"]
     id2token = embedding_info["id2token"]
@@ -97,40 +165,58 @@ def train(config):
     FLAGS.char_vocab_size = 0
     FLAGS.emb_size = embedding_mat.shape[1]
     FLAGS.extra_symbol = extral_symbol
+    FLAGS.appended_symbol = embedding_info.get("appended_symbol", [])
 
-    if FLAGS.scope == "ESIM":
-        model = ESIM()
-    elif FLAGS.scope == "BiBLOSA":
-        model = BiBLOSA()
-    elif FLAGS.scope == "BaseTransformer":
-        model = BaseTransformer()
-    elif FLAGS.scope == "UniversalTransformer":
-        model = UniversalTransformer()
+    teacher_logits = None
+    if config.get("teacher_model_str", None):
+        teacher_logits = prepare_teacher_logits(config, train_corpus, 
+                                        token2id, embedding_info)
+        # batches carry example indices, looked up in both arrays
+        train_label_array = np.asarray(train_corpus_label).astype(np.int32)
+        FLAGS.distillation = True
+
+    model = get_model(FLAGS)
 
     model.build_placeholder(FLAGS)
     model.build_op()
     model.init_step()
+    if config.get("init_model_str", None):
+        model.warm_start_model(config.get("init_model_dir", None) or 
+                        os.path.join(model_dir, model_name, "models"), 
+                        config["init_model_str"])
 
     best_train_accuracy, best_train_loss = 0, 100
     toleration = 1000
     toleration_cnt = 0
     for epoch in range(FLAGS.max_epochs):
         train_loss, train_accuracy = 0, 0
-        train_data = get_batch_data.get_classify_batch(train_corpus, 
-                    train_corpus_label, FLAGS.batch_size, 
-                    token2id, is_training=True,
-                    if_word_drop=FLAGS.with_word_drop, 
-                    word_drop_rate=FLAGS.word_drop_rate)
+        if teacher_logits is not None:
+            train_data = get_batch_data.get_classify_batch(train_corpus, 
+                        np.arange(len(train_corpus)), FLAGS.batch_size, 
+                        token2id, is_training=True,
+                        if_word_drop=FLAGS.with_word_drop, 
+                        word_drop_rate=FLAGS.word_drop_rate)
+        else:
+            train_data = get_batch_data.get_classify_batch(train_corpus, 
+                        train_corpus_label, FLAGS.batch_size, 
+                        token2id, is_training=True,
+                        if_word_drop=FLAGS.with_word_drop, 
+                        word_drop_rate=FLAGS.word_drop_rate)
 
         nan_data = []
         cnt = 0
         for index, corpus in enumerate(train_data):
             anchor, label = corpus
+            batch_teacher_logits = None
+            if teacher_logits is not None:
+                batch_teacher_logits = teacher_logits[label]
+                label = train_label_array[label]
             try:
                 [loss, _, global_step, 
                 accuracy, preds] = model.step(
                                     [anchor, label], 
-                                    is_training=True)
+                                    is_training=True,
+                                    teacher_logits=batch_teacher_logits)
 
                 train_loss += loss*anchor.shape[0]
                 train_accuracy += accuracy*anchor.shape[0]
@@ -178,6 +264,20 @@ if __name__ == "__main__":
     parser.add_argument('--dev_path', type=str, help='dev data path')
     parser.add_argument('--w2v_path', type=str, help='pretrained w2v path')
     parser.add_argument('--vocab_path', type=str, help='vocab_path')
+    parser.add_argument('--vocab_update_path', type=str, default=None, 
+                        help='new train data used to grow an existing vocab')
+    parser.add_argument('--init_model_dir', type=str, default=None, 
+                        help='warm start model path')
+    parser.add_argument('--init_model_str', type=str, default=None, 
+                        help='warm start model name')
+    parser.add_argument('--teacher_model', type=str, default=None, 
+                        help='teacher model name for distillation')
+    parser.add_argument('--teacher_model_dir', type=str, default=None, 
+                        help='teacher model path')
+    parser.add_argument('--teacher_model_str', type=str, default=None, 
+                        help='teacher checkpoint name, enables distillation')
+    parser.add_argument('--teacher_cache_path', type=str, default=None, 
+                        help='cached teacher logits path')
 
     args, unparsed = parser.parse_known_args()
     model_config = args.model_config
@@ -195,6 +295,16 @@ if __name__ == "__main__":
     config["w2v_path"] = args.w2v_path
     config["vocab_path"] = args.vocab_path
     config["dev_path"] = args.dev_path
+    config["vocab_update_path"] = args.vocab_update_path
+    config["init_model_dir"] = args.init_model_dir
+    config["init_model_str"] = args.init_model_str
+    if args.teacher_model_str:
+        config["teacher_model_config_path"] = os.path.join(args.config_prefix, 
+                                model_config.get(args.teacher_model, "esim"))
+        config["teacher_model_dir"] = args.teacher_model_dir
+        config["teacher_model_str"] = args.teacher_model_str
+        config["teacher_cache_path"] = args.teacher_cache_path or \
+                os.path.join(args.model_dir, args.teacher_model_str+"_logits.pkl")
     
     train(config)
 
@@ -1,6 +1,7 @@
 import numpy as np
 import pickle as pkl
 import codecs, json, os, sys, jieba, re
+import multiprocessing
 from jieba import Tokenizer
 from jieba.posseg import POSTokenizer
 from collections import OrderedDict, Counter
@@ -63,11 +64,69 @@ def make_dic(sent_list):
                 dic[token] = 1
     return dic
 
-def read_pretrained_embedding(embedding_path, dic, vocab_path, min_freq=3):
+def _count_shard(sent_list):
+    return make_dic(sent_list)
+
+def make_dic_parallel(sent_list, num_workers=None, min_shard_size=10000):
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    if num_workers <= 1 or len(sent_list) < 2 * min_shard_size:
+        return make_dic(sent_list)
+
+    num_shards = min(num_workers, int(len(sent_list) / min_shard_size))
+    shard_size = int(np.ceil(len(sent_list) / float(num_shards)))
+    shards = [sent_list[start:start+shard_size] 
+                for start in range(0, len(sent_list), shard_size)]
+
+    pool = multiprocessing.Pool(num_shards)
+    try:
+        shard_dics = pool.map(_count_shard, shards)
+    finally:
+        pool.close()
+        pool.join()
+
+    # merge in shard order so token order matches the serial make_dic
+    dic = OrderedDict()
+    token_counter = Counter()
+    for shard_dic in shard_dics:
+        for token in shard_dic:
+            if token not in dic:
+                dic[token] = 0
+        token_counter.update(shard_dic)
+    for token in dic:
+        dic[token] = token_counter[token]
+    return dic
+
+def load_pretrained_w2v(embedding_path):
     if sys.version_info < (3, ):
         w2v = pkl.load(open(embedding_path, "rb"))
     else:
         w2v = pkl.load(open(embedding_path, "rb"), encoding="iso-8859-1")
+    return w2v
+
+def gather_pretrained_embedding(w2v, id2word, word_mat):
+    hit_ids, hit_tokens = [], []
+    for word_id in id2word:
+        token = id2word[word_id]
+        if token in w2v:
+            hit_ids.append(word_id)
+            hit_tokens.append(token)
+    if len(hit_ids) >= 1:
+        pretrained_table = np.asarray([w2v[token] for token in hit_tokens], 
+                                    dtype=np.float32)
+        word_mat[np.asarray(hit_ids, dtype=np.int64)] = pretrained_table
+    return word_mat
+
+def vocab_statistics(dic, min_freq, pretrained_token, unk_token):
+    return {"token_freq":dict(dic),
+            "min_freq":min_freq,
+            "num_tokens":sum(dic.values()),
+            "num_types":len(dic),
+            "num_pretrained":len(pretrained_token),
+            "num_unk":len(unk_token)}
+
+def read_pretrained_embedding(embedding_path, dic, vocab_path, min_freq=3):
+    w2v = load_pretrained_w2v(embedding_path)
 
     word2id, id2word = OrderedDict(), OrderedDict()
     pad_unk = ["<PAD>", "<UNK>", "<S>", "</S>"]
@@ -99,14 +158,101 @@ def read_pretrained_embedding(embedding_path, dic, vocab_path, min_freq=3):
     embed_dim = w2v[list(w2v.keys())[0]].shape[0]
     word_mat = np.random.uniform(low=-0.01, high=0.01, 
                                 size=(len(word2id), embed_dim)).astype(np.float32)
-    for word_id in range(len(word2id)):
-        token = id2word[word_id]
-        if token in w2v:
-            word_mat[word_id] = w2v[token]
+    word_mat = gather_pretrained_embedding(w2v, id2word, word_mat)
 
     pkl.dump({"token2id":word2id, "id2token":id2word, 
             "embedding_matrix":word_mat,
-            "extra_symbol":pad_unk+unk_token}, open(vocab_path, "wb"), protocol=2)
+            "extra_symbol":pad_unk+unk_token,
+            "vocab_stats":vocab_statistics(dic, min_freq, 
+                                    pretrained_token, unk_token)}, 
+            open(vocab_path, "wb"), protocol=2)
+
+def update_pretrained_embedding(embedding_path, dic, vocab_path, 
+                            min_freq=None, new_vocab_path=None, update_id=None):
+    """
+    append the tokens of dic reaching min_freq to an existing vocab, old ids
+    are kept. appended rows are listed in appended_symbol so the model
+    trains them. an update_id already in applied_updates is skipped so its
+    token counts are not added twice
+    """
+    if sys.version_info < (3, ):
+        embedding_info = pkl.load(open(vocab_path, "rb"))
+    else:
+        embedding_info = pkl.load(open(vocab_path, "rb"), encoding="iso-8859-1")
+
+    applied_updates = embedding_info.get("applied_updates", [])
+    if update_id is not None and update_id in applied_updates:
+        print("vocab update {} already applied to {}".format(update_id, vocab_path))
+        return []
+
+    word2id = embedding_info["token2id"]
+    id2word = embedding_info["id2token"]
+    word_mat = embedding_info["embedding_matrix"]
+    vocab_stats = embedding_info.get("vocab_stats", {})
+
+    # vocab pickles built before vocab_stats existed only know their own tokens
+    token_freq = Counter(vocab_stats.get("token_freq", {}))
+    if min_freq is None:
+        min_freq = vocab_stats.get("min_freq", 3)
+    token_freq.update(dic)
+
+    new_token = []
+    for token in dic:
+        if token not in word2id and token_freq[token] >= min_freq:
+            new_token.append(token)
+
+    if len(new_token) >= 1:
+        w2v = load_pretrained_w2v(embedding_path)
+        word_id = word_mat.shape[0]
+        new_id2word = OrderedDict()
+        for token in new_token:
+            word2id[token] = word_id
+            id2word[word_id] = token
+            new_id2word[word_id] = token
+            word_id += 1
+
+        # new rows are appended after the existing ones so old ids stay stable,
+        # tokens missing from w2v start near the mean pretrained vector
+        num_extra = len(embedding_info["extra_symbol"])
+        if word_mat.shape[0] > num_extra:
+            mean_vec = np.mean(word_mat[num_extra:], axis=0)
+        else:
+            mean_vec = np.mean(np.asarray(list(w2v.values()), dtype=np.float32), axis=0)
+        new_mat = (mean_vec + np.random.uniform(low=-0.01, high=0.01, 
+                            size=(word_id, word_mat.shape[1]))).astype(np.float32)
+        new_mat[:word_mat.shape[0]] = word_mat
+        word_mat = gather_pretrained_embedding(w2v, new_id2word, new_mat)
+    else:
+        w2v = {}
+
+    num_pretrained = len([token for token in new_token if token in w2v])
+    vocab_stats = {"token_freq":dict(token_freq),
+            "min_freq":min_freq,
+            "num_tokens":sum(token_freq.values()),
+            "num_types":len(token_freq),
+            "num_pretrained":vocab_stats.get("num_pretrained", 0)+num_pretrained,
+            "num_unk":vocab_stats.get("num_unk", 0)+len(new_token)-num_pretrained,
+            "num_appended":vocab_stats.get("num_appended", 0)+len(new_token)}
+
+    embedding_info["token2id"] = word2id
+    embedding_info["id2token"] = id2word
+    embedding_info["embedding_matrix"] = word_mat
+    embedding_info["vocab_stats"] = vocab_stats
+    embedding_info["appended_symbol"] = embedding_info.get("appended_symbol", []) + new_token
+    if update_id is not None:
+        embedding_info["applied_updates"] = applied_updates + [update_id]
+
+    pkl.dump(embedding_info, open(new_vocab_path or vocab_path, "wb"), protocol=2)
+    return new_token
+
+def build_vocab(sent_list, embedding_path, vocab_path, 
+                min_freq=3, num_workers=None, incremental=False, update_id=None):
+    dic = make_dic_parallel(sent_list, num_workers=num_workers)
+    if incremental and os.path.exists(vocab_path):
+        update_pretrained_embedding(embedding_path, dic, vocab_path, 
+                                min_freq=min_freq, update_id=update_id)
+    else:
+        read_pretrained_embedding(embedding_path, dic, vocab_path, min_freq=min_freq)
 
 def random_initialize_embedding(dic, vocab_path, min_freq=3, embed_dim=300):
     word2id, id2word = OrderedDict(), OrderedDict()
@@ -219,6 +365,102 @@ def read_data(data_path, mode, word_cut_api, data_cleaner_api, split_type="blank
                     check_len.append(len(sent2))
         return [corpus_anchor, corpus_check, gold_label, anchor_len, check_len]
 
+def read_pair_data(data_path, mode, word_cut_api, data_cleaner_api, split_type="blank"):
+    """
+    like read_data, but every distinct sentence is cleaned and cut only once;
+    pairs are returned as indices into the shared sentence table
+    """
+    with codecs.open(data_path, "r", "utf-8") as frobj:
+        lines = frobj.read().splitlines()
+        sent2index = {}
+        sent_table = []
+        anchor_index = []
+        check_index = []
+        gold_label = []
+
+        def get_index(sent):
+            if sent not in sent2index:
+                row = word_cut_api.cut(data_cleaner_api.clean(sent))
+                sent2index[sent] = len(sent_table)
+                sent_table.append(row)
+            return sent2index[sent]
+
+        for line in lines:
+            if split_type == "blank":
+                content = line.split()
+            elif split_type == "tab":
+                content = line.split("\t")
+            if mode == "train" or mode == "test":
+                if len(content) >= 3:
+                    try:
+                        label = int(content[2])
+                        if label == 1 or label == 0:
+                            anchor = get_index(content[0])
+                            check = get_index(content[1])
+                            anchor_index.append(anchor)
+                            check_index.append(check)
+                            gold_label.append(label)
+                        else:
+                            continue
+                    except:
+                        continue
+            else:
+                if len(content) >= 2:
+                    anchor = get_index(content[0])
+                    check = get_index(content[1])
+                    anchor_index.append(anchor)
+                    check_index.append(check)
+        return [sent_table, anchor_index, check_index, gold_label]
+
+def encode_sent_table(sent_table, token2id, start_token=None, end_token=None):
+    return [utt2id(utt, token2id, "<PAD>", start_token, end_token) for utt in sent_table]
+
+def token_usage(sent_list, token2id):
+    used_ids = set()
+    for utt in sent_list:
+        used_ids.update(utt2id(utt, token2id, "<PAD>"))
+    return used_ids
+
+def prune_vocab(embedding_info, used_ids):
+    """
+    keep the pad/unk/start/end symbols and the used token ids, old ids
+    keep their relative order so trainable extra symbols still come first.
+    return the pruned bundle and the kept old ids in new-id order
+    """
+    id2token = embedding_info["id2token"]
+    extra_symbol = embedding_info["extra_symbol"]
+    keep_ids = sorted(set(range(4)) | set(used_ids))
+
+    word2id, id2word = OrderedDict(), OrderedDict()
+    for word_id, old_id in enumerate(keep_ids):
+        word2id[id2token[old_id]] = word_id
+        id2word[word_id] = id2token[old_id]
+
+    pruned_info = dict(embedding_info)
+    pruned_info["token2id"] = word2id
+    pruned_info["id2token"] = id2word
+    pruned_info["embedding_matrix"] = embedding_info["embedding_matrix"][keep_ids]
+    pruned_info["extra_symbol"] = [id2token[old_id] for old_id in keep_ids 
+                                    if old_id < len(extra_symbol)]
+    if "appended_symbol" in embedding_info:
+        appended_start = len(id2token) - len(embedding_info["appended_symbol"])
+        pruned_info["appended_symbol"] = [id2token[old_id] for old_id in keep_ids 
+                                    if old_id >= appended_start]
+    return pruned_info, keep_ids
+
+def restore_pruned_classes(probs, embedding_info):
+    """
+    scatter the output columns of a class-pruned model back to the
+    original class ids, pruned classes get probability 0
+    """
+    label_index = embedding_info.get("label_index", None)
+    if label_index is None:
+        return probs
+    num_classes = embedding_info.get("num_classes", max(label_index)+1)
+    restored = np.zeros([probs.shape[0], num_classes], dtype=probs.dtype)
+    restored[:, label_index] = probs
+    return restored
+
 def utt2charid(utt, token2id, max_length, char_limit):
     utt2char_list = np.zeros([max_length, char_limit])
     for i, word in enumerate(utt.split()):
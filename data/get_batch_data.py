@@ -226,4 +226,46 @@ def get_classify_batch(corpus, label, batch_size,
         label_lst = np.asarray(label_lst).astype(np.int32)
         corpus_lst = np.asarray(corpus_lst).astype(np.int32)
 
-        yield corpus_lst, label_lst
\ No newline at end of file
+        yield corpus_lst, label_lst
+
+def pad_id_lst(id_lst, pad_id=0):
+    max_len = max([len(sent_lst) for sent_lst in id_lst])
+    return [sent_lst + [pad_id]*(max_len-len(sent_lst)) for sent_lst in id_lst]
+
+def get_pair_batches(sent_ids, anchor_index, check_index, label, batch_size, 
+                    token2id, is_training=True, 
+                    if_word_drop=None, word_drop_rate=0.8):
+    """
+    sent_ids is the encoded sentence table from data_utils.encode_sent_table;
+    pairs are grouped by anchor+check length so both sides pad tightly
+    """
+    pair_len = np.asarray([len(sent_ids[a]) + len(sent_ids[c]) 
+                    for a, c in zip(anchor_index, check_index)])
+    if is_training:
+        # random tie-break so batches of equal-length pairs differ per epoch
+        sorted_index = np.lexsort((np.random.permutation(len(pair_len)), pair_len))
+    else:
+        sorted_index = np.argsort(pair_len, kind="mergesort")
+
+    batch_start = list(range(0, len(sorted_index), batch_size))
+    if is_training:
+        batch_start = [batch_start[t] for t in np.random.permutation(len(batch_start))]
+
+    pad_id = token2id["<PAD>"]
+    for start_index in batch_start:
+        batch_index = sorted_index[start_index:start_index+batch_size]
+
+        anchor_lst = [sent_ids[anchor_index[t]] for t in batch_index]
+        check_lst = [sent_ids[check_index[t]] for t in batch_index]
+        if if_word_drop:
+            anchor_lst = [drop_word(sent_lst, word_drop_rate) for sent_lst in anchor_lst]
+            check_lst = [drop_word(sent_lst, word_drop_rate) for sent_lst in check_lst]
+
+        anchor_lst = np.asarray(pad_id_lst(anchor_lst, pad_id)).astype(np.int32)
+        check_lst = np.asarray(pad_id_lst(check_lst, pad_id)).astype(np.int32)
+        if len(label) >= 1:
+            label_lst = np.asarray([label[t] for t in batch_index]).astype(np.int32)
+        else:
+            label_lst = []
+
+        yield anchor_lst, check_lst, label_lst
@@ -126,6 +126,22 @@ def softmax_loss(logits, labels, *args, **kargs):
                         labels=labels))
     return losses, tf.nn.softmax(logits)
 
+def distillation_loss(logits, teacher_logits, *args, **kargs):
+    """
+    cross entropy against temperature-softened teacher probabilities,
+    scaled by temperature^2 so its gradient matches the hard loss
+    temperature = 2.0
+    """
+    config = args[0]
+    temperature = config.get("distillation_temperature", 2.0)
+
+    logits = tf.cast(logits, tf.float32)
+    soft_targets = tf.stop_gradient(tf.nn.softmax(
+                        tf.cast(teacher_logits, tf.float32) / temperature))
+    log_probs = tf.nn.log_softmax(logits / temperature)
+    losses = -tf.reduce_sum(soft_targets * log_probs, axis=-1)
+    return tf.reduce_mean(losses) * temperature * temperature, soft_targets
+
 # def softmax_loss_v1(logits, labels, *args, **kargs):
 
 #     logits = tf.cast(logits, tf.float32)
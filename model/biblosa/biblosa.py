@@ -54,7 +54,8 @@ class BiBLOSA(ModelTemplate):
                 self.is_training, 
                 1 - dropout_rate,
                 block_len=self.config.block_len, 
-                hn=self.config.context_lstm_dim)
+                hn=self.config.context_lstm_dim,
+                memory_efficient=self.config.get("memory_efficient_block_attn", False))
 
         return sent_repres
 
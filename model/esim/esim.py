@@ -5,6 +5,7 @@ from model.utils.embed import char_embedding_utils
 from loss import point_wise_loss
 from base.model_template import ModelTemplate
 from model.utils.esim import esim_utils
+from model.utils.pooling import pooling_utils
 from model.utils.slstm import slstm_utils
 from model.utils.biblosa import cnn, nn, context_fusion, general, rnn, self_attn
 
@@ -72,9 +73,14 @@ class ESIM(ModelTemplate):
                 initial_hidden_states = word_emb_proj
                 initial_cell_states = tf.identity(initial_hidden_states)
 
+                if self.config.get("slstm_fused", False):
+                    slstm_cell = slstm_utils.slstm_cell_fused
+                else:
+                    slstm_cell = slstm_utils.slstm_cell
+
                 [new_hidden_states, 
                 new_cell_states, 
-                dummynode_hidden_states] = slstm_utils.slstm_cell(self.config, 
+                dummynode_hidden_states] = slstm_cell(self.config, 
                                     self.config.scope, 
                                     self.config.slstm_hidden_size, 
                                     input_lengths, 
@@ -86,19 +92,10 @@ class ESIM(ModelTemplate):
                 sent_repres = new_hidden_states
                 match_dim = self.config.slstm_hidden_size * 4
 
-            v_attn = self_attn.multi_dimensional_attention(
-                sent_repres, input_mask, 'multi_dim_attn_for_%s' % self.config.scope,
-                1 - dropout_rate, self.is_training, self.config.weight_decay, "relu")
-            
-            mask = tf.expand_dims(input_mask, -1)
-            v_sum = tf.reduce_sum(sent_repres*tf.cast(mask, tf.float32), 1)
-            v_ave = tf.div(v_sum, tf.expand_dims(tf.cast(input_lengths, tf.float32)+EPSILON, -1))
-
-            v_max = tf.reduce_max(qanet_layers.mask_logits(sent_repres, mask), axis=1)
-
-            v_last = esim_utils.last_relevant_output(sent_repres, input_lengths)
-
-            out = tf.concat([v_ave, v_max, v_attn, v_last], axis=-1)
+            out = pooling_utils.multi_pooling(sent_repres, input_mask, 
+                self.config.get("pooling", ["ave", "max", "attn", "last"]), 
+                self.config.scope, 1 - dropout_rate, self.is_training, 
+                self.config.weight_decay, "relu")
 
         return out, match_dim
 
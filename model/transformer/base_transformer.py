@@ -4,6 +4,7 @@ from loss import point_wise_loss
 from base.model_template import ModelTemplate
 from model.utils.transformer import base_transformer_utils
 from model.utils.esim import esim_utils
+from model.utils.pooling import pooling_utils
 from model.utils.slstm import slstm_utils
 from model.utils.biblosa import cnn, nn, context_fusion, general, rnn, self_attn
 
@@ -49,8 +50,6 @@ class BaseTransformer(ModelTemplate):
         input_mask = tf.expand_dims(input_mask, axis=-1) # batch_size x seq_len x 1
         word_emb *= input_mask
 
-        input_length = tf.reduce_sum(input_mask, axis=-1)
-
         word_emb = tf.layers.dense(word_emb, self.config.hidden_size)
     
         with tf.variable_scope(self.config.scope+"_transformer_encoder", 
@@ -62,15 +61,10 @@ class BaseTransformer(ModelTemplate):
                                         losses=None)
 
             input_mask = tf.squeeze(input_mask, axis=-1)
-            v_attn = self_attn.multi_dimensional_attention(
-                encoder_output, input_mask, 'multi_dim_attn_for_%s' % self.config.scope,
-                1 - dropout_rate, self.is_training, self.config.weight_decay, "relu")
-            
-            v_sum = tf.reduce_sum(encoder_output, 1)
-            v_ave = tf.div(v_sum, tf.expand_dims(tf.cast(input_length, tf.float32), -1))
-            v_max = tf.reduce_max(encoder_output, 1)
-
-            out = tf.concat([v_ave, v_max, v_attn], axis=-1)
+            out = pooling_utils.multi_pooling(encoder_output, input_mask, 
+                self.config.get("pooling", ["ave", "max", "attn"]), 
+                self.config.scope, 1 - dropout_rate, self.is_training, 
+                self.config.weight_decay, "relu")
             return out
 
     def build_predictor(self, matched_repres, *args, **kargs):
@@ -3,6 +3,7 @@ from model.utils.embed import char_embedding_utils
 from loss import point_wise_loss
 from base.model_template import ModelTemplate
 from model.utils.transformer import universal_transformer_utils
+from model.utils.pooling import pooling_utils
 from model.utils.biblosa import cnn, nn, context_fusion, general, rnn, self_attn
 
 class UniversalTransformer(ModelTemplate):
@@ -47,11 +48,11 @@ class UniversalTransformer(ModelTemplate):
         input_mask = tf.expand_dims(input_mask, axis=-1) # batch_size x seq_len x 1
         word_emb *= input_mask
 
-        input_length = tf.reduce_sum(input_mask, axis=-1)
         word_emb = tf.layers.dense(word_emb, self.config.hidden_size)
+        self.encoder_input_emb = word_emb
     
         with tf.variable_scope(self.config.scope+"_transformer_encoder", 
-                    reuse=reuse):
+                    reuse=reuse) as self.encoder_scope:
             encoder_output = universal_transformer_utils.universal_transformer_encoder(
                                         word_emb, 
                                         target_space=None, 
@@ -60,15 +61,11 @@ class UniversalTransformer(ModelTemplate):
                                         make_image_summary=False)
 
             input_mask = tf.squeeze(input_mask, axis=-1)
-            v_attn = self_attn.multi_dimensional_attention(
-                encoder_output, input_mask, 'multi_dim_attn_for_%s' % self.config.scope,
-                1 - dropout_rate, self.is_training, self.config.weight_decay, "relu")
-            
-            v_sum = tf.reduce_sum(encoder_output, 1)
-            v_ave = tf.div(v_sum, tf.expand_dims(tf.cast(input_length, tf.float32), -1))
-            v_max = tf.reduce_max(encoder_output, 1)
-
-            out = tf.concat([v_ave, v_max, v_attn], axis=-1)
+            self.encoder_input_mask = input_mask
+            out = pooling_utils.multi_pooling(encoder_output, input_mask, 
+                self.config.get("pooling", ["ave", "max", "attn"]), 
+                self.config.scope, 1 - dropout_rate, self.is_training, 
+                self.config.weight_decay, "relu")
             return out
 
     def build_predictor(self, matched_repres, *args, **kargs):
@@ -87,6 +84,70 @@ class UniversalTransformer(ModelTemplate):
 
         self.pred_probs = tf.nn.softmax(self.logits)
 
+    def build_early_exit(self, *args, **kargs):
+        self.early_exit_threshold = tf.placeholder_with_default(
+                                    float(self.config.get("early_exit_threshold", 0.9)), 
+                                    [], name="early_exit_threshold")
+        root_scope = tf.get_variable_scope()
+
+        def head_fn(encoder_output):
+            with tf.variable_scope(self.encoder_scope, reuse=True):
+                sent_repres = pooling_utils.multi_pooling(encoder_output, self.encoder_input_mask, 
+                    self.config.get("pooling", ["ave", "max", "attn"]), 
+                    self.config.scope, 1.0, self.is_training, 
+                    self.config.weight_decay, "relu")
+            with tf.variable_scope(root_scope, reuse=True):
+                logits = nn.linear([sent_repres], 
+                            self.config.num_classes, 
+                            True, 0., scope= self.scope+'_logits', 
+                            squeeze=False,
+                            wd=0., 
+                            input_keep_prob=1.0,
+                            is_train=self.is_training)
+            return logits
+
+        with tf.variable_scope(self.encoder_scope, reuse=True):
+            [self.early_exit_probs, 
+            self.early_exit_steps] = universal_transformer_utils.universal_transformer_encoder_early_exit(
+                                        self.encoder_input_emb, 
+                                        target_space=None, 
+                                        hparams=self.config, 
+                                        head_fn=head_fn, 
+                                        threshold=self.early_exit_threshold, 
+                                        num_classes=self.num_classes,
+                                        features=None)
+
+            # the head is only trained on final-step states by the main loss,
+            # this trains it on the intermediate states early exit stops at
+            self.early_exit_step_logits = universal_transformer_utils.universal_transformer_encoder_step_logits(
+                                        self.encoder_input_emb, 
+                                        target_space=None, 
+                                        hparams=self.config, 
+                                        head_fn=head_fn, 
+                                        features=None)
+
+    def infer_early_exit(self, batch_samples, threshold=None, *args, **kargs):
+        feed_dict = self.get_feed_dict(batch_samples, *args, **kargs)
+        if threshold is not None:
+            feed_dict[self.early_exit_threshold] = threshold
+        with self.graph.as_default():
+            [pred_probs, steps] = self.sess.run([self.early_exit_probs, 
+                                            self.early_exit_steps], 
+                                            feed_dict=feed_dict)
+        return pred_probs, steps
+
+    def build_early_exit_loss(self, *args, **kargs):
+        """
+        mean cross entropy of the head on the intermediate recurrent steps,
+        so that its confidence there can be compared with the exit threshold
+        """
+        step_losses = [tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(
+                                    labels=self.gold_label, logits=logits))
+                        for logits in self.early_exit_step_logits]
+        if len(step_losses) == 0:
+            return tf.constant(0.0)
+        return tf.add_n(step_losses) / float(len(step_losses))
+
     def build_loss(self, *args, **kargs):
         if self.config.loss == "softmax_loss":
             self.loss, _ = point_wise_loss.softmax_loss(self.logits, self.gold_label, 
@@ -102,6 +163,9 @@ class UniversalTransformer(ModelTemplate):
                                             self.gold_label, self.config, 
                                             *args, **kargs)
             self.loss = self.loss + self.config.center_gamma * self.center_loss
+        if self.config.get("early_exit", False):
+            self.early_exit_loss = self.build_early_exit_loss()
+            self.loss = self.loss + self.config.get("early_exit_loss_weight", 1.0) * self.early_exit_loss
 
     def build_accuracy(self, *args, **kargs):
         self.pred_label = tf.argmax(self.logits, axis=-1)
@@ -119,6 +183,9 @@ class UniversalTransformer(ModelTemplate):
         self.build_predictor(self.sent_repres,
                             reuse = None)
 
+        if self.config.get("early_exit", False):
+            self.build_early_exit()
+
     def get_feed_dict(self, sample_batch, *args, **kargs):
         [sent_token, gold_label] = sample_batch
 
@@ -69,7 +69,8 @@ def context_fusion_layers(
                 block_len = tf.cast(tf.ceil(tf.pow(tf.cast(2 * sl, tf.float32), 1.0 / 3)), tf.int32)
             context_fusion_output = bi_directional_simple_block_attention(
                 rep_tensor, rep_mask, block_len, 'ct_block_attn',
-                keep_prob, is_train, wd, activation_function, hn)
+                keep_prob, is_train, wd, activation_function, hn,
+                kwargs.get('memory_efficient', False))
         elif method == "slstm":
             num_layers = kwargs["config"].num_slstm_layer
             rep_len = tf.reduce_sum(rep_mask, axis=-1)
@@ -120,22 +120,54 @@ def directional_attention_with_dense(
 # ----------------- bi-blosan -----------
 def bi_directional_simple_block_attention(
         rep_tensor, rep_mask, block_len=5, scope=None,
-        keep_prob=1., is_train=None, wd=0., activation='elu', hn=None):
+        keep_prob=1., is_train=None, wd=0., activation='elu', hn=None,
+        memory_efficient=False):
     with tf.variable_scope(scope or 'bi_directional_simple_block_attn'):
 
         fw_attn_res = simple_block_attention(
             rep_tensor, rep_mask, block_len, "forward_attn", "forward",
-            keep_prob, is_train, wd, activation, hn)
+            keep_prob, is_train, wd, activation, hn, memory_efficient)
         bw_attn_res = simple_block_attention(
             rep_tensor, rep_mask, block_len, "backward_attn", "backward",
-            keep_prob, is_train, wd, activation, hn)
+            keep_prob, is_train, wd, activation, hn, memory_efficient)
         attn_res = tf.concat([fw_attn_res, bw_attn_res], -1)
         return attn_res
 
 
+def intra_block_attention(rep_map, dependent, head, f_bias, rep_mask_split, direct_mask,
+                          block_len, scaled_tanh):
+    """
+    memory efficient equivalent of the tiled intra-block attention in
+    simple_block_attention. masks are broadcast instead of tiled and, when
+    block_len is static, the [bs,bn,bl,bl,vec] logits are computed one
+    query position at a time so only [bs,bn,bl,vec] is live per step.
+    """
+    attn_mask = tf.logical_and(
+        tf.logical_and(tf.expand_dims(rep_mask_split, 2), tf.expand_dims(rep_mask_split, 3)),
+        tf.expand_dims(tf.expand_dims(direct_mask, 0), 0), name='attn_mask')  # bs,bn,bl,bl
+
+    if not isinstance(block_len, int):
+        logits = scaled_tanh(tf.expand_dims(dependent, 2) + tf.expand_dims(head, 3) + f_bias, 5.0)
+        logits_masked = exp_mask_for_high_rank(logits, attn_mask)
+        attn_score = tf.nn.softmax(logits_masked, 3)  # bs,bn,bl,bl,vec
+        attn_score = mask_for_high_rank(attn_score, attn_mask)
+        return tf.reduce_sum(attn_score * tf.expand_dims(rep_map, 2), 3)  # bs,bn,bl,vec
+
+    self_attn_result = []
+    for query_index in range(block_len):
+        query_mask = attn_mask[:, :, query_index, :]  # bs,bn,bl
+        logits = scaled_tanh(dependent + head[:, :, query_index:query_index+1, :] + f_bias, 5.0)  # bs,bn,bl,vec
+        logits_masked = exp_mask_for_high_rank(logits, query_mask)
+        attn_score = tf.nn.softmax(logits_masked, 2)  # bs,bn,bl,vec
+        attn_score = mask_for_high_rank(attn_score, query_mask)
+        self_attn_result.append(tf.reduce_sum(attn_score * rep_map, 2))  # bs,bn,vec
+    return tf.stack(self_attn_result, 2)  # bs,bn,bl,vec
+
+
 def simple_block_attention(
         rep_tensor, rep_mask, block_len=5, scope=None, direction=None,
-        keep_prob=1., is_train=None, wd=0., activation='elu', hn=None):
+        keep_prob=1., is_train=None, wd=0., activation='elu', hn=None,
+        memory_efficient=False):
     assert direction is not None
 
     def scaled_tanh(x, scale=5.):
@@ -159,7 +191,6 @@ def simple_block_attention(
             # non-linear
             rep_map = bn_dense_layer(rep_tensor_split, ivec, True, 0., 'bn_dense_map', activation,
                                      False, wd, keep_prob, is_train)  # bs,bn,bl,vec
-            rep_map_tile = tf.tile(tf.expand_dims(rep_map, 2), [1, 1, block_len, 1, 1])  # bs,bn,bl,bl,vec
             # rep_map_dp = dropout(rep_map, keep_prob, is_train)
             bn = block_num
             bl = block_len
@@ -173,25 +204,32 @@ def simple_block_attention(
                 direct_mask = tf.greater(sl_row, sl_col)  # bl,bl
             else:
                 direct_mask = tf.greater(sl_col, sl_row)  # bl,bl
-            direct_mask_tile = tf.tile(
-                tf.expand_dims(tf.expand_dims(direct_mask, 0), 0), [bs, bn, 1, 1])  # bs,bn,bl,bl
-            rep_mask_tile_1 = tf.tile(tf.expand_dims(rep_mask_split, 2), [1, 1, bl, 1])  # bs,bn,bl,bl
-            rep_mask_tile_2 = tf.tile(tf.expand_dims(rep_mask_split, 3), [1, 1, 1, bl])  # bs,bn,bl,bl
-            rep_mask_tile = tf.logical_and(rep_mask_tile_1, rep_mask_tile_2)
-            attn_mask = tf.logical_and(direct_mask_tile, rep_mask_tile, name='attn_mask')  # bs,bn,bl,bl
 
             # attention
             f_bias = tf.get_variable('f_bias', [ivec], tf.float32, tf.constant_initializer(0.))
             dependent_head = linear(
                 rep_map, 2 * ivec, False, 0., 'linear_dependent_head', False, wd, keep_prob, is_train)  # bs,bn,bl,2vec
             dependent, head = tf.split(dependent_head, 2, 3)
-            dependent_etd = tf.expand_dims(dependent, 2)  # bs,bn,1,bl,vec
-            head_etd = tf.expand_dims(head, 3)  # bs,bn,bl,1,vec
-            logits = scaled_tanh(dependent_etd + head_etd + f_bias, 5.0)  # bs,bn,bl,bl,vec
-            logits_masked = exp_mask_for_high_rank(logits, attn_mask)
-            attn_score = tf.nn.softmax(logits_masked, 3)  # bs,bn,bl,bl,vec
-            attn_score = mask_for_high_rank(attn_score, attn_mask)  # bs,bn,bl,bl,vec
-            self_attn_result = tf.reduce_sum(attn_score * rep_map_tile, 3)  # bs,bn,bl,vec
+            if memory_efficient:
+                self_attn_result = intra_block_attention(
+                    rep_map, dependent, head, f_bias, rep_mask_split, direct_mask,
+                    block_len, scaled_tanh)  # bs,bn,bl,vec
+            else:
+                rep_map_tile = tf.tile(tf.expand_dims(rep_map, 2), [1, 1, block_len, 1, 1])  # bs,bn,bl,bl,vec
+                direct_mask_tile = tf.tile(
+                    tf.expand_dims(tf.expand_dims(direct_mask, 0), 0), [bs, bn, 1, 1])  # bs,bn,bl,bl
+                rep_mask_tile_1 = tf.tile(tf.expand_dims(rep_mask_split, 2), [1, 1, bl, 1])  # bs,bn,bl,bl
+                rep_mask_tile_2 = tf.tile(tf.expand_dims(rep_mask_split, 3), [1, 1, 1, bl])  # bs,bn,bl,bl
+                rep_mask_tile = tf.logical_and(rep_mask_tile_1, rep_mask_tile_2)
+                attn_mask = tf.logical_and(direct_mask_tile, rep_mask_tile, name='attn_mask')  # bs,bn,bl,bl
+
+                dependent_etd = tf.expand_dims(dependent, 2)  # bs,bn,1,bl,vec
+                head_etd = tf.expand_dims(head, 3)  # bs,bn,bl,1,vec
+                logits = scaled_tanh(dependent_etd + head_etd + f_bias, 5.0)  # bs,bn,bl,bl,vec
+                logits_masked = exp_mask_for_high_rank(logits, attn_mask)
+                attn_score = tf.nn.softmax(logits_masked, 3)  # bs,bn,bl,bl,vec
+                attn_score = mask_for_high_rank(attn_score, attn_mask)  # bs,bn,bl,bl,vec
+                self_attn_result = tf.reduce_sum(attn_score * rep_map_tile, 3)  # bs,bn,bl,vec
 
         with tf.variable_scope('source2token_self_attn'):
             inter_block_logits = bn_dense_layer(self_attn_result, ivec, True, 0., 'bn_dense_map', 'linear',
@@ -2,7 +2,8 @@ import tensorflow as tf
 import numpy as np
 
 # -------------- emb mat--------------
-def generate_embedding_mat(dict_size, emb_len, init_mat=None, extra_symbol=None, scope=None):
+def generate_embedding_mat(dict_size, emb_len, init_mat=None, extra_symbol=None, scope=None, 
+                            appended_size=0):
     """
     generate embedding matrix for looking up
     :param dict_size: indices 0 and 1 corresponding to empty and unknown token
@@ -11,6 +12,7 @@ def generate_embedding_mat(dict_size, emb_len, init_mat=None, extra_symbol=None,
     :param extra_mat: extra tensor [extra_dict_size, emb_len]
     :param extra_trainable:
     :param scope:
+    :param appended_size: trainable rows at the end, appended by vocab updates
     :return: if extra_mat is None, return[dict_size+extra_dict_size,emb_len], else [dict_size,emb_len]
     """
     with tf.variable_scope(scope or 'gene_emb_mat'):
@@ -28,12 +30,23 @@ def generate_embedding_mat(dict_size, emb_len, init_mat=None, extra_symbol=None,
                                    initializer=tf.constant_initializer(extra_symbol_matrix, dtype=tf.float32),
                                    trainable=True)
             
+            other_end = dict_size - appended_size
             emb_mat_other = tf.get_variable("emb_mat", 
-                                  [dict_size - len(extra_symbol), emb_len], 
+                                  [other_end - len(extra_symbol), emb_len], 
                                   tf.float32,
-                                  initializer=tf.constant_initializer(init_mat[len(extra_symbol):], 
+                                  initializer=tf.constant_initializer(init_mat[len(extra_symbol):other_end], 
                                                           dtype=tf.float32),
                                   trainable=False)
+            emb_mat_blocks = [emb_mat_ept_and_unk, emb_mat_other]
+
+            if appended_size > 0:
+                emb_mat_appended = tf.get_variable("emb_appended", 
+                                  [appended_size, emb_len], 
+                                  tf.float32,
+                                  initializer=tf.constant_initializer(init_mat[other_end:], 
+                                                          dtype=tf.float32),
+                                  trainable=True)
+                emb_mat_blocks.append(emb_mat_appended)
             
-            emb_mat = tf.concat([emb_mat_ept_and_unk, emb_mat_other], 0)
+            emb_mat = tf.concat(emb_mat_blocks, 0)
         return emb_mat
\ No newline at end of file
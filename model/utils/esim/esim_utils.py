@@ -54,7 +54,8 @@ def last_relevant_output(output, sequence_length):
 
     sequence_length: Tensor
         A tensor of dimension (batch_size, ) indicating the length
-        of the sequences before padding was applied.
+        of the sequences before padding was applied. Empty sequences
+        get the output at position 0.
 
     Returns
     -------
@@ -66,7 +67,7 @@ def last_relevant_output(output, sequence_length):
         batch_size = tf.shape(output)[0]
         max_length = tf.shape(output)[-2]
         out_size = int(output.get_shape()[-1])
-        index = tf.range(0, batch_size) * max_length + (sequence_length - 1)
+        index = tf.range(0, batch_size) * max_length + tf.maximum(sequence_length - 1, 0)
         flat = tf.reshape(output, [-1, out_size])
         relevant = tf.gather(flat, index)
         return relevant
\ No newline at end of file
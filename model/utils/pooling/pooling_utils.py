@@ -0,0 +1,43 @@
+import tensorflow as tf
+from model.utils.biblosa import self_attn
+from model.utils.esim import esim_utils
+
+EPSILON = 1e-8
+VERY_NEGATIVE_NUMBER = -1e30
+
+def multi_pooling(sent_repres, input_mask, pooling_types, scope, 
+                keep_prob=1., is_training=None, wd=0., activation="relu"):
+    """
+    pool [batch_size, seq_len, hidden] into [batch_size, len(pooling_types)*hidden]
+    sharing one mask, one length vector and one masked copy of the sequence
+    across all requested poolings. pooling_types is any of
+    "ave", "max", "attn" (multi_dimensional_attention) and "last".
+    """
+    with tf.name_scope("multi_pooling"):
+        input_mask = tf.cast(input_mask, tf.bool)
+        float_mask = tf.expand_dims(tf.cast(input_mask, tf.float32), -1) # batch_size x seq_len x 1
+        input_lengths = tf.reduce_sum(tf.cast(input_mask, tf.int32), -1)
+
+        masked_repres = None
+        if "ave" in pooling_types or "max" in pooling_types:
+            masked_repres = sent_repres * float_mask
+
+        pooled = []
+        for pooling in pooling_types:
+            if pooling == "ave":
+                v_sum = tf.reduce_sum(masked_repres, 1)
+                pooled.append(tf.div(v_sum, 
+                    tf.expand_dims(tf.cast(input_lengths, tf.float32)+EPSILON, -1)))
+            elif pooling == "max":
+                pooled.append(tf.reduce_max(
+                    masked_repres + VERY_NEGATIVE_NUMBER * (1 - float_mask), axis=1))
+            elif pooling == "attn":
+                pooled.append(self_attn.multi_dimensional_attention(
+                    sent_repres, input_mask, 'multi_dim_attn_for_%s' % scope,
+                    keep_prob, is_training, wd, activation))
+            elif pooling == "last":
+                pooled.append(esim_utils.last_relevant_output(sent_repres, input_lengths))
+            else:
+                raise ValueError("unknown pooling type %s" % pooling)
+
+        return tf.concat(pooled, axis=-1)
@@ -0,0 +1,42 @@
+import numpy as np
+
+def prune_value(var_name, value, var_shape, token_index, label_index,
+                old_vocab_size, old_extra_size, old_appended_size=0):
+    """
+    gather the kept embedding rows or kept classes of one checkpoint value
+    for a variable of var_shape in a graph built with a pruned vocab and
+    label set, optimizer slots and ema shadows share their variable's name.
+    embedding tables are split in extra symbol, pretrained and appended rows
+    """
+    var_shape = list(var_shape)
+    if list(value.shape) == var_shape:
+        return value
+    token_index = np.asarray(token_index)
+    if "_center_loss/" in var_name:
+        # class centers are [num_classes, dim]
+        value = np.take(value, label_index, axis=0)
+    elif value.shape[0] != var_shape[0] and "emb" in var_name:
+        appended_start = old_vocab_size - old_appended_size
+        extra_index = token_index[token_index < old_extra_size]
+        other_index = token_index[(token_index >= old_extra_size) & 
+                                (token_index < appended_start)] - old_extra_size
+        appended_index = token_index[token_index >= appended_start] - appended_start
+        # trainable blocks of generate_embedding_mat are told apart by name
+        name_parts = var_name.split("/")
+        if "emb_appended" in name_parts:
+            value = value[appended_index]
+        elif "emb_pad_unk" in name_parts:
+            value = value[extra_index]
+        elif value.shape[0] == old_vocab_size:
+            value = value[token_index]
+        elif value.shape[0] == appended_start - old_extra_size:
+            value = value[other_index]
+        elif value.shape[0] == old_extra_size:
+            value = value[extra_index]
+    else:
+        # output projection weights [dim, num_classes] and bias [num_classes]
+        value = np.take(value, label_index, axis=-1)
+    if list(value.shape) != var_shape:
+        raise ValueError("can not prune %s from %s to %s" % (var_name, 
+                            str(value.shape), str(var_shape)))
+    return value
@@ -0,0 +1,72 @@
+import tensorflow as tf
+import numpy as np
+
+INT8_SUFFIX = "_int8"
+SCALE_SUFFIX = "_int8_scale"
+EMA_SUFFIX = "/ExponentialMovingAverage"
+
+def quantize_rows(value):
+    """
+    symmetric per-row int8 quantization, value ~= q * scale
+    with scale = max(|row|) / 127 of shape [rows, 1]
+    """
+    value = np.asarray(value, dtype=np.float32)
+    scale = np.max(np.abs(value), axis=-1, keepdims=True) / 127.0
+    scale = np.where(scale > 0, scale, 1.0).astype(np.float32)
+    q = np.clip(np.round(value / scale), -127, 127).astype(np.int8)
+    return q, scale
+
+def dequantize_rows(q, scale):
+    return q.astype(np.float32) * scale
+
+def should_quantize(shape, dtype, min_size=1024):
+    """
+    only float32 matrices (embedding tables and dense kernels)
+    with at least min_size elements are stored as int8
+    """
+    if shape is None or dtype is None:
+        return False
+    if tf.as_dtype(dtype).base_dtype != tf.float32:
+        return False
+    shape = tf.TensorShape(shape)
+    if shape.ndims != 2 or not shape.is_fully_defined():
+        return False
+    return shape.num_elements() >= min_size
+
+def int8_dequant_getter(min_size=1024):
+    """
+    custom getter that stores a quantized matrix as an int8 variable
+    plus a [rows, 1] float scale and returns the matrix dequantized on
+    the fly, so the rest of the graph is unchanged. quantized variables
+    are non-trainable, the graph is meant for inference only.
+    """
+    def getter(getter, name, *args, **kwargs):
+        shape = kwargs.get("shape", None)
+        dtype = kwargs.get("dtype", None) or tf.float32
+        if not should_quantize(shape, dtype, min_size):
+            return getter(name, *args, **kwargs)
+
+        shape = tf.TensorShape(shape).as_list()
+        kwargs.update({"regularizer":None, "constraint":None, 
+                        "partitioner":None, "trainable":False})
+
+        kwargs.update({"shape":shape, "dtype":tf.int8, 
+                        "initializer":tf.zeros_initializer()})
+        q = getter(name+INT8_SUFFIX, *args, **kwargs)
+
+        kwargs.update({"shape":[shape[0], 1], "dtype":tf.float32, 
+                        "initializer":tf.ones_initializer()})
+        scale = getter(name+SCALE_SUFFIX, *args, **kwargs)
+
+        return tf.cast(q, tf.float32) * scale
+    return getter
+
+def read_float_tensor(reader, name):
+    """prefer the moving average since that is what load_model serves"""
+    if reader.has_tensor(name+EMA_SUFFIX):
+        return reader.get_tensor(name+EMA_SUFFIX)
+    return reader.get_tensor(name)
+
+def variable_bytes(variables):
+    return sum([var.get_shape().num_elements() * var.dtype.base_dtype.size 
+                for var in variables])
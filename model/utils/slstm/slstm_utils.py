@@ -327,4 +327,188 @@ def slstm_cell(config, scope, hidden_size,
     initial_hidden_states = tf.nn.dropout(initial_hidden_states, 1 - dropout)
     initial_cell_states = tf.nn.dropout(initial_cell_states, 1 - dropout)
 
-    return initial_hidden_states, initial_cell_states, dummynode_hidden_states
\ No newline at end of file
+    return initial_hidden_states, initial_cell_states, dummynode_hidden_states
+
+def get_neighbour_sums(states, step):
+    """
+    sum of the `step` states before and after every position, computed
+    with one depthwise convolution instead of 2*step shifted copies
+    """
+    channels = states.get_shape().as_list()[-1]
+    seq_len = tf.shape(states)[1]
+    padded_states = tf.pad(states, [[0, 0], [step, step], [0, 0]])
+    window_sums = tf.nn.depthwise_conv2d(tf.expand_dims(padded_states, 1), 
+                                tf.ones([1, step, channels, 1], dtype=tf.float32), 
+                                [1, 1, 1, 1], "VALID")
+    window_sums = tf.squeeze(window_sums, axis=1) # batch x seq_len+step+1 x channels
+    states_before = window_sums[:, :seq_len, :]
+    states_after = window_sums[:, step+1:step+1+seq_len, :]
+    return states_before, states_after
+
+def get_fused_slstm_params(scope, hidden_size, reuse=None):
+    """
+    creates exactly the variables of slstm_cell, so checkpoints work with
+    both implementations, and concatenates them into one kernel per input
+    with gate order f1, f2, f3, f4, i, o
+    """
+    gate_scopes = [("f1_gate", ["Wxf", "Whf", "Wif1", "Wdf1"]), 
+                ("f2_gate", ["Wxf", "Whf", "Wif1", "Wdf1"]), 
+                ("f3_gate", ["Wxf", "Whf", "Wif1", "Wdf1"]), 
+                ("f4_gate", ["Wxf", "Whf", "Wif1", "Wdf1"]), 
+                ("i_gate", ["Wxi", "Whi", "Wii", "Wdi"]), 
+                ("o_gate", ["Wxo", "Who", "Wio", "Wdo"])]
+    # current, left-right, initial state and dummy node inputs
+    input_sizes = [hidden_size, 2*hidden_size, hidden_size, hidden_size]
+
+    def get_variable(name, shape):
+        return tf.get_variable(name, dtype=tf.float32,
+                            shape=shape, initializer=initializer)
+
+    params = {}
+    with tf.variable_scope(scope, reuse = reuse):
+        kernels = [[], [], [], []]
+        for gate_scope, names in gate_scopes:
+            with tf.variable_scope(gate_scope, reuse = reuse):
+                for index, name in enumerate(names):
+                    kernels[index].append(get_variable(name, [input_sizes[index], hidden_size]))
+        with tf.variable_scope("biases", reuse = reuse):
+            biases = [get_variable(name, [hidden_size]) 
+                        for name in ["bf1", "bf2", "bf3", "bf4", "bi", "bo"]]
+
+        with tf.variable_scope("gated_d_gate", reuse = reuse):
+            gated_Wxd = get_variable("gated_Wxd", [hidden_size, hidden_size])
+            gated_Whd = get_variable("gated_Whd", [hidden_size, hidden_size])
+        with tf.variable_scope("gated_o_gate", reuse = reuse):
+            gated_Wxo = get_variable("gated_Wxo", [hidden_size, hidden_size])
+            gated_Who = get_variable("gated_Who", [hidden_size, hidden_size])
+        with tf.variable_scope("gated_f_gate", reuse = reuse):
+            params["gated_Wxf"] = get_variable("gated_Wxf", [hidden_size, hidden_size])
+            params["gated_Whf"] = get_variable("gated_Whf", [hidden_size, hidden_size])
+        with tf.variable_scope("gated_biases", reuse = reuse):
+            gated_bd = get_variable("gated_bd", [hidden_size])
+            gated_bo = get_variable("gated_bo", [hidden_size])
+            params["gated_bf"] = get_variable("gated_bf", [hidden_size])
+
+    # [current; before; after] x [f1 f2 f3 f4 i o]
+    params["W_word"] = tf.concat([tf.concat(kernels[0], axis=1), 
+                                tf.concat(kernels[1], axis=1)], axis=0)
+    params["W_init"] = tf.concat(kernels[2], axis=1)
+    params["W_dummy"] = tf.concat(kernels[3], axis=1)
+    params["b"] = tf.concat(biases, axis=0)
+    # [dummy; word average] x [d o]
+    params["gated_W_do"] = tf.concat([tf.concat([gated_Wxd, gated_Wxo], axis=1), 
+                                tf.concat([gated_Whd, gated_Who], axis=1)], axis=0)
+    params["gated_b_do"] = tf.concat([gated_bd, gated_bo], axis=0)
+    return params
+
+def slstm_layer_fused(params, step, hidden_states, cell_states, 
+                dummynode_hidden_states, dummynode_cell_states,
+                embedding_gates, embedding_cell_states, 
+                sequence_mask, mask_softmax_score_expanded):
+    #update dummy node states
+    combined_word_hidden_state = tf.reduce_mean(hidden_states, axis=1)
+    gated_d_o = tf.nn.sigmoid(
+        tf.matmul(tf.concat([dummynode_hidden_states, combined_word_hidden_state], axis=1), 
+                params["gated_W_do"]) + params["gated_b_do"])
+    gated_d_t, gated_o_t = tf.split(gated_d_o, 2, axis=1)
+    gated_f_t = tf.nn.sigmoid(
+        tf.expand_dims(tf.matmul(dummynode_hidden_states, params["gated_Wxf"]), axis=1) + 
+        tf.tensordot(hidden_states, params["gated_Whf"], axes=[[2], [0]]) + params["gated_bf"])
+
+    gated_softmax_scores = tf.nn.softmax(tf.concat([gated_f_t + mask_softmax_score_expanded, 
+                                tf.expand_dims(gated_d_t, axis=1)], axis=1), dim=1)
+    seq_len = tf.shape(hidden_states)[1]
+    new_gated_f_t = gated_softmax_scores[:,:seq_len,:]
+    new_gated_d_t = gated_softmax_scores[:,seq_len,:]
+    dummy_c_t = tf.reduce_sum(new_gated_f_t * cell_states, axis=1) + new_gated_d_t * dummynode_cell_states
+    dummy_h_t = gated_o_t * tf.nn.tanh(dummy_c_t)
+
+    #update word node states
+    states_before, states_after = get_neighbour_sums(
+                            tf.concat([hidden_states, cell_states], axis=2), step)
+    hidden_states_before, cell_states_before = tf.split(states_before, 2, axis=2)
+    hidden_states_after, cell_states_after = tf.split(states_after, 2, axis=2)
+
+    gates = tf.tensordot(tf.concat([hidden_states, hidden_states_before, hidden_states_after], axis=2), 
+                        params["W_word"], axes=[[2], [0]])
+    gates += embedding_gates
+    gates += tf.expand_dims(tf.matmul(dummynode_hidden_states, params["W_dummy"]), axis=1)
+    gates = tf.nn.sigmoid(gates)
+
+    hidden_size = params["gated_bf"].get_shape().as_list()[0]
+    five_gates, o_t = tf.split(gates, [5*hidden_size, hidden_size], axis=2)
+    five_gates = tf.stack(tf.split(five_gates, 5, axis=2), axis=2) # batch x seq_len x 5 x hidden
+    five_gates = tf.nn.softmax(five_gates, dim=2)
+    f1_t, f2_t, f3_t, f4_t, i_t = tf.unstack(five_gates, axis=2)
+
+    c_t = (f1_t * cell_states_before) + (f2_t * cell_states_after) + (f3_t * embedding_cell_states) + \
+            (f4_t * tf.expand_dims(dummynode_cell_states, axis=1)) + (i_t * cell_states)
+    h_t = o_t * tf.nn.tanh(c_t)
+
+    return h_t*sequence_mask, c_t*sequence_mask, dummy_h_t, dummy_c_t
+
+def slstm_cell_fused(config, scope, hidden_size, 
+            lengths, initial_hidden_states, initial_cell_states, num_layers,
+            dropout, reuse=None):
+    """
+    drop-in replacement for slstm_cell: stacked gate kernels, neighbour
+    windows from one convolution and, with config.slstm_while_loop, a
+    tf.while_loop over layers so graph size does not grow with num_layers
+    """
+    params = get_fused_slstm_params(scope, hidden_size, reuse=reuse)
+
+    #filters for attention        
+    mask_softmax_score=tf.cast(tf.sequence_mask(lengths), tf.float32)*1e25-1e25
+    mask_softmax_score_expanded=tf.expand_dims(mask_softmax_score, dim=2)               
+    #filter invalid steps
+    sequence_mask=tf.expand_dims(tf.cast(tf.sequence_mask(lengths), tf.float32),axis=2)
+    #filter embedding states
+    initial_hidden_states=initial_hidden_states*sequence_mask
+    initial_cell_states=initial_cell_states*sequence_mask
+    shape=tf.shape(initial_hidden_states)
+
+    #initial embedding states, their gate contribution is the same for every layer
+    embedding_gates = tf.tensordot(initial_hidden_states, params["W_init"], axes=[[2], [0]]) + params["b"]
+    embedding_cell_states = initial_cell_states
+
+    #randomly initialize the states
+    if config.random_initialize:
+        initial_hidden_states=tf.random_uniform(shape, minval=-0.05, maxval=0.05, dtype=tf.float32, seed=None, name=None)
+        initial_cell_states=tf.random_uniform(shape, minval=-0.05, maxval=0.05, dtype=tf.float32, seed=None, name=None)
+    initial_hidden_states=initial_hidden_states*sequence_mask
+    initial_cell_states=initial_cell_states*sequence_mask
+
+    #inital dummy node states
+    dummynode_hidden_states=tf.reduce_mean(initial_hidden_states, axis=1)
+    dummynode_cell_states=tf.reduce_mean(initial_cell_states, axis=1)
+
+    def layer(hidden_states, cell_states, dummy_hidden_states, dummy_cell_states):
+        return slstm_layer_fused(params, config.step, hidden_states, cell_states, 
+                        dummy_hidden_states, dummy_cell_states,
+                        embedding_gates, embedding_cell_states, 
+                        sequence_mask, mask_softmax_score_expanded)
+
+    states = [initial_hidden_states, initial_cell_states, 
+                dummynode_hidden_states, dummynode_cell_states]
+    if config.get("slstm_while_loop", False):
+        def body(i, *states):
+            return [i+1] + list(layer(*states))
+        shape_invariants = [tf.TensorShape([]), 
+                            tf.TensorShape([None, None, hidden_size]), 
+                            tf.TensorShape([None, None, hidden_size]),
+                            tf.TensorShape([None, hidden_size]),
+                            tf.TensorShape([None, hidden_size])]
+        states = tf.while_loop(lambda i, *states: i < num_layers, body, 
+                            [tf.constant(0)] + states, 
+                            shape_invariants=shape_invariants)[1:]
+    else:
+        for i in range(num_layers):
+            states = layer(*states)
+
+    [initial_hidden_states, initial_cell_states, 
+    dummynode_hidden_states, dummynode_cell_states] = states
+
+    initial_hidden_states = tf.nn.dropout(initial_hidden_states, 1 - dropout)
+    initial_cell_states = tf.nn.dropout(initial_cell_states, 1 - dropout)
+
+    return initial_hidden_states, initial_cell_states, dummynode_hidden_states
@@ -1,8 +1,10 @@
 import tensorflow as tf
 import numpy as np
+import functools
 
 from tensor2tensor.models.research import universal_transformer, universal_transformer_util
 from tensor2tensor.models import transformer
+from tensor2tensor.layers import common_attention, common_layers
 
 
 def universal_transformer_encoder(inputs, target_space, 
@@ -27,3 +29,141 @@ def universal_transformer_encoder(inputs, target_space,
     # encoder_output = tf.expand_dims(encoder_output, 2)
 
     return encoder_output
+
+
+def _universal_transformer_step_fns(inputs, target_space, hparams, head_fn, features=None):
+    """
+    builds the fixed-step recurrence of universal_transformer_encoder one
+    step at a time. returns ut_function(layer_inputs, step), ut_initializer
+    and step_logits(layer_inputs), which applies head_fn to the encoder
+    output the recurrence would give if it stopped after that step
+    """
+    if hparams.recurrence_type == "act":
+        raise ValueError("early exit needs a fixed-step recurrence_type, act already halts per position")
+
+    encoder_input, self_attention_bias, encoder_decoder_attention_bias = (
+        transformer.transformer_prepare_encoder(
+            inputs, target_space, hparams, features=features))
+
+    encoder_input = tf.nn.dropout(encoder_input,
+                                  1.0 - hparams.layer_prepostprocess_dropout)
+
+    nonpadding = transformer.features_to_nonpadding(features, "inputs")
+    with tf.variable_scope("encoder") as encoder_scope:
+        if nonpadding is None:
+            nonpadding = 1.0 - common_attention.attention_bias_to_padding(
+                self_attention_bias)
+
+        ffn_unit = functools.partial(
+            universal_transformer_util.transformer_encoder_ffn_unit,
+            hparams=hparams,
+            nonpadding_mask=nonpadding,
+            pad_remover=None)
+
+        attention_unit = functools.partial(
+            universal_transformer_util.transformer_encoder_attention_unit,
+            hparams=hparams,
+            encoder_self_attention_bias=self_attention_bias,
+            attention_dropout_broadcast_dims=common_layers.comma_separated_string_to_integer_list(
+                getattr(hparams, "attention_dropout_broadcast_dims", "")),
+            save_weights_to=None,
+            make_image_summary=False)
+
+        def add_vanilla_transformer_layer(x, num_layers):
+            if hparams.add_position_timing_signal:
+                x = common_attention.add_timing_signal_1d(x)
+            for layer in range(num_layers):
+                with tf.variable_scope("layer_%d" % layer):
+                    x = ffn_unit(attention_unit(x))
+            return x
+
+        with tf.variable_scope("universal_transformer_%s" % hparams.recurrence_type) as ut_scope:
+            x = encoder_input
+            if hparams.mix_with_transformer == "before_ut":
+                x = add_vanilla_transformer_layer(x, hparams.num_mixedin_layers)
+
+            ut_function, ut_initializer = universal_transformer_util.get_ut_layer(
+                x, hparams, ffn_unit, attention_unit, None)
+
+    def step_function(layer_inputs, step):
+        with tf.variable_scope(ut_scope):
+            return ut_function(layer_inputs, step)
+
+    def step_logits(layer_inputs):
+        with tf.variable_scope(ut_scope):
+            if hparams.get("use_memory_as_final_state", False):
+                output = layer_inputs[2]
+            else:
+                output = layer_inputs[0]
+            if hparams.mix_with_transformer == "after_ut":
+                output = add_vanilla_transformer_layer(output, hparams.num_mixedin_layers)
+        with tf.variable_scope(encoder_scope):
+            if hparams.get("use_memory_as_last_state", False):
+                output = layer_inputs[2]
+            output = common_layers.layer_preprocess(output, hparams)
+        return head_fn(output)
+
+    return step_function, ut_initializer, step_logits
+
+
+def universal_transformer_encoder_step_logits(inputs, target_space, 
+                hparams, head_fn, features=None):
+    """
+    head_fn logits after each of the first num_rec_steps - 1 recurrent
+    steps, for an auxiliary loss that trains the head on the intermediate
+    states early exit stops at. must be built under a reuse=True scope
+    after the full-depth encoder, whose variables it shares.
+    """
+    step_function, layer_inputs, step_logits = _universal_transformer_step_fns(
+                inputs, target_space, hparams, head_fn, features=features)
+    logits = []
+    for step in range(hparams.num_rec_steps - 1):
+        layer_inputs = step_function(layer_inputs, tf.constant(step, dtype=tf.int32))
+        logits.append(step_logits(layer_inputs))
+    return logits
+
+
+def universal_transformer_encoder_early_exit(inputs, target_space, 
+                hparams, head_fn, threshold, num_classes, features=None):
+    """
+    runs the fixed-step recurrence of universal_transformer_encoder in a
+    tf.while_loop and stops once the softmax of head_fn(encoder_output)
+    gives every example a top class probability >= threshold. the exit is
+    per batch: an example that is already confident keeps the
+    probabilities of the step it exited at, but the loop keeps running
+    until the least confident example of the batch exits, so batched
+    inference only saves steps when the whole batch is confident.
+    must be built under a reuse=True scope after the full-depth encoder,
+    whose variables it shares.
+    returns pred_probs of the step each example exited at and steps taken.
+    """
+    step_function, ut_initializer, step_logits = _universal_transformer_step_fns(
+                inputs, target_space, hparams, head_fn, features=features)
+
+    def should_continue(step, layer_inputs, pred_probs, steps, exited):
+        return tf.logical_and(tf.less(step, hparams.num_rec_steps), 
+                            tf.logical_not(tf.reduce_all(exited)))
+
+    def body(step, layer_inputs, pred_probs, steps, exited):
+        layer_inputs = step_function(layer_inputs, step)
+        probs = tf.nn.softmax(step_logits(layer_inputs))
+
+        running = tf.logical_not(exited)
+        pred_probs = tf.where(running, probs, pred_probs)
+        steps = tf.where(running, tf.fill(tf.shape(steps), step+1), steps)
+        exited = tf.logical_or(exited, tf.greater_equal(tf.reduce_max(probs, axis=-1), threshold))
+        return step+1, layer_inputs, pred_probs, steps, exited
+
+    batch_size = tf.shape(inputs)[0]
+    [_, _, pred_probs, steps, _] = tf.while_loop(should_continue, body, 
+            [tf.constant(0, dtype=tf.int32), ut_initializer, 
+            tf.zeros([batch_size, num_classes], dtype=tf.float32), 
+            tf.zeros([batch_size], dtype=tf.int32), 
+            tf.zeros([batch_size], dtype=tf.bool)],
+            shape_invariants=[tf.TensorShape([]), 
+                            tuple([layer_input.get_shape() for layer_input in ut_initializer]), 
+                            tf.TensorShape([None, num_classes]), 
+                            tf.TensorShape([None]), 
+                            tf.TensorShape([None])])
+
+    return pred_probs, steps
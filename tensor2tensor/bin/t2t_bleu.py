@@ -50,6 +50,8 @@ there are optional parameters:
    This is useful for continuous evaluation of a running training, in which case
    this should be equal to save_checkpoints_secs/60 plus time needed for
    translation plus some reserve.
+ * num_workers: Number of processes tokenizing and counting n-grams.
+   Default=1.
 """
 from __future__ import absolute_import
 from __future__ import division
@@ -85,6 +87,8 @@ flags.DEFINE_integer("wait_minutes", 0,
                      "save_checkpoints_secs.")
 flags.DEFINE_bool("report_zero", None,
                   "Store BLEU=0 and guess its time based on the oldest file.")
+flags.DEFINE_integer("num_workers", 1,
+                     "Number of processes tokenizing and counting n-grams.")
 
 
 def main(_):
@@ -95,11 +99,13 @@ def main(_):
           "Cannot specify both --translation and --translations_dir.")
     if FLAGS.bleu_variant in ("uncased", "both"):
       bleu = 100 * bleu_hook.bleu_wrapper(FLAGS.reference, FLAGS.translation,
-                                          case_sensitive=False)
+                                          case_sensitive=False,
+                                          num_workers=FLAGS.num_workers)
       print("BLEU_uncased = %6.2f" % bleu)
     if FLAGS.bleu_variant in ("cased", "both"):
       bleu = 100 * bleu_hook.bleu_wrapper(FLAGS.reference, FLAGS.translation,
-                                          case_sensitive=True)
+                                          case_sensitive=True,
+                                          num_workers=FLAGS.num_workers)
       print("BLEU_cased = %6.2f" % bleu)
     return
 
@@ -151,13 +157,15 @@ def main(_):
     values = []
     if FLAGS.bleu_variant in ("uncased", "both"):
       bleu = 100 * bleu_hook.bleu_wrapper(FLAGS.reference, filename,
-                                          case_sensitive=False)
+                                          case_sensitive=False,
+                                          num_workers=FLAGS.num_workers)
       values.append(tf.Summary.Value(tag="BLEU_uncased" + FLAGS.tag_suffix,
                                      simple_value=bleu))
       tf.logging.info("%s: BLEU_uncased = %6.2f" % (filename, bleu))
     if FLAGS.bleu_variant in ("cased", "both"):
       bleu = 100 * bleu_hook.bleu_wrapper(FLAGS.reference, filename,
-                                          case_sensitive=True)
+                                          case_sensitive=True,
+                                          num_workers=FLAGS.num_workers)
       values.append(tf.Summary.Value(tag="BLEU_cased" + FLAGS.tag_suffix,
                                      simple_value=bleu))
       tf.logging.info("%s: BLEU_cased = %6.2f" % (transl_file.filename, bleu))
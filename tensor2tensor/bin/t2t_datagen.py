@@ -70,6 +70,17 @@ flags.DEFINE_integer("task_id_end", -1, "For distributed data generation.")
 flags.DEFINE_integer(
     "num_concurrent_processes", None,
     "Applies only to problems for which multiprocess_generate=True.")
+flags.DEFINE_integer(
+    "num_datagen_workers", None,
+    "Number of processes converting examples to tf.Example protos and "
+    "writing shards in generator_utils.generate_files. Serial if unset.")
+flags.DEFINE_integer(
+    "shuffle_memory_budget_mb", None,
+    "Approximate memory for shuffling records, in MB. Larger datasets are "
+    "shuffled through temporary bucket files. Unlimited if unset.")
+flags.DEFINE_bool("shuffle_mix_shards", False,
+                  "If true, shuffle records across all shards of a split "
+                  "instead of within each shard.")
 flags.DEFINE_string("t2t_usr_dir", "",
                     "Path to a Python module that will be imported. The "
                     "__init__.py file should include the necessary imports. "
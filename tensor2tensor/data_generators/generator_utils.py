@@ -18,13 +18,18 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import bisect
+import collections
 import gzip
+import math
 import multiprocessing as mp
 import os
 import random
+import re
 import stat
 import tarfile
 import tempfile
+import time
 import requests
 import six
 from six.moves import range  # pylint: disable=redefined-builtin
@@ -129,8 +134,129 @@ def outputs_exist(filenames):
       return out_fname
 
 
+def _datagen_flag(name):
+  """Returns the value of flag `name` if defined, e.g. by t2t-datagen."""
+  try:
+    return getattr(tf.flags.FLAGS, name)
+  except Exception:  # pylint: disable=broad-except
+    return None
+
+
+def _write_shards_worker(worker_id, tmp_filenames, case_queue, result_queue):
+  """Worker process: serializes cases and writes the shards it owns.
+
+  Args:
+    worker_id: an integer, used for logging.
+    tmp_filenames: dict from shard index to the file this worker writes.
+    case_queue: queue of (shard, list of cases) chunks, ended by None.
+    result_queue: queue receiving (worker_id, num_examples, seconds).
+  """
+  start_time = time.time()
+  writers = {shard: tf.python_io.TFRecordWriter(fname)
+             for shard, fname in six.iteritems(tmp_filenames)}
+  counter = 0
+  while True:
+    chunk = case_queue.get()
+    if chunk is None:
+      break
+    shard, cases = chunk
+    for case in cases:
+      writers[shard].write(to_example(case).SerializeToString())
+    counter += len(cases)
+  for writer in writers.values():
+    writer.close()
+  elapsed = time.time() - start_time
+  tf.logging.info("Worker %d wrote %d examples to %d shards (%.1f examples/s)",
+                  worker_id, counter, len(writers), counter / max(elapsed, 1e-6))
+  result_queue.put((worker_id, counter, elapsed))
+
+
+def _put_chunk(case_queue, chunk, worker):
+  """Puts a chunk on a worker queue, failing if the worker has died."""
+  while True:
+    try:
+      case_queue.put(chunk, timeout=1)
+      return
+    except six.moves.queue.Full:
+      if not worker.is_alive():
+        raise ValueError("Datagen worker exited with code %s." %
+                         worker.exitcode)
+
+
+def _generate_files_parallel(generator, tmp_filenames, max_cases,
+                             cycle_every_n, num_workers, chunk_size=256):
+  """Writes cases to tmp_filenames with to_example running in num_workers.
+
+  Cases are pulled from the generator in this process and assigned to shards
+  exactly as in the serial path. Each worker owns the writers of a fixed subset
+  of shards and receives their cases in order through its own queue, so every
+  shard gets the same records in the same order as with a single writer.
+
+  Returns:
+    The number of cases written.
+  """
+  num_shards = len(tmp_filenames)
+  num_workers = min(num_workers, num_shards)
+  case_queues = [mp.Queue(maxsize=4) for _ in range(num_workers)]
+  result_queue = mp.Queue()
+  workers = []
+  for worker_id in range(num_workers):
+    owned = {shard: tmp_filenames[shard]
+             for shard in range(worker_id, num_shards, num_workers)}
+    worker = mp.Process(
+        target=_write_shards_worker,
+        args=(worker_id, owned, case_queues[worker_id], result_queue))
+    worker.start()
+    workers.append(worker)
+
+  start_time = time.time()
+  chunks = [[] for _ in range(num_shards)]
+  counter, shard = 0, 0
+  try:
+    for case in generator:
+      if case is None:
+        continue
+      if counter % 100000 == 0:
+        tf.logging.info("Generating case %d." % counter)
+      counter += 1
+      if max_cases and counter > max_cases:
+        counter -= 1
+        break
+      chunks[shard].append(case)
+      if len(chunks[shard]) >= chunk_size:
+        _put_chunk(case_queues[shard % num_workers], (shard, chunks[shard]),
+                   workers[shard % num_workers])
+        chunks[shard] = []
+      if counter % cycle_every_n == 0:
+        shard = (shard + 1) % num_shards
+    for shard, cases in enumerate(chunks):
+      if cases:
+        _put_chunk(case_queues[shard % num_workers], (shard, cases),
+                   workers[shard % num_workers])
+  finally:
+    for case_queue, worker in zip(case_queues, workers):
+      if worker.is_alive():
+        case_queue.put(None)
+    for worker in workers:
+      worker.join()
+
+  failed = [i for i, worker in enumerate(workers) if worker.exitcode != 0]
+  if failed:
+    raise ValueError("Datagen workers %s failed; partial outputs are left as "
+                     ".incomplete files." % failed)
+  results = [result_queue.get() for _ in workers]
+
+  elapsed = time.time() - start_time
+  tf.logging.info("Generated %d examples with %d workers (%.1f examples/s, "
+                  "per worker: %s)", counter, num_workers,
+                  counter / max(elapsed, 1e-6),
+                  ", ".join("%.1f" % (n / max(t, 1e-6))
+                            for _, n, t in sorted(results)))
+  return counter
+
+
 def generate_files(generator, output_filenames,
-                   max_cases=None, cycle_every_n=1):
+                   max_cases=None, cycle_every_n=1, num_workers=None):
   """Generate cases from a generator and save as TFRecord files.
 
   Generated cases are transformed to tf.Example protos and saved as TFRecords
@@ -143,29 +269,44 @@ def generate_files(generator, output_filenames,
       if None (default), we use the generator until StopIteration is raised.
     cycle_every_n: how many cases from the generator to take before
       switching to the next shard; by default set to 1, switch every case.
+    num_workers: number of processes converting cases to tf.Example and
+      writing shards. Defaults to --num_datagen_workers if that flag is
+      defined. If None or 1, everything runs in this process. The output
+      files are the same either way.
   """
   if outputs_exist(output_filenames):
     tf.logging.info("Skipping generator because outputs files exist")
     return
   tmp_filenames = [fname + ".incomplete" for fname in output_filenames]
   num_shards = len(output_filenames)
-  writers = [tf.python_io.TFRecordWriter(fname) for fname in tmp_filenames]
-  counter, shard = 0, 0
-  for case in generator:
-    if case is None:
-      continue
-    if counter % 100000 == 0:
-      tf.logging.info("Generating case %d." % counter)
-    counter += 1
-    if max_cases and counter > max_cases:
-      break
-    example = to_example(case)
-    writers[shard].write(example.SerializeToString())
-    if counter % cycle_every_n == 0:
-      shard = (shard + 1) % num_shards
+  if num_workers is None:
+    num_workers = _datagen_flag("num_datagen_workers")
+  if num_workers and num_workers > 1 and mp.current_process().daemon:
+    # Pool workers (e.g. multiprocess_generate) cannot start child processes.
+    tf.logging.warning("Writing shards serially inside a daemon process.")
+    num_workers = None
+
+  if num_workers and num_workers > 1 and num_shards > 1:
+    counter = _generate_files_parallel(generator, tmp_filenames, max_cases,
+                                       cycle_every_n, num_workers)
+  else:
+    writers = [tf.python_io.TFRecordWriter(fname) for fname in tmp_filenames]
+    counter, shard = 0, 0
+    for case in generator:
+      if case is None:
+        continue
+      if counter % 100000 == 0:
+        tf.logging.info("Generating case %d." % counter)
+      counter += 1
+      if max_cases and counter > max_cases:
+        break
+      example = to_example(case)
+      writers[shard].write(example.SerializeToString())
+      if counter % cycle_every_n == 0:
+        shard = (shard + 1) % num_shards
 
-  for writer in writers:
-    writer.close()
+    for writer in writers:
+      writer.close()
 
   for tmp_name, final_name in zip(tmp_filenames, output_filenames):
     tf.gfile.Rename(tmp_name, final_name)
@@ -300,7 +441,7 @@ def gunzip_file(gz_path, new_path):
 
 def get_or_generate_vocab_inner(data_dir, vocab_filename, vocab_size,
                                 generator, max_subtoken_length=None,
-                                reserved_tokens=None):
+                                reserved_tokens=None, num_workers=None):
   """Inner implementation for vocab generators.
 
   Args:
@@ -314,6 +455,8 @@ def get_or_generate_vocab_inner(data_dir, vocab_filename, vocab_size,
     reserved_tokens: List of reserved tokens. `text_encoder.RESERVED_TOKENS`
       should be a prefix of `reserved_tokens`. If `None`, defaults to
       `RESERVED_TOKENS`.
+    num_workers: an optional integer. Number of processes used to count
+      candidate subtokens while building the vocabulary.
 
   Returns:
     A SubwordTextEncoder vocabulary object.
@@ -329,7 +472,7 @@ def get_or_generate_vocab_inner(data_dir, vocab_filename, vocab_size,
   tf.logging.info("Generating vocab file: %s", vocab_filepath)
   vocab = text_encoder.SubwordTextEncoder.build_from_generator(
       generator, vocab_size, max_subtoken_length=max_subtoken_length,
-      reserved_tokens=reserved_tokens)
+      reserved_tokens=reserved_tokens, num_workers=num_workers)
 
   if vocab_filepath:
     tf.gfile.MakeDirs(data_dir)
@@ -472,25 +615,137 @@ def generate_dataset_and_shuffle(train_gen,
     shuffle_dataset(train_paths + dev_paths)
 
 
-def _shuffle_single(fname):
-  records = read_records(fname)
-  random.shuffle(records)
-  out_fname = fname.replace(UNSHUFFLED_SUFFIX, "")
-  write_records(records, out_fname)
-  tf.gfile.Remove(fname)
+def _shard_group(fname):
+  """Strips the -xxxxx-of-yyyyy suffix so that shards of one split match."""
+  return re.sub(r"-\d{5}-of-\d{5}$", "", fname)
+
+
+def _shuffle_records(in_fnames, out_fnames, memory_budget=None):
+  """Shuffles the records of in_fnames together into out_fnames.
+
+  Output i receives as many records as input i had. If the inputs are larger
+  than memory_budget bytes, records are first scattered uniformly at random
+  into temporary bucket files that each fit in the budget, and each bucket is
+  then shuffled in memory. Concatenating uniformly shuffled random buckets is
+  a uniform shuffle of the whole input.
+
+  Args:
+    in_fnames: list of TFRecord files to shuffle; removed when done.
+    out_fnames: list of output files, one per input.
+    memory_budget: approximate number of record bytes to hold in memory at
+      once, or None for no limit.
+  """
+  total_bytes = sum(tf.gfile.Stat(fname).length for fname in in_fnames)
+  num_buckets = 1
+  if memory_budget:
+    num_buckets = max(1, int(math.ceil(total_bytes / memory_budget)))
+
+  counts = []
+  if num_buckets == 1:
+    records = []
+    for fname in in_fnames:
+      shard_records = read_records(fname)
+      counts.append(len(shard_records))
+      records.extend(shard_records)
+    random.shuffle(records)
+    buckets = [records]
+  else:
+    tmp_dir = make_tmp_dir(prefix="shuffle",
+                           dir=os.path.dirname(out_fnames[0]) or None)
+    bucket_fnames = [os.path.join(tmp_dir, "bucket-%.5d" % i)
+                     for i in range(num_buckets)]
+    tf.logging.info("Scattering %d bytes into %d buckets in %s", total_bytes,
+                    num_buckets, tmp_dir)
+    writers = [tf.python_io.TFRecordWriter(fname) for fname in bucket_fnames]
+    for fname in in_fnames:
+      count = 0
+      for record in tf.python_io.tf_record_iterator(fname):
+        writers[random.randrange(num_buckets)].write(record)
+        count += 1
+      counts.append(count)
+    for writer in writers:
+      writer.close()
+
+    def shuffled_buckets():
+      for bucket_fname in bucket_fnames:
+        bucket = read_records(bucket_fname)
+        random.shuffle(bucket)
+        tf.gfile.Remove(bucket_fname)
+        yield bucket
+    buckets = shuffled_buckets()
+
+  tmp_out_fnames = [fname + ".incomplete" for fname in out_fnames]
+  out_index, remaining = 0, counts[0]
+  writer = tf.python_io.TFRecordWriter(tmp_out_fnames[0])
+  for bucket in buckets:
+    for record in bucket:
+      while not remaining:
+        writer.close()
+        out_index += 1
+        remaining = counts[out_index]
+        writer = tf.python_io.TFRecordWriter(tmp_out_fnames[out_index])
+      writer.write(record)
+      remaining -= 1
+  writer.close()
+  # Outputs after the last record only get empty files.
+  for fname in tmp_out_fnames[out_index + 1:]:
+    tf.python_io.TFRecordWriter(fname).close()
+
+  if num_buckets > 1:
+    tf.gfile.DeleteRecursively(tmp_dir)
+  for tmp_name, final_name in zip(tmp_out_fnames, out_fnames):
+    tf.gfile.Rename(tmp_name, final_name, overwrite=True)
+  for fname in in_fnames:
+    if fname not in out_fnames:
+      tf.gfile.Remove(fname)
+
+
+def _shuffle_group(args):
+  in_fnames, memory_budget = args
+  out_fnames = [fname.replace(UNSHUFFLED_SUFFIX, "") for fname in in_fnames]
+  _shuffle_records(in_fnames, out_fnames, memory_budget)
 
 
-def shuffle_dataset(filenames):
-  """Shuffles the dataset."""
+def shuffle_dataset(filenames, memory_budget_mb=None, mix_shards=None):
+  """Shuffles the dataset.
+
+  Args:
+    filenames: list of unshuffled TFRecord files.
+    memory_budget_mb: approximate megabytes of records held in memory at once,
+      summed over all shuffling processes. Larger inputs are shuffled through
+      temporary bucket files next to the outputs. Defaults to
+      --shuffle_memory_budget_mb if that flag is defined, else no limit.
+    mix_shards: whether to shuffle records across the shards of each split
+      (e.g. all train shards together) instead of within each file. Defaults
+      to --shuffle_mix_shards if that flag is defined, else False.
+  """
   if outputs_exist(filenames):
     tf.logging.info("Skipping shuffle because output files exist")
     return
+  if memory_budget_mb is None:
+    memory_budget_mb = _datagen_flag("shuffle_memory_budget_mb")
+  if mix_shards is None:
+    mix_shards = bool(_datagen_flag("shuffle_mix_shards"))
   tf.logging.info("Shuffling data...")
-  if len(filenames) > 1:
-    pool = mp.Pool(min(len(filenames), 20))
-    pool.map(_shuffle_single, filenames)
+
+  if mix_shards:
+    groups = collections.OrderedDict()
+    for fname in filenames:
+      groups.setdefault(_shard_group(fname), []).append(fname)
+    groups = list(groups.values())
   else:
-    _shuffle_single(filenames[0])
+    groups = [[fname] for fname in filenames]
+  num_processes = min(len(groups), 20)
+  memory_budget = None
+  if memory_budget_mb:
+    memory_budget = memory_budget_mb * 1024 * 1024 / num_processes
+
+  args = [(group, memory_budget) for group in groups]
+  if num_processes > 1:
+    pool = mp.Pool(num_processes)
+    pool.map(_shuffle_group, args)
+  else:
+    _shuffle_group(args[0])
   tf.logging.info("Data shuffled.")
 
 
@@ -516,6 +771,9 @@ class SequencePacker(object):
   def can_fit(self, ids, packed_length):
     return len(self._ids) + self._spacing + len(ids) <= packed_length
 
+  def remaining(self, packed_length):
+    return packed_length - len(self._ids)
+
   def to_dict(self):
     return {"inputs": [0],
             "targets": self._ids,
@@ -541,6 +799,10 @@ class SequencePairPacker(object):
     return (self._inputs.can_fit(pair[0], packed_length) and
             self._targets.can_fit(pair[1], packed_length))
 
+  def remaining(self, packed_length):
+    return min(self._inputs.remaining(packed_length),
+               self._targets.remaining(packed_length))
+
   def to_dict(self):
     ret = self._targets.to_dict()
     inputs_dict = self._inputs.to_dict()
@@ -550,12 +812,59 @@ class SequencePairPacker(object):
     return ret
 
 
+class _BestFitBins(object):
+  """Open packers indexed by remaining capacity, for best-fit lookup."""
+
+  def __init__(self, packed_length):
+    self._packed_length = packed_length
+    self._bins = {}  # remaining capacity -> list of packers
+    self._capacities = []  # sorted capacities with at least one packer
+    self._size = 0
+
+  def __len__(self):
+    return self._size
+
+  def add(self, packer):
+    capacity = packer.remaining(self._packed_length)
+    if capacity not in self._bins:
+      self._bins[capacity] = []
+      bisect.insort(self._capacities, capacity)
+    self._bins[capacity].append(packer)
+    self._size += 1
+
+  def _pop(self, capacity, index=-1):
+    packers = self._bins[capacity]
+    packer = packers.pop(index)
+    if not packers:
+      del self._bins[capacity]
+      del self._capacities[bisect.bisect_left(self._capacities, capacity)]
+    self._size -= 1
+    return packer
+
+  def pop_best_fit(self, x, needed):
+    """Removes and returns the fullest packer that fits x, or None."""
+    start = bisect.bisect_left(self._capacities, needed)
+    for capacity in self._capacities[start:]:
+      for index, packer in enumerate(self._bins[capacity]):
+        if packer.can_fit(x, self._packed_length):
+          return self._pop(capacity, index)
+    return None
+
+  def pop_fullest(self):
+    return self._pop(self._capacities[0])
+
+  def pop_all(self):
+    while self._size:
+      yield self.pop_fullest()
+
+
 def pack_examples(examples,
                   has_inputs,
                   packed_length=256,
                   spacing=2,
-                  queue_size=10,
-                  chop_long_sequences=False):
+                  queue_size=100,
+                  chop_long_sequences=False,
+                  window_size=1000):
   """Pack examples into longer examples.
 
   If has_inputs=False, we are packing single-sequence examples with
@@ -573,6 +882,13 @@ def pack_examples(examples,
   (as above) and concatenating the targets (as above).  Chopping of
   long sequences is not supported.
 
+  Packing is best-fit decreasing: examples are read in windows of
+  window_size, sorted longest first, and each goes to the open packed example
+  with the least remaining room that still fits it.  At most queue_size packed
+  examples are kept open; beyond that the fullest ones are emitted.  For
+  sequence pairs, room is the smaller of the inputs and targets room.  The
+  fraction of non-padding positions is logged at the end.
+
   The packed examples are represented as dictionaries containing:
     "inputs", "targets": the packed sequences described above
     "inputs_segmentation", "targets_segmentation":
@@ -591,37 +907,80 @@ def pack_examples(examples,
     has_inputs: a boolean
     packed_length: an integer
     spacing: an integer
-    queue_size: an integer
+    queue_size: an integer, how many packed examples are kept open.
     chop_long_sequences: a boolean
+    window_size: an integer, how many examples are sorted together.
 
   Yields:
     feature dictionaries.
   """
   packer = SequencePairPacker if has_inputs else SequencePacker
-  combined = []
+  keys = ["inputs", "targets"] if has_inputs else ["targets"]
+  bins = _BestFitBins(packed_length)
+  window = []
+  stats = collections.Counter()
+
+  def size(x):
+    return max(len(x[0]), len(x[1])) if has_inputs else len(x)
+
+  def needed(x):
+    # Lower bound on the room (see SequencePairPacker.remaining) that x takes.
+    return (min(len(x[0]), len(x[1])) if has_inputs else len(x)) + spacing
+
+  def emit(p):
+    packed = p.to_dict()
+    stats["packed"] += 1
+    for key in keys:
+      stats["tokens"] += sum(1 for s in packed[key + "_segmentation"] if s)
+      stats["slots"] += max(len(packed[key]), packed_length)
+    return packed
+
+  def pack_window():
+    window.sort(key=size, reverse=True)
+    for x in window:
+      p = bins.pop_best_fit(x, needed(x))
+      if p is None:
+        p = packer(x, spacing)
+      else:
+        p.add(x)
+      if p.remaining(packed_length) <= spacing:
+        yield emit(p)
+        continue
+      bins.add(p)
+    del window[:]
+    while len(bins) > queue_size:
+      yield emit(bins.pop_fullest())
+
   for example in examples:
     x = ((example["inputs"], example["targets"])
          if has_inputs else example["targets"])
+    stats["examples"] += 1
     if chop_long_sequences and len(x) > packed_length:
       assert not has_inputs
       num_fragments = len(x) // packed_length
       for i in range(num_fragments):
-        yield packer(
-            x[packed_length * i:packed_length * (i + 1)], spacing).to_dict()
+        yield emit(packer(
+            x[packed_length * i:packed_length * (i + 1)], spacing))
       x = x[packed_length * num_fragments:]
-    added = False
-    for c in combined:
-      if c.can_fit(x, packed_length):
-        c.add(x)
-        added = True
-        break
-    if not added:
-      if len(combined) == queue_size:
-        yield combined[0].to_dict()
-        combined = combined[1:]
-      combined.append(packer(x, spacing))
-  for c in combined:
-    yield c.to_dict()
+      if not x:
+        continue
+    if size(x) > packed_length:
+      yield emit(packer(x, spacing))
+      continue
+    window.append(x)
+    if len(window) >= window_size:
+      for packed in pack_window():
+        yield packed
+  for packed in pack_window():
+    yield packed
+  for p in bins.pop_all():
+    yield emit(p)
+
+  if stats["packed"]:
+    tf.logging.info(
+        "Packed %d examples into %d; packing efficiency %.1f%%",
+        stats["examples"], stats["packed"],
+        100.0 * stats["tokens"] / max(stats["slots"], 1))
 
 
 def make_tmp_dir(suffix="", prefix="tmp", dir=None):  # pylint: disable=redefined-builtin
@@ -48,6 +48,70 @@ class GeneratorUtilsTest(tf.test.TestCase):
     os.remove(tmp_file_path + "-train-00000-of-00001")
     os.remove(tmp_file_path)
 
+  def testGenerateFilesParallel(self):
+    tmp_dir = self.get_temp_dir()
+
+    def test_generator():
+      for i in range(1000):
+        yield {"inputs": [i], "targets": [i, i + 1]}
+
+    serial = generator_utils.train_data_filenames("serial", tmp_dir, 3)
+    generator_utils.generate_files(test_generator(), serial, cycle_every_n=7)
+    parallel = generator_utils.train_data_filenames("parallel", tmp_dir, 3)
+    generator_utils.generate_files(test_generator(), parallel, cycle_every_n=7,
+                                   num_workers=2)
+
+    for serial_name, parallel_name in zip(serial, parallel):
+      self.assertFalse(tf.gfile.Exists(parallel_name + ".incomplete"))
+      self.assertEqual(generator_utils.read_records(serial_name),
+                       generator_utils.read_records(parallel_name))
+
+  def testShuffleDatasetExternal(self):
+    tmp_dir = self.get_temp_dir()
+
+    def test_generator():
+      for i in range(1000):
+        yield {"inputs": [i], "targets": [i, i + 1]}
+
+    name = "shuffle" + generator_utils.UNSHUFFLED_SUFFIX
+    unshuffled = generator_utils.train_data_filenames(name, tmp_dir, 3)
+    generator_utils.generate_files(test_generator(), unshuffled)
+    before = [generator_utils.read_records(fname) for fname in unshuffled]
+
+    # A budget of a few kilobytes forces many bucket files.
+    generator_utils.shuffle_dataset(unshuffled, memory_budget_mb=0.005,
+                                    mix_shards=True)
+    shuffled = [fname.replace(generator_utils.UNSHUFFLED_SUFFIX, "")
+                for fname in unshuffled]
+    after = [generator_utils.read_records(fname) for fname in shuffled]
+
+    self.assertFalse(any(tf.gfile.Exists(fname) for fname in unshuffled))
+    self.assertEqual([len(records) for records in before],
+                     [len(records) for records in after])
+    self.assertEqual(sorted(sum(before, [])), sorted(sum(after, [])))
+    # Records moved across shards.
+    self.assertNotEqual(sorted(before[0]), sorted(after[0]))
+
+  def testPackExamples(self):
+    lengths = [200, 30, 120, 50, 250, 60, 5, 130, 1, 100]
+    examples = [{"targets": list(range(1, n + 1))} for n in lengths]
+    packed = list(generator_utils.pack_examples(
+        examples, has_inputs=False, packed_length=256, window_size=4))
+
+    unpacked = []
+    for ex in packed:
+      self.assertLessEqual(len(ex["targets"]), 256)
+      segmentation = ex["targets_segmentation"]
+      for segment in sorted(set(segmentation) - {0}):
+        ids = [t for t, s in zip(ex["targets"], segmentation) if s == segment]
+        positions = [p for p, s in zip(ex["targets_position"], segmentation)
+                     if s == segment]
+        self.assertEqual(list(range(len(ids))), positions)
+        unpacked.append(ids)
+    self.assertEqual(sorted(ex["targets"] for ex in examples), sorted(unpacked))
+    # 946 tokens plus spacing cannot fit in fewer than 4 examples of 256.
+    self.assertEqual(4, len(packed))
+
   def testMaybeDownload(self):
     tmp_dir = self.get_temp_dir()
     (_, tmp_file_path) = tempfile.mkstemp(dir=tmp_dir)
@@ -26,8 +26,10 @@ from __future__ import print_function
 import collections
 from itertools import chain
 import math
+import multiprocessing as mp
 import re
 import tempfile
+import zlib
 import numpy as np
 import six
 from six.moves import range  # pylint: disable=redefined-builtin
@@ -55,6 +57,9 @@ else:
 _UNESCAPE_REGEX = re.compile(r"\\u|\\\\|\\([0-9]+);")
 _ESCAPE_CHARS = set(u"\\_u;0123456789")
 
+# Key marking a complete subtoken in the subtoken trie; never a character.
+_TRIE_ID = None
+
 
 # Unicode utility functions that work with Python 2 and 3
 def native_to_unicode(s):
@@ -445,6 +450,223 @@ def _unescape_token(escaped_token):
   return _UNESCAPE_REGEX.sub(match, trimmed)
 
 
+# Default bound on the number of candidate subtokens counted at once.
+_MAX_SUBTOKEN_CANDIDATES = 1 << 23
+
+
+def _candidate_partition(subtoken_string, num_partitions):
+  """Hash partition of a candidate, the same in every process."""
+  return ((zlib.crc32(subtoken_string.encode("utf-8")) & 0xffffffff) %
+          num_partitions)
+
+
+def _count_subtoken_candidates(encoder, token_count_items,
+                               max_subtoken_length=None, partition=None,
+                               max_candidates=None):
+  """Counts substrings of escaped tokens that break along subtoken boundaries.
+
+  Args:
+    encoder: a SubwordTextEncoder holding the current alphabet and subtokens.
+    token_count_items: an iterable of (token, count) pairs.
+    max_subtoken_length: Maximum length of a candidate subtoken, or None.
+    partition: None, or a pair (index, num_partitions) to only count the
+      candidates in that hash partition.
+    max_candidates: None, or the number of distinct candidates past which
+      counting stops.
+  Returns:
+    a defaultdict mapping candidate subtoken strings to counts, or None if
+    there are more than max_candidates of them.
+  """
+  subtoken_counts = collections.defaultdict(int)
+  for token, count in token_count_items:
+    escaped_token = _escape_token(token, encoder._alphabet)  # pylint: disable=protected-access
+    subtokens = encoder._escaped_token_to_subtoken_strings(escaped_token)  # pylint: disable=protected-access
+    start = 0
+    for subtoken in subtokens:
+      last_position = len(escaped_token) + 1
+      if max_subtoken_length is not None:
+        last_position = min(last_position, start + max_subtoken_length)
+
+      for end in range(start + 1, last_position):
+        new_subtoken = escaped_token[start:end]
+        if (partition is not None and
+            _candidate_partition(new_subtoken, partition[1]) != partition[0]):
+          continue
+        subtoken_counts[new_subtoken] += count
+      start += len(subtoken)
+    if max_candidates is not None and len(subtoken_counts) > max_candidates:
+      return None
+  return subtoken_counts
+
+
+def _count_subtoken_candidates_shard(args):
+  """Pool worker: counts candidate subtokens for one shard of token counts."""
+  (token_count_items, alphabet, subtoken_strings, max_subtoken_length,
+   partition, max_candidates) = args
+  encoder = SubwordTextEncoder()
+  encoder._alphabet = alphabet  # pylint: disable=protected-access
+  encoder._init_subtokens_from_list(subtoken_strings)  # pylint: disable=protected-access
+  subtoken_counts = _count_subtoken_candidates(
+      encoder, token_count_items, max_subtoken_length, partition,
+      max_candidates)
+  return None if subtoken_counts is None else dict(subtoken_counts)
+
+
+def _prune_subtoken_counts(subtoken_counts, min_count):
+  """Drops multi-character candidates below min_count.
+
+  Such candidates can never be accepted, and decrementing their counts only
+  lowers them further, so dropping them does not change the vocabulary.
+  Single characters are kept since alphabet counts order the final vocab.
+
+  Args:
+    subtoken_counts: a dictionary of candidate subtoken strings to counts.
+    min_count: an integer.
+  Returns:
+    a defaultdict with the surviving counts.
+  """
+  pruned = collections.defaultdict(int)
+  for subtoken_string, count in six.iteritems(subtoken_counts):
+    if count >= min_count or len(subtoken_string) == 1:
+      pruned[subtoken_string] = count
+  return pruned
+
+
+class _SubtokenCandidateCounter(object):
+  """Counts candidate subtokens for vocab building, optionally in parallel.
+
+  Token counts are split into shards that are segmented and counted in a
+  process pool and merged in the parent. At most max_candidates distinct
+  candidates are held at once: past that, candidates are counted one hash
+  partition at a time. A partition holds the full counts of its candidates,
+  so it is pruned to min_count before the next one is counted, and the
+  result is the same as counting everything at once.
+
+  The first iteration segments every token into single characters whatever
+  min_count is. When bisection probes min_counts above min_prune_count, its
+  counts are computed once, pruned at min_prune_count, and reused by every
+  probe.
+  """
+
+  def __init__(self, token_counts, max_subtoken_length=None, num_workers=None,
+               min_prune_count=1, max_candidates=_MAX_SUBTOKEN_CANDIDATES):
+    self.token_count_items = list(six.iteritems(token_counts))
+    self.max_subtoken_length = max_subtoken_length
+    self.min_prune_count = max(min_prune_count, 1)
+    self.max_candidates = max_candidates
+    self._num_partitions = 1
+    self._initial_counts = None
+    self._pool = None
+    self._shards = [self.token_count_items]
+    if num_workers is not None and num_workers > 1:
+      num_shards = num_workers * 4
+      shard_size = int(math.ceil(len(self.token_count_items) / num_shards))
+      self._shards = [
+          self.token_count_items[i:i + shard_size]
+          for i in range(0, len(self.token_count_items), max(shard_size, 1))
+      ]
+      self._pool = mp.Pool(num_workers)
+
+  def _count_partition(self, encoder, partition):
+    """Returns the counts of one partition, or None past max_candidates."""
+    if self._pool is None:
+      return _count_subtoken_candidates(
+          encoder, self.token_count_items, self.max_subtoken_length,
+          partition, self.max_candidates)
+
+    subtoken_strings = list(encoder._subtoken_string_to_id)  # pylint: disable=protected-access
+    args = [(shard, encoder._alphabet, subtoken_strings,  # pylint: disable=protected-access
+             self.max_subtoken_length, partition, self.max_candidates)
+            for shard in self._shards]
+    subtoken_counts = collections.defaultdict(int)
+    for shard_counts in self._pool.imap_unordered(
+        _count_subtoken_candidates_shard, args):
+      if shard_counts is None:
+        return None
+      for subtoken_string, count in six.iteritems(shard_counts):
+        subtoken_counts[subtoken_string] += count
+      del shard_counts
+      if (self.max_candidates is not None and
+          len(subtoken_counts) > self.max_candidates):
+        return None
+    return subtoken_counts
+
+  def count(self, encoder, min_count, initial=False):
+    """Returns pruned candidate counts for the encoder's current subtokens."""
+    if initial and self._initial_counts is not None:
+      return _prune_subtoken_counts(self._initial_counts, min_count)
+
+    prune_count = self.min_prune_count if initial else min_count
+    while True:
+      subtoken_counts = collections.defaultdict(int)
+      for index in range(self._num_partitions):
+        partition = (None if self._num_partitions == 1 else
+                     (index, self._num_partitions))
+        partition_counts = self._count_partition(encoder, partition)
+        if partition_counts is None:
+          break
+        subtoken_counts.update(
+            _prune_subtoken_counts(partition_counts, prune_count))
+        del partition_counts
+      else:
+        break
+      # Too many candidates at once: retry with smaller partitions.
+      del subtoken_counts
+      self._num_partitions *= 2
+      tf.logging.info("Counting subtoken candidates in %d partitions" %
+                      self._num_partitions)
+
+    if initial and self.min_prune_count < min_count:
+      self._initial_counts = subtoken_counts
+      return _prune_subtoken_counts(subtoken_counts, min_count)
+    return subtoken_counts
+
+  def close(self):
+    if self._pool is not None:
+      self._pool.close()
+      self._pool.join()
+      self._pool = None
+
+
+class _LRUCache(object):
+  """Bounded least-recently-used cache with hit and miss counters."""
+
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self.hits = 0
+    self.misses = 0
+    self._data = collections.OrderedDict()
+
+  def get(self, key):
+    """Returns the cached value and marks it most recent, or None."""
+    try:
+      value = self._data.pop(key)
+    except KeyError:
+      self.misses += 1
+      return None
+    self._data[key] = value
+    self.hits += 1
+    return value
+
+  def put(self, key, value):
+    self._data[key] = value
+    if len(self._data) > self.capacity:
+      self._data.popitem(last=False)
+
+  def __len__(self):
+    return len(self._data)
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+        "hits": self.hits,
+        "misses": self.misses,
+        "size": len(self._data),
+        "capacity": self.capacity,
+        "hit_rate": self.hits / lookups if lookups else 0.0,
+    }
+
+
 class SubwordTextEncoder(TextEncoder):
   """Class for invertibly encoding text using a limited vocabulary.
 
@@ -502,6 +724,21 @@ class SubwordTextEncoder(TextEncoder):
     return self._tokens_to_subtoken_ids(
         tokenizer.encode(native_to_unicode(s)))
 
+  def encode_many(self, strings):
+    """Converts a list of native strings to lists of subtoken ids.
+
+    Tokens repeated across the batch are escaped and segmented once and then
+    served from the token cache.
+
+    Args:
+      strings: a list of native strings.
+    Returns:
+      a list of lists of integers in the range [0, vocab_size)
+    """
+    tokens_to_subtoken_ids = self._tokens_to_subtoken_ids
+    return [tokens_to_subtoken_ids(tokenizer.encode(native_to_unicode(s)))
+            for s in strings]
+
   def encode_without_tokenizing(self, token_text):
     """Converts string to list of subtoken ids without calling tokenizer.
 
@@ -564,15 +801,18 @@ class SubwordTextEncoder(TextEncoder):
     Returns:
       a list of integers in the range [0, vocab_size)
     """
-    cache_location = hash(token) % self._cache_size
-    cache_key, cache_value = self._cache[cache_location]
-    if cache_key == token:
-      return cache_value
-    ret = self._escaped_token_to_subtoken_ids(
-        _escape_token(token, self._alphabet))
-    self._cache[cache_location] = (token, ret)
+    ret = self._cache.get(token)
+    if ret is None:
+      ret = self._escaped_token_to_subtoken_ids(
+          _escape_token(token, self._alphabet))
+      self._cache.put(token, ret)
     return ret
 
+  @property
+  def cache_stats(self):
+    """Hit, miss and occupancy counters of the token cache."""
+    return self._cache.stats()
+
   def _subtoken_ids_to_tokens(self, subtokens):
     """Converts a list of subtoken ids to a list of tokens.
 
@@ -598,36 +838,60 @@ class SubwordTextEncoder(TextEncoder):
       return self._all_subtoken_strings[subtoken]
     return u""
 
-  def _escaped_token_to_subtoken_strings(self, escaped_token):
-    """Converts an escaped token string to a list of subtoken strings.
+  def _escaped_token_to_subtoken_spans(self, escaped_token):
+    """Greedily splits an escaped token into (start, end, id) subtoken spans.
+
+    Each span is the longest subtoken in the vocabulary that is a prefix of
+    the remaining portion of the token, found in a single walk down the
+    subtoken trie.
 
     Args:
       escaped_token: An escaped token as a unicode string.
     Returns:
-      A list of subtokens as unicode strings.
+      A list of (start, end, subtoken id) tuples.
     """
     # NOTE: This algorithm is greedy; it won't necessarily produce the "best"
     # list of subtokens.
     ret = []
     start = 0
     token_len = len(escaped_token)
+    trie = self._subtoken_trie
     while start < token_len:
-      for end in range(
-          min(token_len, start + self._max_subtoken_len), start, -1):
-        subtoken = escaped_token[start:end]
-        if subtoken in self._subtoken_string_to_id:
-          ret.append(subtoken)
-          start = end
+      node = trie
+      end, subtoken_id = start, None
+      pos = start
+      while pos < token_len:
+        node = node.get(escaped_token[pos])
+        if node is None:
           break
+        pos += 1
+        if _TRIE_ID in node:
+          end, subtoken_id = pos, node[_TRIE_ID]
 
-      else:  # Did not break
+      if subtoken_id is None:
         # If there is no possible encoding of the escaped token then one of the
         # characters in the token is not in the alphabet. This should be
         # impossible and would be indicative of a bug.
         assert False, "Token substring not found in subtoken vocabulary."
 
+      ret.append((start, end, subtoken_id))
+      start = end
+
     return ret
 
+  def _escaped_token_to_subtoken_strings(self, escaped_token):
+    """Converts an escaped token string to a list of subtoken strings.
+
+    Args:
+      escaped_token: An escaped token as a unicode string.
+    Returns:
+      A list of subtokens as unicode strings.
+    """
+    return [
+        escaped_token[start:end]
+        for start, end, _ in self._escaped_token_to_subtoken_spans(escaped_token)
+    ]
+
   def _escaped_token_to_subtoken_ids(self, escaped_token):
     """Converts an escaped token string to a list of subtoken IDs.
 
@@ -637,8 +901,9 @@ class SubwordTextEncoder(TextEncoder):
       A list of subtoken IDs as integers.
     """
     return [
-        self._subtoken_string_to_id[subtoken]
-        for subtoken in self._escaped_token_to_subtoken_strings(escaped_token)
+        subtoken_id
+        for _, _, subtoken_id in self._escaped_token_to_subtoken_spans(
+            escaped_token)
     ]
 
   @classmethod
@@ -646,7 +911,8 @@ class SubwordTextEncoder(TextEncoder):
                            generator,
                            target_vocab_size,
                            max_subtoken_length=None,
-                           reserved_tokens=None):
+                           reserved_tokens=None,
+                           num_workers=None):
     """Builds a SubwordTextEncoder from the generated text.
 
     Args:
@@ -659,6 +925,8 @@ class SubwordTextEncoder(TextEncoder):
       reserved_tokens: List of reserved tokens. The global variable
         `RESERVED_TOKENS` must be a prefix of `reserved_tokens`. If this
         argument is `None`, it will use `RESERVED_TOKENS`.
+      num_workers: Number of processes counting candidate subtokens. If None
+        or 1, counting happens in this process.
 
     Returns:
       SubwordTextEncoder with `vocab_size` approximately `target_vocab_size`.
@@ -670,7 +938,8 @@ class SubwordTextEncoder(TextEncoder):
     encoder = cls.build_to_target_size(
         target_vocab_size, token_counts, 1, 1e3,
         max_subtoken_length=max_subtoken_length,
-        reserved_tokens=reserved_tokens)
+        reserved_tokens=reserved_tokens,
+        num_workers=num_workers)
     return encoder
 
   @classmethod
@@ -681,11 +950,13 @@ class SubwordTextEncoder(TextEncoder):
                            max_val,
                            max_subtoken_length=None,
                            reserved_tokens=None,
-                           num_iterations=4):
+                           num_iterations=4,
+                           num_workers=None):
     """Builds a SubwordTextEncoder that has `vocab_size` near `target_size`.
 
     Uses simple recursive binary search to find a minimum token count that most
-    closely matches the `target_size`.
+    closely matches the `target_size`. All probes share one candidate counter,
+    so the first refinement iteration is only counted once.
 
     Args:
       target_size: Desired vocab_size to approximate.
@@ -700,6 +971,8 @@ class SubwordTextEncoder(TextEncoder):
         `RESERVED_TOKENS` must be a prefix of `reserved_tokens`. If this
         argument is `None`, it will use `RESERVED_TOKENS`.
       num_iterations: An integer; how many iterations of refinement.
+      num_workers: Number of processes counting candidate subtokens. If None
+        or 1, counting happens in this process.
 
     Returns:
       A SubwordTextEncoder instance.
@@ -716,14 +989,17 @@ class SubwordTextEncoder(TextEncoder):
     if reserved_tokens is None:
       reserved_tokens = RESERVED_TOKENS
 
+    counter = _SubtokenCandidateCounter(
+        token_counts, max_subtoken_length=max_subtoken_length,
+        num_workers=num_workers, min_prune_count=min_val)
+
     def bisect(min_val, max_val):
       """Bisection to find the right size."""
       present_count = (max_val + min_val) // 2
       tf.logging.info("Trying min_count %d" % present_count)
       subtokenizer = cls()
-      subtokenizer.build_from_token_counts(
-          token_counts, present_count, num_iterations,
-          max_subtoken_length=max_subtoken_length,
+      subtokenizer._build_from_candidate_counter(  # pylint: disable=protected-access
+          counter, present_count, num_iterations,
           reserved_tokens=reserved_tokens)
 
       # Being within 1% of the target size is ok.
@@ -745,14 +1021,18 @@ class SubwordTextEncoder(TextEncoder):
         return other_subtokenizer
       return subtokenizer
 
-    return bisect(min_val, max_val)
+    try:
+      return bisect(min_val, max_val)
+    finally:
+      counter.close()
 
   def build_from_token_counts(self,
                               token_counts,
                               min_count,
                               num_iterations=4,
                               reserved_tokens=None,
-                              max_subtoken_length=None):
+                              max_subtoken_length=None,
+                              num_workers=None):
     """Train a SubwordTextEncoder based on a dictionary of word counts.
 
     Args:
@@ -766,12 +1046,39 @@ class SubwordTextEncoder(TextEncoder):
         then the runtime and memory use of creating the vocab is quadratic in
         the length of the longest token. If this is set, then it is instead
         O(max_subtoken_length * length of longest token).
+      num_workers: Number of processes counting candidate subtokens. If None
+        or 1, counting happens in this process.
 
     Raises:
       ValueError: if reserved is not 0 or len(RESERVED_TOKENS). In this case, it
         is not clear what the space is being reserved for, or when it will be
         filled in.
     """
+    counter = _SubtokenCandidateCounter(
+        token_counts, max_subtoken_length=max_subtoken_length,
+        num_workers=num_workers, min_prune_count=min_count)
+    try:
+      self._build_from_candidate_counter(
+          counter, min_count, num_iterations, reserved_tokens=reserved_tokens)
+    finally:
+      counter.close()
+
+  def _build_from_candidate_counter(self,
+                                    counter,
+                                    min_count,
+                                    num_iterations=4,
+                                    reserved_tokens=None):
+    """Train a SubwordTextEncoder from a _SubtokenCandidateCounter.
+
+    Args:
+      counter: a _SubtokenCandidateCounter over the token counts.
+      min_count: an integer - discard subtokens with lower counts.
+      num_iterations: an integer.  how many iterations of refinement.
+      reserved_tokens: List of reserved tokens, as in build_from_token_counts.
+
+    Raises:
+      ValueError: if `RESERVED_TOKENS` is not a prefix of `reserved_tokens`.
+    """
     if reserved_tokens is None:
       reserved_tokens = RESERVED_TOKENS
     else:
@@ -783,7 +1090,7 @@ class SubwordTextEncoder(TextEncoder):
 
     # Initialize the alphabet. Note, this must include reserved tokens or it can
     # result in encoding failures.
-    alphabet_tokens = chain(six.iterkeys(token_counts),
+    alphabet_tokens = chain((token for token, _ in counter.token_count_items),
                             [native_to_unicode(t) for t in reserved_tokens])
 
     self._init_alphabet_from_tokens(alphabet_tokens)
@@ -802,21 +1109,8 @@ class SubwordTextEncoder(TextEncoder):
       tf.logging.info("Iteration {0}".format(i))
 
       # Collect all substrings of the encoded token that break along current
-      # subtoken boundaries.
-      subtoken_counts = collections.defaultdict(int)
-      for token, count in six.iteritems(token_counts):
-        escaped_token = _escape_token(token, self._alphabet)
-        subtokens = self._escaped_token_to_subtoken_strings(escaped_token)
-        start = 0
-        for subtoken in subtokens:
-          last_position = len(escaped_token) + 1
-          if max_subtoken_length is not None:
-            last_position = min(last_position, start + max_subtoken_length)
-
-          for end in range(start + 1, last_position):
-            new_subtoken = escaped_token[start:end]
-            subtoken_counts[new_subtoken] += count
-          start += len(subtoken)
+      # subtoken boundaries, dropping those that can never reach min_count.
+      subtoken_counts = counter.count(self, min_count, initial=(i == 0))
 
       # Array of sets of candidate subtoken strings, by length.
       len_to_subtoken_strings = []
@@ -895,9 +1189,16 @@ class SubwordTextEncoder(TextEncoder):
         s: i + len(reserved_tokens)
         for i, s in enumerate(subtoken_strings) if s
     }
+    # Prefix trie over the subtoken strings for longest-match segmentation.
+    self._subtoken_trie = {}
+    for subtoken, subtoken_id in six.iteritems(self._subtoken_string_to_id):
+      node = self._subtoken_trie
+      for c in subtoken:
+        node = node.setdefault(c, {})
+      node[_TRIE_ID] = subtoken_id
     # Initialize the cache to empty.
     self._cache_size = 2 ** 20
-    self._cache = [(None, None)] * self._cache_size
+    self._cache = _LRUCache(self._cache_size)
 
   def _init_alphabet_from_tokens(self, tokens):
     """Initialize alphabet from an iterable of token or subtoken strings."""
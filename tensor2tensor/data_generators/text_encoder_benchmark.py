@@ -0,0 +1,109 @@
+# coding=utf-8
+# Copyright 2018 The Tensor2Tensor Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+r"""Benchmark SubwordTextEncoder encoding against the slicing reference.
+
+Encodes a corpus with the trie matcher and LRU cache, checks the ids are
+identical to the original slice-and-probe greedy segmentation, and reports
+throughput and cache statistics.
+
+Example usage:
+
+python data_generators/text_encoder_benchmark.py \
+    --vocab_filename=$DATA_DIR/vocab.translate_ende_wmt32k.32768 \
+    --corpus_filepattern=$DATA_DIR/train.en \
+    --corpus_max_lines=100000 \
+    --logtostderr
+
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+from tensor2tensor.data_generators import text_encoder
+from tensor2tensor.data_generators import tokenizer
+
+import tensorflow as tf
+
+tf.flags.DEFINE_string('vocab_filename', '', 'SubwordTextEncoder vocab file')
+tf.flags.DEFINE_string('corpus_filepattern', '',
+                       'Corpus of one or more text files')
+tf.flags.DEFINE_integer('corpus_max_lines', 100000,
+                        'How many lines of corpus to read')
+tf.flags.DEFINE_integer('batch_size', 256, 'Lines per encode_many call')
+FLAGS = tf.flags.FLAGS
+
+
+def reference_encode(encoder, s):
+  """Slice-and-probe greedy segmentation without caching."""
+  ret = []
+  for token in tokenizer.encode(text_encoder.native_to_unicode(s)):
+    escaped_token = text_encoder._escape_token(token, encoder._alphabet)  # pylint: disable=protected-access
+    start = 0
+    token_len = len(escaped_token)
+    while start < token_len:
+      for end in range(
+          min(token_len, start + encoder._max_subtoken_len), start, -1):  # pylint: disable=protected-access
+        subtoken = escaped_token[start:end]
+        if subtoken in encoder._subtoken_string_to_id:  # pylint: disable=protected-access
+          ret.append(encoder._subtoken_string_to_id[subtoken])  # pylint: disable=protected-access
+          start = end
+          break
+  return ret
+
+
+def read_lines(filepattern, max_lines):
+  lines = []
+  for filename in tf.gfile.Glob(filepattern):
+    with tf.gfile.Open(filename) as f:
+      for line in f:
+        lines.append(line.strip())
+        if len(lines) >= max_lines:
+          return lines
+  return lines
+
+
+def main(unused_argv):
+  encoder = text_encoder.SubwordTextEncoder(FLAGS.vocab_filename)
+  lines = read_lines(FLAGS.corpus_filepattern, FLAGS.corpus_max_lines)
+
+  start = time.time()
+  reference = [reference_encode(encoder, line) for line in lines]
+  reference_time = time.time() - start
+
+  start = time.time()
+  encoded = []
+  for i in range(0, len(lines), FLAGS.batch_size):
+    encoded.extend(encoder.encode_many(lines[i:i + FLAGS.batch_size]))
+  encode_time = time.time() - start
+
+  mismatches = sum(1 for a, b in zip(reference, encoded) if a != b)
+  num_ids = sum(len(ids) for ids in encoded)
+  tf.logging.info('lines = %d, subtokens = %d, mismatches = %d', len(lines),
+                  num_ids, mismatches)
+  tf.logging.info('reference: %.3fs (%.1f lines/s)', reference_time,
+                  len(lines) / max(reference_time, 1e-8))
+  tf.logging.info('trie + lru: %.3fs (%.1f lines/s)', encode_time,
+                  len(lines) / max(encode_time, 1e-8))
+  tf.logging.info('cache stats: %s', encoder.cache_stats)
+  if mismatches:
+    raise ValueError('%d lines encoded differently from the reference' %
+                     mismatches)
+
+
+if __name__ == '__main__':
+  tf.logging.set_verbosity(tf.logging.INFO)
+  tf.app.run()
@@ -366,6 +366,106 @@ class SubwordTextEncoderTest(tf.test.TestCase):
     reconstructed_corpus = encoder.decode(encoder.encode(corpus))
     self.assertEqual(corpus, reconstructed_corpus)
 
+  def test_trie_matches_greedy_longest_match(self):
+    corpus = (
+        "This is a corpus of text that provides a bunch of tokens from which "
+        "to build a vocabulary. It will be used when strings are encoded "
+        "with a TextEncoder subclass. The encoder was coded by a coder.")
+    token_counts = collections.Counter(corpus.split(" "))
+    encoder = text_encoder.SubwordTextEncoder.build_to_target_size(
+        100, token_counts, 2, 10)
+
+    def greedy_subtoken_strings(escaped_token):
+      ret = []
+      start = 0
+      while start < len(escaped_token):
+        for end in range(
+            min(len(escaped_token), start + encoder._max_subtoken_len), start,
+            -1):
+          if escaped_token[start:end] in encoder._subtoken_string_to_id:
+            ret.append(escaped_token[start:end])
+            start = end
+            break
+      return ret
+
+    random.seed(1234)
+    for token in list(token_counts) + ["encodedTextEncoder", "coderscoded"]:
+      for _ in range(5):
+        escaped = text_encoder._escape_token(token, encoder._alphabet)
+        self.assertEqual(greedy_subtoken_strings(escaped),
+                         encoder._escaped_token_to_subtoken_strings(escaped))
+        token = "".join(random.sample(token, len(token)))
+
+  def test_lru_cache(self):
+    cache = text_encoder._LRUCache(2)
+    cache.put("a", [1])
+    cache.put("b", [2])
+    self.assertEqual([1], cache.get("a"))
+    cache.put("c", [3])
+    # "b" was least recently used and is evicted.
+    self.assertIsNone(cache.get("b"))
+    self.assertEqual([1], cache.get("a"))
+    self.assertEqual([3], cache.get("c"))
+    stats = cache.stats()
+    self.assertEqual(3, stats["hits"])
+    self.assertEqual(1, stats["misses"])
+    self.assertEqual(2, stats["size"])
+
+  def test_encode_many(self):
+    corpus = "The quick brown fox jumps over the lazy dog"
+    token_counts = collections.Counter(corpus.split(" "))
+    encoder = text_encoder.SubwordTextEncoder.build_to_target_size(
+        10, token_counts, 2, 10)
+
+    strings = [corpus, "the lazy fox", corpus]
+    self.assertEqual([encoder.encode(s) for s in strings],
+                     encoder.encode_many(strings))
+    self.assertGreater(encoder.cache_stats["hits"], 0)
+
+  def test_parallel_build_matches_serial(self):
+    corpus = (
+        "This is a corpus of text that provides a bunch of tokens from which "
+        "to build a vocabulary. It will be used when strings are encoded "
+        "with a TextEncoder subclass. The encoder was coded by a coder.")
+    token_counts = collections.Counter(corpus.split(" "))
+
+    serial = text_encoder.SubwordTextEncoder.build_to_target_size(
+        100, token_counts, 2, 10)
+    parallel = text_encoder.SubwordTextEncoder.build_to_target_size(
+        100, token_counts, 2, 10, num_workers=2)
+    self.assertEqual(serial.all_subtoken_strings,
+                     parallel.all_subtoken_strings)
+
+    encoder = text_encoder.SubwordTextEncoder()
+    encoder.build_from_token_counts(token_counts, 3, num_workers=2)
+    reference = text_encoder.SubwordTextEncoder()
+    reference.build_from_token_counts(token_counts, 3)
+    self.assertEqual(reference.all_subtoken_strings,
+                     encoder.all_subtoken_strings)
+
+  def test_partitioned_counting_matches_unbounded(self):
+    corpus = (
+        "This is a corpus of text that provides a bunch of tokens from which "
+        "to build a vocabulary. It will be used when strings are encoded "
+        "with a TextEncoder subclass. The encoder was coded by a coder.")
+    token_counts = collections.Counter(corpus.split(" "))
+
+    reference = text_encoder.SubwordTextEncoder()
+    reference.build_from_token_counts(token_counts, 2)
+
+    for num_workers in [None, 2]:
+      counter = text_encoder._SubtokenCandidateCounter(
+          token_counts, num_workers=num_workers, min_prune_count=2,
+          max_candidates=20)
+      encoder = text_encoder.SubwordTextEncoder()
+      try:
+        encoder._build_from_candidate_counter(counter, 2)
+      finally:
+        counter.close()
+      self.assertGreater(counter._num_partitions, 1)
+      self.assertEqual(reference.all_subtoken_strings,
+                       encoder.all_subtoken_strings)
+
 
 if __name__ == "__main__":
   tf.test.main()
@@ -25,6 +25,8 @@ description of the model and the results obtained with its early version.
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import copy
+import six
 from six.moves import range  # pylint: disable=redefined-builtin
 
 from tensor2tensor.data_generators import librispeech
@@ -40,6 +42,8 @@ import tensorflow as tf
 
 from tensorflow.python.util import nest
 
+# Variable scope of the draft model used for speculative decoding.
+_DRAFT_SCOPE = "draft"
 
 @registry.register_model
 class Transformer(t2t_model.T2TModel):
@@ -222,8 +226,11 @@ class Transformer(t2t_model.T2TModel):
     if self._target_modality_is_real:
       return  super(Transformer, self)._greedy_infer(features, decode_length)
     with tf.variable_scope(self.name):
-      return (self._fast_decode_tpu(features, decode_length) if use_tpu else
-              self._fast_decode(features, decode_length))
+      if use_tpu:
+        return self._fast_decode_tpu(features, decode_length)
+      if self._decode_hparams.draft_hparams_set:
+        return self._speculative_decode(features, decode_length)
+      return self._fast_decode(features, decode_length)
 
   def _beam_decode(self, features, decode_length, beam_size, top_beams, alpha):
     """Beam search decoding.
@@ -654,7 +661,10 @@ class Transformer(t2t_model.T2TModel):
         top_beams=top_beams,
         alpha=alpha,
         batch_size=batch_size,
-        force_decode_length=self._decode_hparams.force_decode_length)
+        force_decode_length=self._decode_hparams.force_decode_length,
+        # symbols_to_logits_fn closes over the batch-sized partial_targets.
+        compact_beam_search=(self._decode_hparams.compact_beam_search and
+                             partial_targets is None))
     if partial_targets is not None:
       if beam_size <= 1 or top_beams <= 1:
         ret["outputs"] = ret["outputs"][:, partial_targets_length:]
@@ -663,6 +673,179 @@ class Transformer(t2t_model.T2TModel):
     return ret
 
 
+  def _incremental_decoder(self, features, decode_length, extra_length=0):
+    """Encodes the inputs and returns a multi-token incremental decoder.
+
+    Like the decoding step in _fast_decode, but the returned step function
+    feeds several target positions at once, attending to the cache and to
+    each other causally.
+
+    Args:
+      features: a map of string to model features.
+      decode_length: an integer.  How many additional timesteps to decode.
+      extra_length: an integer.  How many positions the decoder may be fed
+        beyond the decode length.
+
+    Returns:
+      (batch_size, decode_length, cache, step_fn) where step_fn maps
+      `(ids [batch_size, n], i, cache)` to `(logits [batch_size, n, vocab],
+      cache)` for ids at positions i..i+n-1.
+    """
+    dp = self._data_parallelism
+    hparams = self._hparams
+    target_modality = self._problem_hparams.target_modality
+
+    inputs = features["inputs"]
+    decode_length = (
+        common_layers.shape_list(inputs)[1] + features.get(
+            "decode_length", decode_length))
+    inputs = tf.expand_dims(inputs, axis=1)
+    if len(inputs.shape) < 5:
+      inputs = tf.expand_dims(inputs, axis=4)
+    s = common_layers.shape_list(inputs)
+    batch_size = s[0]
+    inputs = tf.reshape(inputs, [s[0] * s[1], s[2], s[3], s[4]])
+    inputs = self._shard_features({"inputs": inputs})["inputs"]
+    input_modality = self._problem_hparams.input_modality["inputs"]
+    with tf.variable_scope(input_modality.name):
+      inputs = input_modality.bottom_sharded(inputs, dp)
+    with tf.variable_scope("body"):
+      encoder_output, encoder_decoder_attention_bias = dp(
+          self.encode,
+          inputs,
+          features["target_space_id"],
+          hparams,
+          features=features)
+    encoder_output = encoder_output[0]
+    encoder_decoder_attention_bias = encoder_decoder_attention_bias[0]
+    cache = init_fast_decode_cache(encoder_output,
+                                   encoder_decoder_attention_bias, hparams,
+                                   batch_size)
+
+    max_length = decode_length + extra_length
+    if hparams.pos == "timing":
+      positional_encoding = common_attention.get_timing_signal_1d(
+          max_length + 1, hparams.hidden_size)
+    elif hparams.pos == "emb":
+      positional_encoding = common_attention.add_positional_embedding(
+          tf.zeros([1, max_length + 1, hparams.hidden_size]),
+          hparams.max_length, "targets_positional_embedding", None)
+    else:
+      positional_encoding = None
+
+    decoder_self_attention_bias = (
+        common_attention.attention_bias_lower_triangle(max_length))
+    if hparams.proximity_bias:
+      decoder_self_attention_bias += common_attention.attention_bias_proximal(
+          max_length)
+
+    def step_fn(ids, i, cache):
+      """Go from ids at positions i..i+n-1 to logits for the next symbols."""
+      n = common_layers.shape_list(ids)[1]
+      targets = tf.expand_dims(tf.expand_dims(ids, axis=2), axis=3)
+      targets = self._shard_features({"targets": targets})["targets"]
+      with tf.variable_scope(target_modality.name):
+        targets = target_modality.targets_bottom_sharded(targets, dp)[0]
+      targets = common_layers.flatten4d3d(targets)
+
+      # As in _fast_decode, position 0 is fed zeros.
+      nonzero = tf.not_equal(tf.range(i, i + n), 0)
+      targets *= tf.reshape(tf.cast(nonzero, targets.dtype), [1, n, 1])
+      if positional_encoding is not None:
+        targets += positional_encoding[:, i:i + n]
+
+      bias = decoder_self_attention_bias[:, :, i:i + n, :i + n]
+      with tf.variable_scope("body"):
+        body_outputs = dp(
+            self.decode,
+            targets,
+            cache.get("encoder_output"),
+            cache.get("encoder_decoder_attention_bias"),
+            bias,
+            hparams,
+            cache,
+            nonpadding=features_to_nonpadding(features, "targets"))
+
+      with tf.variable_scope(target_modality.name):
+        logits = target_modality.top_sharded(body_outputs, None, dp)[0]
+      return tf.squeeze(logits, axis=[2, 3]), cache
+
+    return batch_size, decode_length, cache, step_fn
+
+  def _draft_model(self, draft_hparams):
+    """Builds the draft Transformer with the given hparams.
+
+    The draft shares this model's problem and vocabulary but has its own
+    hparams and modalities.  Its variables are local variables, so the
+    Estimator's checkpoint restore skips them, and are initialized from
+    decode_hparams.draft_checkpoint.
+    """
+    draft_problem_hparams = copy.copy(self._problem_hparams)
+    draft_problem_hparams.input_modality = {
+        f: type(m)(draft_hparams, m._vocab_size)  # pylint: disable=protected-access
+        for f, m in six.iteritems(self._problem_hparams.input_modality)}
+    target_modality = self._problem_hparams.target_modality
+    draft_problem_hparams.target_modality = type(target_modality)(
+        draft_hparams, target_modality._vocab_size)  # pylint: disable=protected-access
+
+    draft = Transformer(draft_hparams, tf.estimator.ModeKeys.PREDICT,
+                        decode_hparams=self._decode_hparams)
+    draft._problem_hparams = draft_problem_hparams  # pylint: disable=protected-access
+    return draft
+
+  def _speculative_decode(self, features, decode_length):
+    """Greedy decoding with a draft model proposing tokens.
+
+    See speculative_decode.  Falls back to _fast_decode without a draft
+    checkpoint and for settings the multi-token decoder does not support.
+
+    Args:
+      features: a map of string to model features.
+      decode_length: an integer.  How many additional timesteps to decode.
+
+    Returns:
+      A dict of decoding results, as from _fast_decode.
+    """
+    if not self._decode_hparams.draft_checkpoint:
+      # An untrained draft only slows decoding down.
+      tf.logging.warning("draft_hparams_set is set without draft_checkpoint, "
+                         "using standard greedy decoding.")
+      return self._fast_decode(features, decode_length)
+
+    draft_hparams = registry.hparams(self._decode_hparams.draft_hparams_set)
+    supported = (
+        self.has_input and self._num_datashards == 1 and
+        not self._problem_hparams.target_modality.is_class_modality and
+        self._hparams.sampling_method == "argmax")
+    # Both decoders are run on several positions at once.
+    for hparams in [self._hparams, draft_hparams]:
+      supported = supported and (
+          hparams.self_attention_type == "dot_product" and
+          hparams.ffn_layer in ["dense_relu_dense", "conv_hidden_relu"])
+    if not supported:
+      tf.logging.warning("Speculative decoding is not supported with these "
+                         "hparams, using standard greedy decoding.")
+      return self._fast_decode(features, decode_length)
+
+    num_draft_tokens = self._decode_hparams.num_draft_tokens
+    batch_size, max_decode_length, cache, step_fn = self._incremental_decoder(
+        features, decode_length, extra_length=num_draft_tokens)
+
+    draft = self._draft_model(draft_hparams)
+    with tf.variable_scope(_DRAFT_SCOPE, custom_getter=_local_variable_getter):
+      with tf.variable_scope(draft.name) as draft_scope:
+        _, _, draft_cache, draft_step_fn = draft._incremental_decoder(  # pylint: disable=protected-access
+            features, decode_length, extra_length=num_draft_tokens)
+    # Checkpoint variables are named e.g. transformer/body/...
+    tf.train.init_from_checkpoint(
+        self._decode_hparams.draft_checkpoint,
+        {draft.name + "/": draft_scope.name + "/"})
+
+    return speculative_decode(
+        step_fn, cache, draft_step_fn, draft_cache, batch_size,
+        max_decode_length, num_draft_tokens,
+        force_decode_length=self._decode_hparams.force_decode_length)
+
 def fast_decode_tpu(encoder_output,
                     encoder_decoder_attention_bias,
                     symbols_to_logits_fn,
@@ -797,6 +980,57 @@ def fast_decode_tpu(encoder_output,
   return {"outputs": decoded_ids, "scores": scores}
 
 
+def init_fast_decode_cache(encoder_output, encoder_decoder_attention_bias,
+                           hparams, batch_size):
+  """Creates the incremental decoding cache used by fast_decode.
+
+  Args:
+    encoder_output: Output from encoder, or None.
+    encoder_decoder_attention_bias: a bias tensor for use in encoder-decoder
+      attention, or None.
+    hparams: run hyperparameters
+    batch_size: an integer scalar.
+
+  Returns:
+    a dict with empty self-attention keys and values for every decoder layer
+    and, if there is an encoder, the encoder-decoder keys and values.
+  """
+  key_channels = hparams.attention_key_channels or hparams.hidden_size
+  value_channels = hparams.attention_value_channels or hparams.hidden_size
+  num_layers = hparams.num_decoder_layers or hparams.num_hidden_layers
+
+  cache = {
+      "layer_%d" % layer: {
+          "k":
+              common_attention.split_heads(
+                  tf.zeros([batch_size, 0, key_channels]), hparams.num_heads),
+          "v":
+              common_attention.split_heads(
+                  tf.zeros([batch_size, 0, value_channels]), hparams.num_heads),
+          "f":
+              tf.zeros([batch_size, 0, hparams.hidden_size]),
+      } for layer in range(num_layers)
+  }
+
+  if encoder_output is not None:
+    for layer in range(num_layers):
+      layer_name = "layer_%d" % layer
+      with tf.variable_scope(
+          "body/decoder/%s/encdec_attention/multihead_attention" % layer_name):
+        k_encdec = common_attention.compute_attention_component(
+            encoder_output, key_channels, name="k")
+        k_encdec = common_attention.split_heads(k_encdec, hparams.num_heads)
+        v_encdec = common_attention.compute_attention_component(
+            encoder_output, value_channels, name="v")
+        v_encdec = common_attention.split_heads(v_encdec, hparams.num_heads)
+      cache[layer_name]["k_encdec"] = k_encdec
+      cache[layer_name]["v_encdec"] = v_encdec
+
+    cache["encoder_output"] = encoder_output
+    cache["encoder_decoder_attention_bias"] = encoder_decoder_attention_bias
+  return cache
+
+
 def fast_decode(encoder_output,
                 encoder_decoder_attention_bias,
                 symbols_to_logits_fn,
@@ -808,7 +1042,8 @@ def fast_decode(encoder_output,
                 alpha=1.0,
                 eos_id=beam_search.EOS_ID,
                 batch_size=None,
-                force_decode_length=False):
+                force_decode_length=False,
+                compact_beam_search=False):
   """Given encoder output and a symbols to logits function, does fast decoding.
 
   Implements both greedy and beam search decoding, uses beam search iff
@@ -831,6 +1066,9 @@ def fast_decode(encoder_output,
     batch_size: an integer scalar - must be passed if there is no input
     force_decode_length: bool, whether to force the full decode length, or if
       False, stop when all beams hit eos_id.
+    compact_beam_search: bool, whether to use beam_search.compact_beam_search,
+      which removes batch elements from the loop as soon as they are decided.
+      symbols_to_logits_fn must not close over batch-sized tensors.
 
   Returns:
       A dict of decoding results {
@@ -847,43 +1085,14 @@ def fast_decode(encoder_output,
   if encoder_output is not None:
     batch_size = common_layers.shape_list(encoder_output)[0]
 
-  key_channels = hparams.attention_key_channels or hparams.hidden_size
-  value_channels = hparams.attention_value_channels or hparams.hidden_size
-  num_layers = hparams.num_decoder_layers or hparams.num_hidden_layers
-
-  cache = {
-      "layer_%d" % layer: {
-          "k":
-              common_attention.split_heads(
-                  tf.zeros([batch_size, 0, key_channels]), hparams.num_heads),
-          "v":
-              common_attention.split_heads(
-                  tf.zeros([batch_size, 0, value_channels]), hparams.num_heads),
-          "f":
-              tf.zeros([batch_size, 0, hparams.hidden_size]),
-      } for layer in range(num_layers)
-  }
-
-  if encoder_output is not None:
-    for layer in range(num_layers):
-      layer_name = "layer_%d" % layer
-      with tf.variable_scope(
-          "body/decoder/%s/encdec_attention/multihead_attention" % layer_name):
-        k_encdec = common_attention.compute_attention_component(
-            encoder_output, key_channels, name="k")
-        k_encdec = common_attention.split_heads(k_encdec, hparams.num_heads)
-        v_encdec = common_attention.compute_attention_component(
-            encoder_output, value_channels, name="v")
-        v_encdec = common_attention.split_heads(v_encdec, hparams.num_heads)
-      cache[layer_name]["k_encdec"] = k_encdec
-      cache[layer_name]["v_encdec"] = v_encdec
-
-    cache["encoder_output"] = encoder_output
-    cache["encoder_decoder_attention_bias"] = encoder_decoder_attention_bias
+  cache = init_fast_decode_cache(encoder_output, encoder_decoder_attention_bias,
+                                 hparams, batch_size)
 
   if beam_size > 1:  # Beam Search
     initial_ids = tf.zeros([batch_size], dtype=tf.int32)
-    decoded_ids, scores = beam_search.beam_search(
+    search_fn = (beam_search.compact_beam_search if compact_beam_search
+                 else beam_search.beam_search)
+    decoded_ids, scores = search_fn(
         symbols_to_logits_fn,
         initial_ids,
         beam_size,
@@ -948,6 +1157,140 @@ def fast_decode(encoder_output,
   return {"outputs": decoded_ids, "scores": scores}
 
 
+def _local_variable_getter(getter, *args, **kwargs):
+  """Creates variables as non-trainable local variables."""
+  kwargs["collections"] = [tf.GraphKeys.LOCAL_VARIABLES]
+  kwargs["trainable"] = False
+  return getter(*args, **kwargs)
+
+
+def _truncate_cache(cache, length):
+  """Drops self-attention cache entries at positions >= length."""
+  for value in cache.values():
+    if isinstance(value, dict):
+      for key in ["k", "v"]:
+        value[key] = value[key][:, :, :length]
+  return cache
+
+
+def speculative_decode(step_fn,
+                       cache,
+                       draft_step_fn,
+                       draft_cache,
+                       batch_size,
+                       decode_length,
+                       num_draft_tokens=4,
+                       eos_id=beam_search.EOS_ID,
+                       force_decode_length=False):
+  """Greedy decoding where a draft model proposes tokens for verification.
+
+  Each iteration, the draft model greedily proposes num_draft_tokens tokens,
+  one decoder pass per token.  The full model then scores the last committed
+  token and the first num_draft_tokens - 1 proposals in a single pass, which
+  gives its own greedy choice at each of those positions.  Its choices are
+  committed up to and including the first position where they differ from the
+  draft in any batch element, and both caches are cut back to the committed
+  length.  Every committed token is the full model's greedy choice given the
+  committed prefix, so the outputs are those of greedy decoding (up to
+  floating point differences between single and multi-position passes).
+
+  Args:
+    step_fn: function mapping `(ids [batch_size, n], i, cache)` to
+      `(logits [batch_size, n, vocab_size], cache)` for the full model.
+    cache: incremental decoding cache of the full model.
+    draft_step_fn: like step_fn, for the draft model.
+    draft_cache: incremental decoding cache of the draft model.
+    batch_size: an integer scalar.
+    decode_length: an integer.  How many timesteps to decode.
+    num_draft_tokens: an integer.  How many tokens the draft proposes.
+    eos_id: End-of-sequence symbol.
+    force_decode_length: bool, whether to force the full decode length, or if
+      False, stop when all sequences hit eos_id.
+
+  Returns:
+    A dict of decoding results {
+        "outputs": integer `Tensor` of decoded ids of shape
+            [batch_size, <= decode_length]
+        "scores": decoding log probs, [batch_size]
+    }
+  """
+
+  def inner_loop(i, next_id, decoded_ids, log_probs, cache, draft_cache):
+    """Proposes, verifies and commits up to num_draft_tokens tokens."""
+    draft_ids = []
+    draft_id = next_id
+    for j in range(num_draft_tokens):
+      draft_logits, draft_cache = draft_step_fn(draft_id, i + j, draft_cache)
+      draft_id = tf.argmax(draft_logits, axis=-1)
+      draft_ids.append(draft_id)
+    draft_ids = tf.concat(draft_ids, axis=1)
+
+    verify_ids = tf.concat([next_id, draft_ids[:, :-1]], axis=1)
+    logits, cache = step_fn(verify_ids, i, cache)
+    greedy_ids = tf.argmax(logits, axis=-1)
+    greedy_log_probs = tf.reduce_sum(
+        common_layers.log_prob_from_logits(logits) *
+        tf.one_hot(greedy_ids, common_layers.shape_list(logits)[-1]), axis=-1)
+
+    # Number of leading proposals the full model agrees with, per sequence.
+    num_accepted = tf.reduce_sum(
+        tf.cumprod(tf.to_int32(tf.equal(greedy_ids, draft_ids)), axis=1),
+        axis=1)
+    num_committed = tf.reduce_min(
+        tf.minimum(num_accepted + 1, num_draft_tokens))
+
+    decoded_ids = tf.concat([decoded_ids, greedy_ids[:, :num_committed]],
+                            axis=1)
+    log_probs = tf.concat([log_probs, greedy_log_probs[:, :num_committed]],
+                          axis=1)
+    next_id = greedy_ids[:, num_committed - 1:num_committed]
+    cache = _truncate_cache(cache, i + num_committed)
+    draft_cache = _truncate_cache(draft_cache, i + num_committed)
+    return (i + num_committed, next_id, decoded_ids, log_probs, cache,
+            draft_cache)
+
+  def is_not_finished(i, unused_next_id, decoded_ids, *_):
+    finished = i >= decode_length
+    if not force_decode_length:
+      hit_eos = tf.reduce_any(tf.equal(decoded_ids, eos_id), axis=1)
+      finished |= tf.reduce_all(hit_eos)
+    return tf.logical_not(finished)
+
+  decoded_ids = tf.zeros([batch_size, 0], dtype=tf.int64)
+  log_probs = tf.zeros([batch_size, 0], dtype=tf.float32)
+  next_id = tf.zeros([batch_size, 1], dtype=tf.int64)
+  _, _, decoded_ids, log_probs, _, _ = tf.while_loop(
+      is_not_finished,
+      inner_loop, [
+          tf.constant(0), next_id, decoded_ids, log_probs, cache, draft_cache
+      ],
+      shape_invariants=[
+          tf.TensorShape([]),
+          tf.TensorShape([None, None]),
+          tf.TensorShape([None, None]),
+          tf.TensorShape([None, None]),
+          nest.map_structure(beam_search.get_state_shape_invariants, cache),
+          nest.map_structure(beam_search.get_state_shape_invariants,
+                             draft_cache),
+      ])
+
+  # Greedy decoding stops at the step where the last sequence hits EOS, and
+  # more than that may have been committed here.
+  num_decoded = common_layers.shape_list(decoded_ids)[1]
+  length = tf.minimum(num_decoded, decode_length)
+  if not force_decode_length:
+    is_eos = tf.equal(decoded_ids, eos_id)
+    first_eos = tf.where(
+        tf.reduce_any(is_eos, axis=1),
+        tf.to_int32(tf.argmax(tf.to_int32(is_eos), axis=1)),
+        tf.fill([batch_size], num_decoded))
+    length = tf.minimum(length, tf.reduce_max(first_eos) + 1)
+  return {
+      "outputs": decoded_ids[:, :length],
+      "scores": tf.reduce_sum(log_probs[:, :length], axis=1),
+  }
+
+
 @registry.register_model
 class TransformerScorer(Transformer):
   """Transformer model, but only scores in PREDICT mode.
@@ -320,6 +320,39 @@ class TransformerTest(tf.test.TestCase):
                      (BATCH_SIZE, INPUT_LENGTH + decode_length))
     self.assertAllClose(fast_tpu_res, fast_non_tpu_res)
 
+  def testCompactBeamSearchDecodePaths(self):
+    if not tf_version_has_inplace_ops():
+      return
+
+    decode_length = 3
+
+    model, features = self._create_greedy_infer_model()
+
+    with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+      beam_result = model._beam_decode(
+          features, decode_length, beam_size=4, top_beams=1,
+          alpha=1.0)["outputs"]
+      greedy_result = model._greedy_infer(
+          features, decode_length, use_tpu=False)["outputs"]
+
+      # The flag selects the compact search in _fast_decode and is ignored by
+      # the TPU decoder.
+      model._decode_hparams.compact_beam_search = True
+      compact_beam_result = model._beam_decode(
+          features, decode_length, beam_size=4, top_beams=1,
+          alpha=1.0)["outputs"]
+      greedy_tpu_result = model._greedy_infer(
+          features, decode_length, use_tpu=True)["outputs"]
+
+    with self.test_session():
+      beam_res = beam_result.eval()
+      compact_beam_res = compact_beam_result.eval()
+      greedy_res = greedy_result.eval()
+      greedy_tpu_res = greedy_tpu_result.eval()
+
+    self.assertAllEqual(beam_res, compact_beam_res)
+    self.assertAllEqual(greedy_res, greedy_tpu_res)
+
   def testGreedyTPUSlowVsFast(self):
     if not tf_version_has_inplace_ops():
       return
@@ -345,6 +378,66 @@ class TransformerTest(tf.test.TestCase):
     self.assertAllClose(fast_res, slow_res)
 
 
+def _toy_step_fn(batch_size, vocab_size, draft=False):
+  """Returns a step function for speculative_decode over toy models.
+
+  The greedy choice at each position is 2 + (sum of the ids in the cache +
+  batch index) mod (vocab_size - 2), so it depends on the whole cache and is
+  never EOS or padding.  The draft model is off by one at every third position.
+  """
+
+  def step_fn(ids, i, cache):
+    num_ids = tf.shape(ids)[1]
+    ids = tf.to_float(ids)[:, None, :, None]
+    k = tf.concat([cache["layer"]["k"], ids], axis=2)
+    cache["layer"] = {"k": k, "v": k}
+    sums = tf.to_int64(tf.cumsum(tf.reduce_sum(k, axis=[1, 3]), axis=1))
+    sums = sums[:, i:] + tf.range(batch_size, dtype=tf.int64)[:, None]
+    if draft:
+      positions = tf.range(num_ids) + i
+      sums += tf.to_int64(tf.equal(positions % 3, 2))[None, :]
+    next_ids = 2 + sums % (vocab_size - 2)
+    return 10. * tf.one_hot(next_ids, vocab_size), cache
+
+  return step_fn
+
+
+def _toy_greedy_decode(batch_size, vocab_size, decode_length):
+  outputs = []
+  for b in range(batch_size):
+    ids = [0]
+    for _ in range(decode_length):
+      ids.append(2 + (sum(ids) + b) % (vocab_size - 2))
+    outputs.append(ids[1:])
+  return np.array(outputs)
+
+
+class SpeculativeDecodeTest(tf.test.TestCase):
+
+  def testMatchesGreedyDecoding(self):
+    batch_size = 2
+    decode_length = 10
+
+    def empty_cache():
+      k = tf.zeros([batch_size, 1, 0, 1])
+      return {"layer": {"k": k, "v": k}}
+
+    results = []
+    for num_draft_tokens in [1, 2, 4]:
+      results.append(transformer.speculative_decode(
+          _toy_step_fn(batch_size, VOCAB_SIZE), empty_cache(),
+          _toy_step_fn(batch_size, VOCAB_SIZE, draft=True), empty_cache(),
+          batch_size, decode_length, num_draft_tokens=num_draft_tokens,
+          force_decode_length=True)["outputs"])
+
+    with self.test_session() as session:
+      results = session.run(results)
+
+    expected = _toy_greedy_decode(batch_size, VOCAB_SIZE, decode_length)
+    for result in results:
+      self.assertAllEqual(expected, result)
+
+
 class TransformerScorerTest(tf.test.TestCase):
 
   def testReturnsScores(self):
@@ -536,3 +536,225 @@ def beam_search(symbols_to_logits_fn,
   finished_scores = tf.where(
       tf.reduce_any(finished_flags, 1), finished_scores, alive_log_probs)
   return finished_seq, finished_scores
+
+
+def _get_compact_state_shape_invariants(tensor):
+  """Like get_state_shape_invariants, but the batch dim may shrink too."""
+  shape = tensor.shape.as_list()
+  for i in range(0, len(shape) - 1):
+    shape[i] = None
+  return tf.TensorShape(shape)
+
+
+def compact_beam_search(symbols_to_logits_fn,
+                        initial_ids,
+                        beam_size,
+                        decode_length,
+                        vocab_size,
+                        alpha,
+                        states=None,
+                        eos_id=EOS_ID,
+                        stop_early=True):
+  """Beam search that drops batch elements as soon as they are decided.
+
+  Like beam_search, but sequences are written into preallocated
+  [batch_size, beam_size, decode_length + 1] buffers instead of being grown by
+  concatenation, and a batch element leaves the loop as soon as its own
+  termination condition holds.  Its result is scattered into the output
+  buffers and its rows of the alive/finished tensors and of `states` are
+  gathered away, so later steps only run symbols_to_logits_fn on the elements
+  still being decoded.
+
+  With stop_early, an element is retired once all its beam_size finished slots
+  are filled and the lowest finished score beats the best score any of its
+  alive beams can still reach.  No later step can change its finished beams
+  then.  beam_search instead stops the whole batch once every element meets
+  the bound, possibly with unfilled finished slots (score -INF).  So the top
+  beams and scores are the same as beam_search's, and so is every lower beam
+  that beam_search filled; lower beams beam_search left unfilled may be filled
+  here, and the outputs may have more positions, padded with zeros.
+
+  symbols_to_logits_fn must only depend on batch-sized tensors through its
+  arguments; everything else it closes over must be independent of the batch
+  element, since rows are removed from `ids` and `states` as they finish.
+
+  Args:
+    symbols_to_logits_fn: Interface to the model, to provide logits.
+        Should take [batch_size, decoded_ids] and return [batch_size,
+        vocab_size]
+    initial_ids: Ids to start off the decoding, this will be the first thing
+        handed to symbols_to_logits_fn (after expanding to beam size)
+        [batch_size]
+    beam_size: Size of the beam.
+    decode_length: Number of steps to decode for.
+    vocab_size: Size of the vocab, must equal the size of the logits returned by
+        symbols_to_logits_fn
+    alpha: alpha for length penalty.
+    states: dict (possibly nested) of decoding states.
+    eos_id: ID for end of sentence.
+    stop_early: a boolean - stop once best sequence is provably determined.
+  Returns:
+    Tuple of
+    (decoded beams [batch_size, beam_size, decode_length]
+     decoding probabilities [batch_size, beam_size])
+  """
+  batch_size = common_layers.shape_list(initial_ids)[0]
+
+  # Assume initial_ids are prob 1.0
+  initial_log_probs = tf.constant([[0.] + [-float("inf")] * (beam_size - 1)])
+  alive_log_probs = tf.tile(initial_log_probs, [batch_size, 1])
+
+  # Preallocated sequence buffers; position 0 holds initial_ids.
+  alive_seq = _expand_to_beam_size(initial_ids, beam_size)
+  alive_seq = tf.concat(
+      [tf.expand_dims(alive_seq, axis=2),
+       tf.zeros([batch_size, beam_size, decode_length], initial_ids.dtype)],
+      axis=2)
+  if states:
+    states = nest.map_structure(
+        lambda state: _expand_to_beam_size(state, beam_size), states)
+  else:
+    states = {}
+
+  finished_seq = tf.zeros_like(alive_seq)
+  finished_scores = tf.ones([batch_size, beam_size]) * -INF
+  finished_flags = tf.zeros([batch_size, beam_size], tf.bool)
+
+  # Original batch index of each row still being decoded, and the results of
+  # the rows that are done.
+  rows = tf.range(batch_size)
+  output_seq = tf.zeros_like(alive_seq)
+  output_scores = tf.zeros([batch_size, beam_size])
+
+  def grow_topk(i, num_rows, alive_seq, alive_log_probs, states):
+    """Grows alive to the top 2*beam_size candidates, as in beam_search."""
+    flat_ids = tf.reshape(alive_seq[:, :, :i + 1], [num_rows * beam_size, -1])
+    if states:
+      flat_states = nest.map_structure(_merge_beam_dim, states)
+      flat_logits, flat_states = symbols_to_logits_fn(flat_ids, i, flat_states)
+      states = nest.map_structure(
+          lambda t: _unmerge_beam_dim(t, num_rows, beam_size), flat_states)
+    else:
+      flat_logits = symbols_to_logits_fn(flat_ids)
+
+    logits = tf.reshape(flat_logits, [num_rows, beam_size, -1])
+    candidate_log_probs = common_layers.log_prob_from_logits(logits)
+    log_probs = candidate_log_probs + tf.expand_dims(alive_log_probs, axis=2)
+
+    length_penalty = tf.pow(((5. + tf.to_float(i + 1)) / 6.), alpha)
+
+    curr_scores = log_probs / length_penalty
+    flat_curr_scores = tf.reshape(curr_scores, [-1, beam_size * vocab_size])
+
+    topk_scores, topk_ids = tf.nn.top_k(flat_curr_scores, k=beam_size * 2)
+    topk_log_probs = topk_scores * length_penalty
+
+    topk_beam_index = topk_ids // vocab_size
+    topk_ids %= vocab_size
+
+    batch_pos = compute_batch_indices(num_rows, beam_size * 2)
+    topk_coordinates = tf.stack([batch_pos, topk_beam_index], axis=2)
+
+    topk_seq = tf.gather_nd(alive_seq, topk_coordinates)
+    if states:
+      states = nest.map_structure(
+          lambda state: tf.gather_nd(state, topk_coordinates), states)
+
+    # Write the new ids at position i + 1 of the buffer.
+    position = tf.one_hot(i + 1, common_layers.shape_list(alive_seq)[2],
+                          dtype=tf.int32)
+    topk_seq += tf.expand_dims(topk_ids, axis=2) * position
+
+    topk_finished = tf.equal(topk_ids, eos_id)
+
+    return topk_seq, topk_log_probs, topk_scores, topk_finished, states
+
+  def inner_loop(i, rows, alive_seq, alive_log_probs, finished_seq,
+                 finished_scores, finished_flags, states, output_seq,
+                 output_scores):
+    """One beam search step, then retires the rows that are done."""
+    num_rows = common_layers.shape_list(rows)[0]
+    topk_seq, topk_log_probs, topk_scores, topk_finished, states = grow_topk(
+        i, num_rows, alive_seq, alive_log_probs, states)
+
+    # grow_alive
+    alive_seq, alive_log_probs, _, states = compute_topk_scores_and_seq(
+        topk_seq, topk_scores + tf.to_float(topk_finished) * -INF,
+        topk_log_probs, topk_finished, beam_size, num_rows, "grow_alive",
+        states)
+
+    # grow_finished
+    curr_scores = topk_scores + (1. - tf.to_float(topk_finished)) * -INF
+    curr_finished_scores = tf.concat([finished_scores, curr_scores], axis=1)
+    finished_seq, finished_scores, finished_flags, _ = (
+        compute_topk_scores_and_seq(
+            tf.concat([finished_seq, topk_seq], axis=1), curr_finished_scores,
+            curr_finished_scores,
+            tf.concat([finished_flags, topk_finished], axis=1), beam_size,
+            num_rows, "grow_finished"))
+
+    # Rows whose termination condition holds, see beam_search._is_finished.
+    done = tf.fill([num_rows], tf.greater_equal(i + 1, decode_length))
+    any_finished = tf.reduce_any(finished_flags, 1)
+    if stop_early:
+      max_length_penalty = tf.pow(((5. + tf.to_float(decode_length)) / 6.),
+                                  alpha)
+      lower_bound_alive_scores = alive_log_probs[:, 0] / max_length_penalty
+      lowest_score_of_finished_in_finished = tf.reduce_min(
+          finished_scores * tf.to_float(finished_flags), axis=1)
+      lowest_score_of_finished_in_finished += (
+          (1. - tf.to_float(any_finished)) * -INF)
+      # Unfilled finished slots could still be filled by alive beams.
+      done = tf.logical_or(done, tf.logical_and(
+          tf.reduce_all(finished_flags, 1),
+          tf.greater(lowest_score_of_finished_in_finished,
+                     lower_bound_alive_scores)))
+
+    # Scatter the results of the done rows into the outputs. Every row is
+    # retired exactly once, so adding to the zero-initialized outputs is safe.
+    done_index = tf.squeeze(tf.where(done), axis=1)
+    done_rows = tf.expand_dims(tf.gather(rows, done_index), axis=1)
+    done_seq = tf.gather(
+        tf.where(any_finished, finished_seq, alive_seq), done_index)
+    done_scores = tf.gather(
+        tf.where(any_finished, finished_scores, alive_log_probs), done_index)
+    output_seq += tf.scatter_nd(done_rows, done_seq, tf.shape(output_seq))
+    output_scores += tf.scatter_nd(done_rows, done_scores,
+                                   tf.shape(output_scores))
+
+    # Compact the remaining rows.
+    keep_index = tf.squeeze(tf.where(tf.logical_not(done)), axis=1)
+    keep = lambda t: tf.gather(t, keep_index)
+    return (i + 1, keep(rows), keep(alive_seq), keep(alive_log_probs),
+            keep(finished_seq), keep(finished_scores), keep(finished_flags),
+            nest.map_structure(keep, states), output_seq, output_scores)
+
+  def _is_not_finished(i, rows, *unused_args):
+    return tf.logical_and(
+        tf.less(i, decode_length), tf.greater(tf.size(rows), 0))
+
+  (steps, _, _, _, _, _, _, _, output_seq, output_scores) = tf.while_loop(
+      _is_not_finished,
+      inner_loop, [
+          tf.constant(0), rows, alive_seq, alive_log_probs, finished_seq,
+          finished_scores, finished_flags, states, output_seq, output_scores
+      ],
+      shape_invariants=[
+          tf.TensorShape([]),
+          tf.TensorShape([None]),
+          tf.TensorShape([None, beam_size, None]),
+          tf.TensorShape([None, beam_size]),
+          tf.TensorShape([None, beam_size, None]),
+          tf.TensorShape([None, beam_size]),
+          tf.TensorShape([None, beam_size]),
+          nest.map_structure(_get_compact_state_shape_invariants, states),
+          output_seq.get_shape(),
+          output_scores.get_shape(),
+      ],
+      parallel_iterations=1,
+      back_prop=False)
+
+  # beam_search returns as many positions as the loop ran steps.
+  output_seq = output_seq[:, :, :steps + 1]
+  output_seq.set_shape((None, beam_size, None))
+  return output_seq, output_scores
@@ -369,5 +369,49 @@ class BeamSearchTest(tf.test.TestCase):
       except tf.errors.InvalidArgumentError as e:
         raise AssertionError(e.message)
 
+  def testCompactBeamSearchMatchesBeamSearch(self):
+    batch_size = 4
+    beam_size = 3
+    vocab_size = 5
+    decode_length = 8
+
+    rng = np.random.RandomState(0)
+    initial_ids = tf.constant([0] * batch_size)
+    transitions = tf.constant(rng.randn(vocab_size, vocab_size),
+                              dtype=tf.float32)
+    # A per-element bias carried in states, so that elements finish at
+    # different steps and compaction has to keep rows and states aligned.
+    states = {"bias": tf.constant(2. * rng.randn(batch_size, vocab_size),
+                                  dtype=tf.float32)}
+
+    def symbols_to_logits(ids, _, states):
+      logits = tf.gather(transitions, ids[:, -1]) + states["bias"]
+      return logits, states
+
+    for stop_early in [True, False]:
+      ids, scores = beam_search.beam_search(
+          symbols_to_logits, initial_ids, beam_size, decode_length,
+          vocab_size, 0.6, states=states, eos_id=1, stop_early=stop_early)
+      compact_ids, compact_scores = beam_search.compact_beam_search(
+          symbols_to_logits, initial_ids, beam_size, decode_length,
+          vocab_size, 0.6, states=states, eos_id=1, stop_early=stop_early)
+
+      with self.test_session() as sess:
+        ids, scores, compact_ids, compact_scores = sess.run(
+            [ids, scores, compact_ids, compact_scores])
+      # compact_beam_search may run longer to fill finished slots that
+      # beam_search left empty.
+      self.assertGreaterEqual(compact_ids.shape[2], ids.shape[2])
+      ids = np.pad(ids, [[0, 0], [0, 0],
+                         [0, compact_ids.shape[2] - ids.shape[2]]],
+                   "constant")
+      filled = scores > -beam_search.INF / 2
+      self.assertTrue(np.all(filled[:, 0]))
+      self.assertAllEqual(ids[filled], compact_ids[filled])
+      self.assertAllClose(scores[filled], compact_scores[filled])
+      if not stop_early:
+        self.assertAllEqual(ids, compact_ids)
+        self.assertAllClose(scores, compact_scores)
+
 if __name__ == "__main__":
   tf.test.main()
@@ -18,7 +18,9 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import functools
 import math
+import multiprocessing
 import os
 import re
 import sys
@@ -56,10 +58,135 @@ def _get_ngrams(segment, max_order):
   return ngram_counts
 
 
+def _token_ids(sequences):
+  """Maps the tokens of sequences to integer ids, equal tokens to equal ids.
+
+  Args:
+    sequences: list of token sequences.
+
+  Returns:
+    (ids, lengths): int64 arrays of the concatenated token ids and of the
+    sequence lengths.
+  """
+  lengths = np.array([len(s) for s in sequences], dtype=np.int64)
+  if (sequences and
+      all(isinstance(s, np.ndarray) and s.dtype.kind in "iu"
+          for s in sequences) and
+      len(set(s.dtype for s in sequences)) == 1):
+    # Rows of an id tensor, e.g. from bleu_score.
+    _, ids = np.unique(np.concatenate(sequences), return_inverse=True)
+  else:
+    vocab = {}
+    ids = [vocab.setdefault(token, len(vocab))
+           for sequence in sequences for token in sequence]
+  return np.asarray(ids, dtype=np.int64).reshape([-1]), lengths
+
+
+def ngram_ids(sequences, max_order):
+  """Maps all n-grams up to max_order of sequences to integer ids.
+
+  Two n-grams of the same order get the same id iff they are equal.  The ids
+  of order n are built from those of order n - 1 and the following token, so
+  they are exact, unlike hashes.
+
+  Args:
+    sequences: list of token sequences.
+    max_order: maximum length in tokens of the n-grams.
+
+  Returns:
+    A list with, for each order 1..max_order, a pair of int64 arrays: the id
+    of every n-gram of the sequences and the index of its sequence.
+  """
+  tokens, lengths = _token_ids(sequences)
+  num_tokens = len(tokens)
+  vocab_size = tokens.max() + 1 if num_tokens else 1
+  sequence = np.repeat(np.arange(len(lengths)), lengths)
+  # Number of tokens from each position to the end of its sequence.
+  remaining = np.repeat(np.cumsum(lengths), lengths) - np.arange(num_tokens)
+
+  result = []
+  ids = tokens
+  for order in range(1, max_order + 1):
+    if order > 1:
+      # Also pairs n-grams across sequence boundaries, which are dropped below.
+      _, ids = np.unique(ids[:-1] * vocab_size + tokens[order - 1:],
+                         return_inverse=True)
+      ids = ids.astype(np.int64).reshape([-1])
+    valid = remaining[:len(ids)] >= order
+    result.append((ids[valid], sequence[:len(ids)][valid]))
+  return result
+
+
+def map_chunks(fn, items, num_workers=None):
+  """Applies fn to contiguous chunks of items in worker processes.
+
+  Args:
+    fn: a picklable function of a list of items.
+    items: a list.
+    num_workers: number of processes.  If None or 1, fn is applied to all of
+      items in this process.
+
+  Returns:
+    The list of results of fn on the chunks, in order.
+  """
+  if not num_workers or num_workers <= 1 or len(items) < 2:
+    return [fn(items)]
+  chunk_size = -(-len(items) // num_workers)
+  chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+  pool = multiprocessing.Pool(num_workers)
+  try:
+    return pool.map(fn, chunks)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def _bleu_stats(max_order, corpus_pairs):
+  """Counts clipped n-gram matches of (reference, translation) pairs.
+
+  Args:
+    max_order: Maximum n-gram order.
+    corpus_pairs: list of (reference, translation) token sequences.
+
+  Returns:
+    (matches_by_order, possible_matches_by_order, reference_length,
+    translation_length), all integers.
+  """
+  num_pairs = len(corpus_pairs)
+  references = [reference for reference, _ in corpus_pairs]
+  translations = [translation for _, translation in corpus_pairs]
+  reference_length = sum(len(reference) for reference in references)
+  translation_length = sum(len(translation) for translation in translations)
+  if not num_pairs:
+    return [0] * max_order, [0] * max_order, 0, 0
+
+  matches_by_order = []
+  possible_matches_by_order = []
+  for ids, sequence in ngram_ids(references + translations, max_order):
+    # Key each n-gram by its pair, so that counts are per sentence.
+    is_reference = sequence < num_pairs
+    keys = (sequence % num_pairs) * (ids.max() + 1 if len(ids) else 1) + ids
+    ref_ngrams, ref_counts = np.unique(keys[is_reference], return_counts=True)
+    translation_ngrams, translation_counts = np.unique(
+        keys[~is_reference], return_counts=True)
+    matches = 0
+    if len(ref_ngrams) and len(translation_ngrams):
+      index = np.minimum(np.searchsorted(translation_ngrams, ref_ngrams),
+                         len(translation_ngrams) - 1)
+      found = translation_ngrams[index] == ref_ngrams
+      matches = np.minimum(ref_counts[found],
+                           translation_counts[index[found]]).sum()
+    matches_by_order.append(int(matches))
+    possible_matches_by_order.append(int(translation_counts.sum()))
+  return (matches_by_order, possible_matches_by_order, reference_length,
+          translation_length)
+
+
 def compute_bleu(reference_corpus,
                  translation_corpus,
                  max_order=4,
-                 use_bp=True):
+                 use_bp=True,
+                 num_workers=None):
   """Computes BLEU score of translated segments against one or more references.
 
   Args:
@@ -69,33 +196,27 @@ def compute_bleu(reference_corpus,
         should be tokenized into a list of tokens.
     max_order: Maximum n-gram order to use when computing BLEU score.
     use_bp: boolean, whether to apply brevity penalty.
+    num_workers: number of processes counting n-grams, None for one.
 
   Returns:
     BLEU score.
   """
-  reference_length = 0
-  translation_length = 0
   bp = 1.0
   geo_mean = 0
 
   matches_by_order = [0] * max_order
   possible_matches_by_order = [0] * max_order
-  precisions = []
-
-  for (references, translations) in zip(reference_corpus, translation_corpus):
-    reference_length += len(references)
-    translation_length += len(translations)
-    ref_ngram_counts = _get_ngrams(references, max_order)
-    translation_ngram_counts = _get_ngrams(translations, max_order)
-
-    overlap = dict((ngram,
-                    min(count, translation_ngram_counts[ngram]))
-                   for ngram, count in ref_ngram_counts.items())
-
-    for ngram in overlap:
-      matches_by_order[len(ngram) - 1] += overlap[ngram]
-    for ngram in translation_ngram_counts:
-      possible_matches_by_order[len(ngram)-1] += translation_ngram_counts[ngram]
+  reference_length = 0
+  translation_length = 0
+  for stats in map_chunks(
+      functools.partial(_bleu_stats, max_order),
+      list(zip(reference_corpus, translation_corpus)), num_workers):
+    for i in range(max_order):
+      matches_by_order[i] += stats[0][i]
+      possible_matches_by_order[i] += stats[1][i]
+    reference_length += stats[2]
+    translation_length += stats[3]
+
   precisions = [0] * max_order
   smooth = 1.0
   for i in range(0, max_order):
@@ -190,7 +311,43 @@ def bleu_tokenize(string):
   return string.split()
 
 
-def bleu_wrapper(ref_filename, hyp_filename, case_sensitive=False):
+# Joins lines for bleu_tokenize_many.  No substitution of bleu_tokenize
+# matches across it: it starts and ends with a digit, and NUL is neither
+# punctuation nor a symbol.
+_LINE_SEPARATOR = u"0\x000"
+
+
+def _bleu_tokenize_joined(strings):
+  """Tokenizes strings by applying the bleu_tokenize regexes once."""
+  if any(u"\x00" in string for string in strings):
+    return [bleu_tokenize(string) for string in strings]
+  string = _LINE_SEPARATOR.join(strings)
+  string = uregex.nondigit_punct_re.sub(r"\1 \2 ", string)
+  string = uregex.punct_nondigit_re.sub(r" \1 \2", string)
+  string = uregex.symbol_re.sub(r" \1 ", string)
+  return [line.split() for line in string.split(_LINE_SEPARATOR)]
+
+
+def bleu_tokenize_many(strings, num_workers=None):
+  """Tokenizes a list of one-line strings, as bleu_tokenize on each.
+
+  Args:
+    strings: list of input strings.
+    num_workers: number of processes, None for one.
+
+  Returns:
+    a list of lists of tokens.
+  """
+  if not strings:
+    return []
+  result = []
+  for tokens in map_chunks(_bleu_tokenize_joined, strings, num_workers):
+    result.extend(tokens)
+  return result
+
+
+def bleu_wrapper(ref_filename, hyp_filename, case_sensitive=False,
+                 num_workers=None):
   """Compute BLEU for two files (reference and hypothesis translation)."""
   ref_lines = text_encoder.native_to_unicode(
       tf.gfile.Open(ref_filename, "r").read()).splitlines()
@@ -200,9 +357,9 @@ def bleu_wrapper(ref_filename, hyp_filename, case_sensitive=False):
   if not case_sensitive:
     ref_lines = [x.lower() for x in ref_lines]
     hyp_lines = [x.lower() for x in hyp_lines]
-  ref_tokens = [bleu_tokenize(x) for x in ref_lines]
-  hyp_tokens = [bleu_tokenize(x) for x in hyp_lines]
-  return compute_bleu(ref_tokens, hyp_tokens)
+  ref_tokens = bleu_tokenize_many(ref_lines, num_workers)
+  hyp_tokens = bleu_tokenize_many(hyp_lines, num_workers)
+  return compute_bleu(ref_tokens, hyp_tokens, num_workers=num_workers)
 
 
 StepFile = collections.namedtuple("StepFile", "filename mtime ctime steps")
@@ -18,6 +18,7 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import numpy as np
 from tensor2tensor.utils import bleu_hook
 
 import tensorflow as tf
@@ -58,6 +59,39 @@ class BleuHookTest(tf.test.TestCase):
     self.assertEqual(bleu_hook.bleu_tokenize(u"hi, “there”"),
                      [u"hi", u",", u"“", u"there", u"”"])
 
+  def testComputeBleuMatchesCounts(self):
+    rng = np.random.RandomState(0)
+    reference_corpus = [list(rng.randint(5, size=rng.randint(12)))
+                        for _ in range(50)]
+    translation_corpus = [list(rng.randint(5, size=rng.randint(1, 12)))
+                          for _ in range(50)]
+    # The clipped n-gram counts from the Counters of _get_ngrams.
+    matches = [0] * 4
+    possible_matches = [0] * 4
+    for reference, translation in zip(reference_corpus, translation_corpus):
+      ref_counts = bleu_hook._get_ngrams(reference, 4)
+      translation_counts = bleu_hook._get_ngrams(translation, 4)
+      for ngram, count in translation_counts.items():
+        matches[len(ngram) - 1] += min(count, ref_counts[ngram])
+        possible_matches[len(ngram) - 1] += count
+    stats = bleu_hook._bleu_stats(
+        4, list(zip(reference_corpus, translation_corpus)))
+    self.assertEqual(matches, stats[0])
+    self.assertEqual(possible_matches, stats[1])
+
+    bleu = bleu_hook.compute_bleu(reference_corpus, translation_corpus)
+    self.assertEqual(bleu, bleu_hook.compute_bleu(
+        reference_corpus, translation_corpus, num_workers=2))
+
+  def testBleuTokenizeMany(self):
+    strings = [u"hi, “there”", u",5 dots...", u"3.14, and 1,000.",
+               u"year 2018.", u"", u"$5", u"a.b,c", u"(1)", u".5",
+               u"end.\x00,x"]
+    self.assertEqual([bleu_hook.bleu_tokenize(x) for x in strings],
+                     bleu_hook.bleu_tokenize_many(strings))
+    self.assertEqual([bleu_hook.bleu_tokenize(x) for x in strings],
+                     bleu_hook.bleu_tokenize_many(strings, num_workers=2))
+
 
 if __name__ == "__main__":
   tf.test.main()
@@ -18,7 +18,6 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
-import operator
 import os
 import time
 
@@ -36,6 +35,9 @@ FLAGS = tf.flags.FLAGS
 # Number of samples to draw for an image input (in such cases as captioning)
 IMAGE_DECODE_LENGTH = 100
 
+# decode_length feature of decode_from_file inputs, beyond their length.
+FILE_DECODE_EXTRA_LENGTH = 50
+
 
 def decode_hparams(overrides=""):
   """Hyperparameters for decoding."""
@@ -44,6 +46,7 @@ def decode_hparams(overrides=""):
       log_results=True,
       extra_length=100,
       batch_size=0,
+      batch_tokens=0,
       beam_size=4,
       alpha=0.6,
       return_beams=False,
@@ -55,7 +58,16 @@ def decode_hparams(overrides=""):
       decode_to_file=None,
       shards=1,
       shard_id=0,
-      force_decode_length=False)
+      force_decode_length=False,
+      compact_beam_search=False,
+      # Speculative greedy decoding: a registered hparams set and checkpoint
+      # of a smaller draft Transformer over the same vocabulary.
+      draft_hparams_set="",
+      draft_checkpoint="",
+      num_draft_tokens=4,
+      # Directory of PREDICT graphs serialized by earlier runs, reused
+      # instead of rebuilding the graph. See utils/graph_cache.py.
+      graph_cache_dir="")
   hp.parse(overrides)
   return hp
 
@@ -278,16 +290,20 @@ def decode_from_file(estimator,
   targets_vocab = p_hp.vocabulary["targets"]
   problem_name = FLAGS.problem
   tf.logging.info("Performing decoding from a file.")
-  sorted_inputs, sorted_keys = _get_sorted_inputs(filename, decode_hp.shards,
-                                                  decode_hp.delimiter)
-  num_decode_batches = (len(sorted_inputs) - 1) // decode_hp.batch_size + 1
+  inputs = _get_inputs(filename, decode_hp.shards, decode_hp.delimiter)
+  encoded_inputs = _encode_inputs(inputs, inputs_vocab,
+                                  decode_hp.max_input_size)
+  batches = _length_binned_batches(encoded_inputs, decode_hp.batch_size,
+                                   decode_hp.batch_tokens, decode_hp.beam_size)
+  tf.logging.info("Decoding %d inputs in %d batches" % (len(inputs),
+                                                         len(batches)))
 
   def input_fn():
-    input_gen = _decode_batch_input_fn(num_decode_batches, sorted_inputs,
-                                       inputs_vocab, decode_hp.batch_size,
-                                       decode_hp.max_input_size)
-    gen_fn = make_input_fn_from_generator(input_gen)
-    example = gen_fn()
+    dataset = tf.data.Dataset.from_generator(
+        lambda: (batch for _, batch in batches), tf.int32,
+        tf.TensorShape([None, None]))
+    dataset = dataset.prefetch(2)
+    example = {"inputs": dataset.make_one_shot_iterator().get_next()}
     return _decode_input_tensor_to_features_dict(example, hparams)
 
   decodes = []
@@ -348,14 +364,19 @@ def decode_from_file(estimator,
       decodes.append(decoded_outputs)
     total_time_per_step += elapsed_time
     total_cnt += result["outputs"].shape[-1]
-  tf.logging.info("Elapsed Time: %5.5f" % (time.time() - start_time))
+  elapsed_time = time.time() - start_time
+  tf.logging.info("Elapsed Time: %5.5f" % elapsed_time)
   tf.logging.info("Averaged Single Token Generation Time: %5.7f" %
                   (total_time_per_step / total_cnt))
-
-  # Reversing the decoded inputs and outputs because they were reversed in
-  # _decode_batch_input_fn
-  sorted_inputs.reverse()
-  decodes.reverse()
+  tf.logging.info("Decoded %d tokens, %.1f tokens/sec (compact_beam_search=%s)"
+                  % (total_cnt, total_cnt / max(elapsed_time, 1e-6),
+                     decode_hp.compact_beam_search))
+
+  # Predictions come in batch order; put them back into file order.
+  decode_order = [index for indices, _ in batches for index in indices]
+  file_order_decodes = [None] * len(inputs)
+  for index, decoded in zip(decode_order, decodes):
+    file_order_decodes[index] = decoded
   # If decode_to_file was provided use it as the output filename without change
   # (except for adding shard_id if using more shards for decoding).
   # Otherwise, use the input filename plus model, hp, problem, beam, alpha.
@@ -366,8 +387,8 @@ def decode_from_file(estimator,
     decode_filename = _decode_filename(decode_filename, problem_name, decode_hp)
   tf.logging.info("Writing decodes into %s" % decode_filename)
   outfile = tf.gfile.Open(decode_filename, "w")
-  for index in range(len(sorted_inputs)):
-    outfile.write("%s%s" % (decodes[sorted_keys[index]], decode_hp.delimiter))
+  for decoded in file_order_decodes:
+    outfile.write("%s%s" % (decoded, decode_hp.delimiter))
 
 
 def _decode_filename(base_filename, problem_name, decode_hp):
@@ -439,35 +460,59 @@ def decode_interactively(estimator, hparams, decode_hp, checkpoint_path=None):
             targets_vocab.decode(_save_until_eos(result["outputs"], is_image)))
 
 
-def _decode_batch_input_fn(num_decode_batches, sorted_inputs, vocabulary,
-                           batch_size, max_input_size):
-  """Generator to produce batches of inputs."""
-  tf.logging.info(" batch %d" % num_decode_batches)
-  # First reverse all the input sentences so that if you're going to get OOMs,
-  # you'll see it in the first batch
-  sorted_inputs.reverse()
-  for b in range(num_decode_batches):
-    tf.logging.info("Decoding batch %d" % b)
-    batch_length = 0
-    batch_inputs = []
-    for inputs in sorted_inputs[b * batch_size:(b + 1) * batch_size]:
-      input_ids = vocabulary.encode(inputs)
-      if max_input_size > 0:
-        # Subtract 1 for the EOS_ID.
-        input_ids = input_ids[:max_input_size - 1]
-      input_ids.append(text_encoder.EOS_ID)
-      batch_inputs.append(input_ids)
-      if len(input_ids) > batch_length:
-        batch_length = len(input_ids)
-    final_batch_inputs = []
-    for input_ids in batch_inputs:
-      assert len(input_ids) <= batch_length
-      x = input_ids + [0] * (batch_length - len(input_ids))
-      final_batch_inputs.append(x)
-
-    yield {
-        "inputs": np.array(final_batch_inputs).astype(np.int32),
-    }
+def _encode_inputs(inputs, vocabulary, max_input_size):
+  """Encodes all inputs up front, truncating and appending EOS_ID."""
+  if hasattr(vocabulary, "encode_many"):
+    encoded = vocabulary.encode_many(inputs)
+  else:
+    encoded = [vocabulary.encode(x) for x in inputs]
+  if max_input_size > 0:
+    # Subtract 1 for the EOS_ID.
+    encoded = [ids[:max_input_size - 1] for ids in encoded]
+  return [ids + [text_encoder.EOS_ID] for ids in encoded]
+
+
+def _length_binned_batches(encoded_inputs, batch_size, batch_tokens=0,
+                           beam_size=1):
+  """Groups encoded inputs of similar length into padded batches.
+
+  Inputs are sorted by encoded length, longest first so that any OOM shows up
+  in the first batch.  With batch_tokens > 0, each batch holds as many inputs
+  as fit in batch_tokens decoded positions, so short inputs are decoded in
+  larger batches.  No batch holds more than batch_size inputs.
+
+  _decode_input_tensor_to_features_dict sets the decode_length feature of a
+  batch of length n to n + FILE_DECODE_EXTRA_LENGTH, and the fast decoders add
+  the input length to it, so each of the beam_size beams of an input is
+  decoded for up to 2 * n + FILE_DECODE_EXTRA_LENGTH steps.
+
+  Args:
+    encoded_inputs: list of lists of ids.
+    batch_size: an integer, maximum inputs per batch.
+    batch_tokens: an integer, decoded positions per batch, or 0.
+    beam_size: an integer, beams decoded per input.
+
+  Returns:
+    a list of (indices into encoded_inputs, int32 array [batch, length]).
+  """
+  lengths = np.array([len(ids) for ids in encoded_inputs], dtype=np.int64)
+  order = np.argsort(-lengths, kind="mergesort")
+  batches = []
+  start = 0
+  while start < len(order):
+    batch_length = lengths[order[start]]
+    num_inputs = batch_size
+    if batch_tokens > 0:
+      decoded_length = max(beam_size, 1) * (
+          2 * batch_length + FILE_DECODE_EXTRA_LENGTH)
+      num_inputs = min(num_inputs, max(1, batch_tokens // decoded_length))
+    indices = order[start:start + num_inputs]
+    padded = np.zeros((len(indices), batch_length), dtype=np.int32)
+    for row, index in enumerate(indices):
+      padded[row, :lengths[index]] = encoded_inputs[index]
+    batches.append((indices.tolist(), padded))
+    start += num_inputs
+  return batches
 
 
 def _interactive_input_fn(hparams, decode_hp):
@@ -582,8 +627,8 @@ def show_and_save_image(img, save_path):
     plt.savefig(sp)
 
 
-def _get_sorted_inputs(filename, num_shards=1, delimiter="\n"):
-  """Returning inputs sorted according to length.
+def _get_inputs(filename, num_shards=1, delimiter="\n"):
+  """Returns the inputs in filename, in file order.
 
   Args:
     filename: path to file with inputs, 1 per line.
@@ -592,11 +637,9 @@ def _get_sorted_inputs(filename, num_shards=1, delimiter="\n"):
     delimiter: str, delimits records in the file.
 
   Returns:
-    a sorted list of inputs
-
+    a list of inputs
   """
-  tf.logging.info("Getting sorted inputs")
-  # read file and sort inputs according them according to input length.
+  tf.logging.info("Getting inputs")
   if num_shards > 1:
     decode_filename = filename + ("%.2d" % FLAGS.worker_id)
   else:
@@ -609,15 +652,7 @@ def _get_sorted_inputs(filename, num_shards=1, delimiter="\n"):
     # Strip the last empty line.
     if not inputs[-1]:
       inputs.pop()
-  input_lens = [(i, len(line.split())) for i, line in enumerate(inputs)]
-  sorted_input_lens = sorted(input_lens, key=operator.itemgetter(1))
-  # We'll need the keys to rearrange the inputs back into their original order
-  sorted_keys = {}
-  sorted_inputs = []
-  for i, (index, _) in enumerate(sorted_input_lens):
-    sorted_inputs.append(inputs[index])
-    sorted_keys[index] = i
-  return sorted_inputs, sorted_keys
+  return inputs
 
 
 def _save_until_eos(hyp, is_image):
@@ -699,7 +734,8 @@ def _decode_input_tensor_to_features_dict(feature_map, hparams):
   features["input_space_id"] = input_space_id
   features["target_space_id"] = target_space_id
   features["decode_length"] = (
-      IMAGE_DECODE_LENGTH if input_is_image else tf.shape(x)[1] + 50)
+      IMAGE_DECODE_LENGTH if input_is_image else
+      tf.shape(x)[1] + FILE_DECODE_EXTRA_LENGTH)
   features["inputs"] = x
   return features
 
@@ -0,0 +1,209 @@
+# coding=utf-8
+# Copyright 2018 The Tensor2Tensor Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Persistent cache of built inference graphs.
+
+Building the PREDICT graph of a large model takes tens of seconds and is
+repeated by every decoding run.  With decode_hparams.graph_cache_dir set, the
+graph built by T2TModel.estimator_spec_predict is serialized as a MetaGraphDef
+keyed by the model, hparams, problem, decode hparams, feature signature and
+TensorFlow version, and later runs import it instead of building it.
+
+The key does not cover the model code itself: clear the cache directory after
+changing it.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import time
+import six
+
+import tensorflow as tf
+
+# Decode hparams that do not change the PREDICT graph.
+_NON_GRAPH_DECODE_HPARAMS = [
+    "graph_cache_dir", "save_images", "log_results", "batch_size",
+    "batch_tokens", "max_input_size", "identity_output", "num_samples",
+    "delimiter", "decode_to_file", "shards", "shard_id"
+]
+
+# Name scope of the cached graph's ops, so that they do not clash with the
+# input pipeline's when imported.  Variable names are not affected.
+_SCOPE = "graph_cache"
+
+
+def _device_key(device):
+  if isinstance(device, six.string_types):
+    return device
+  return getattr(device, "__name__", type(device).__name__)
+
+
+def _modality_key(modality):
+  """Returns a JSON-serializable key of a modality, spec or dict of them."""
+  if isinstance(modality, dict):
+    return sorted((k, _modality_key(v)) for k, v in six.iteritems(modality))
+  if modality is None or isinstance(modality, (list, tuple)):
+    # An unconstructed (modality name, vocab size) spec.
+    return modality
+  return [type(modality).__name__, modality.top_dimensionality]
+
+
+def graph_cache_key(model_name, hparams, decode_hparams, features,
+                    data_parallelism=None):
+  """Returns the cache key of a PREDICT graph.
+
+  Args:
+    model_name: a string, the registered model name.
+    hparams: model HParams, possibly with problem and problem_hparams.
+    decode_hparams: decoding HParams.
+    features: dict<str name, Tensor feature> fed to the model.
+    data_parallelism: an expert_utils.Parallelism or None.
+
+  Returns:
+    a hex string.
+  """
+  problem = getattr(hparams, "problem", None)
+  problem_hparams = getattr(hparams, "problem_hparams", None)
+  modalities = None
+  if problem_hparams is not None:
+    modalities = {
+        "inputs": _modality_key(problem_hparams.input_modality),
+        "targets": _modality_key(problem_hparams.target_modality),
+    }
+  decode_values = {
+      k: v for k, v in six.iteritems(decode_hparams.values())
+      if k not in _NON_GRAPH_DECODE_HPARAMS
+  }
+  devices = None
+  if data_parallelism is not None:
+    devices = [_device_key(d) for d in data_parallelism._devices]  # pylint: disable=protected-access
+  key = {
+      "model": model_name,
+      "hparams": hparams.values(),
+      "problem": getattr(problem, "name", None),
+      "modalities": modalities,
+      "decode_hparams": decode_values,
+      "features": {k: [v.dtype.name, str(v.shape)]
+                   for k, v in six.iteritems(features)},
+      "devices": devices,
+      "tensorflow": [tf.__version__, tf.__git_version__],
+  }
+  key = json.dumps(key, sort_keys=True, default=str)
+  return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _tensor_names(tensors):
+  return {k: v.name for k, v in six.iteritems(tensors)}
+
+
+def _build_and_save(path, features, spec_fn):
+  """Builds the PREDICT graph in a new graph and writes it to path.
+
+  Returns:
+    whether the graph could be cached.
+  """
+  graph = tf.Graph()
+  with graph.as_default(), tf.name_scope(_SCOPE):
+    with tf.name_scope("features"):
+      placeholders = {
+          k: tf.placeholder(v.dtype, v.shape, name=k)
+          for k, v in six.iteritems(features)
+      }
+    feature_names = _tensor_names(placeholders)
+    spec = spec_fn(dict(placeholders))
+    if tf.train.get_global_step(graph) is not None:
+      # The importing graph has its own global step.
+      tf.logging.warning("Not caching a graph that uses the global step.")
+      return False
+    signature = {
+        "features": feature_names,
+        "predictions": _tensor_names(spec.predictions),
+        "export_outputs": {
+            k: _tensor_names(v.outputs)
+            for k, v in six.iteritems(spec.export_outputs)
+        },
+    }
+    meta_graph_def = tf.train.export_meta_graph()
+
+  # The graph is complete once the .meta file exists.
+  with tf.gfile.Open(path + ".json", "w") as f:
+    f.write(json.dumps(signature))
+  tmp_path = path + ".meta.incomplete"
+  with tf.gfile.Open(tmp_path, "wb") as f:
+    f.write(meta_graph_def.SerializeToString())
+  tf.gfile.Rename(tmp_path, path + ".meta", overwrite=True)
+  return True
+
+
+def cached_predict_spec(cache_dir, key, features, spec_fn):
+  """Returns a PREDICT EstimatorSpec whose graph is imported from the cache.
+
+  On a cache miss, spec_fn is called on placeholders in a separate graph and
+  the result is written to the cache before being imported.
+
+  Args:
+    cache_dir: a string, the cache directory.
+    key: a string, see graph_cache_key.
+    features: dict<str name, Tensor feature> in the default graph.
+    spec_fn: function mapping features to a PREDICT EstimatorSpec.  It must
+      create its model and variables in the default graph.
+
+  Returns:
+    an EstimatorSpec, or None if the graph cannot be cached.
+  """
+  path = os.path.join(cache_dir, key)
+  if not tf.gfile.Exists(path + ".meta"):
+    start_time = time.time()
+    tf.gfile.MakeDirs(cache_dir)
+    if not _build_and_save(path, features, spec_fn):
+      return None
+    tf.logging.info("Cached PREDICT graph %s (%.3f sec)." %
+                    (path, time.time() - start_time))
+
+  start_time = time.time()
+  with tf.gfile.Open(path + ".json") as f:
+    signature = json.loads(f.read())
+  meta_graph_def = tf.MetaGraphDef()
+  with tf.gfile.Open(path + ".meta", "rb") as f:
+    meta_graph_def.ParseFromString(f.read())
+  input_map = {
+      name: features[k] for k, name in six.iteritems(signature["features"])
+  }
+  tf.train.import_meta_graph(meta_graph_def, input_map=input_map)
+  tf.logging.info("Imported cached PREDICT graph %s (%.3f sec)." %
+                  (path, time.time() - start_time))
+
+  graph = tf.get_default_graph()
+
+  def get_tensors(names):
+    # Features passed through to the outputs are taken from the input map, as
+    # the imported placeholders are not fed.
+    return {
+        k: input_map[name] if name in input_map else
+        graph.get_tensor_by_name(name) for k, name in six.iteritems(names)
+    }
+
+  export_outputs = {
+      k: tf.estimator.export.PredictOutput(get_tensors(names))
+      for k, names in six.iteritems(signature["export_outputs"])
+  }
+  return tf.estimator.EstimatorSpec(
+      tf.estimator.ModeKeys.PREDICT,
+      predictions=get_tensors(signature["predictions"]),
+      export_outputs=export_outputs)
@@ -0,0 +1,101 @@
+# coding=utf-8
+# Copyright 2018 The Tensor2Tensor Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for tensor2tensor.utils.graph_cache."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+from tensor2tensor.data_generators import problem_hparams
+from tensor2tensor.models import transformer
+from tensor2tensor.utils import graph_cache
+
+import tensorflow as tf
+
+
+def _spec_fn(features):
+  with tf.variable_scope("model"):
+    w = tf.get_variable("w", [3], initializer=tf.ones_initializer())
+  outputs = tf.reduce_sum(features["inputs"] * w, axis=1)
+  return tf.estimator.EstimatorSpec(
+      tf.estimator.ModeKeys.PREDICT,
+      predictions={"outputs": outputs, "inputs": features["inputs"]},
+      export_outputs={
+          "serving_default": tf.estimator.export.PredictOutput(
+              {"outputs": outputs})
+      })
+
+
+class GraphCacheTest(tf.test.TestCase):
+
+  def _run(self, cache_dir, key, spec_fn):
+    with tf.Graph().as_default():
+      inputs = tf.constant(np.arange(6, dtype=np.float32).reshape([2, 3]))
+      spec = graph_cache.cached_predict_spec(cache_dir, key,
+                                             {"inputs": inputs}, spec_fn)
+      self.assertEqual(["model/w:0"],
+                       [v.name for v in tf.global_variables()])
+      with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        return sess.run(spec.predictions)
+
+  def testCachedGraphMatchesBuiltGraph(self):
+    cache_dir = self.get_temp_dir()
+    key = "test_key"
+    built = self._run(cache_dir, key, _spec_fn)
+
+    def fail_spec_fn(unused_features):
+      raise AssertionError("The graph should come from the cache.")
+
+    cached = self._run(cache_dir, key, fail_spec_fn)
+    self.assertAllEqual([3., 12.], built["outputs"])
+    self.assertAllEqual(built["outputs"], cached["outputs"])
+    self.assertAllEqual(built["inputs"], cached["inputs"])
+
+  def testKeyDependsOnHParams(self):
+    features = {"inputs": tf.placeholder(tf.int32, [None, None])}
+    decode_hparams = tf.contrib.training.HParams(beam_size=4, shard_id=0)
+    hparams = tf.contrib.training.HParams(hidden_size=16)
+    key = graph_cache.graph_cache_key("model", hparams, decode_hparams,
+                                      features)
+    decode_hparams.shard_id = 1
+    self.assertEqual(key, graph_cache.graph_cache_key(
+        "model", hparams, decode_hparams, features))
+    hparams.hidden_size = 32
+    self.assertNotEqual(key, graph_cache.graph_cache_key(
+        "model", hparams, decode_hparams, features))
+
+  def testKeyStableAcrossModalityObjects(self):
+    features = {"inputs": tf.placeholder(tf.int32, [None, None])}
+    decode_hparams = tf.contrib.training.HParams(beam_size=4)
+
+    def key(vocab_size):
+      # Each model constructs new modality objects in its problem_hparams.
+      hparams = transformer.transformer_tiny()
+      p_hparams = problem_hparams.test_problem_hparams(vocab_size, vocab_size)
+      hparams.problem_hparams = p_hparams
+      transformer.Transformer(hparams, tf.estimator.ModeKeys.PREDICT,
+                              p_hparams)
+      return graph_cache.graph_cache_key("transformer", hparams,
+                                         decode_hparams, features)
+
+    self.assertEqual(key(10), key(10))
+    self.assertNotEqual(key(10), key(12))
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -26,13 +26,17 @@ from __future__ import unicode_literals
 
 import numpy as np
 
+from tensor2tensor.utils import bleu_hook
+
 import tensorflow as tf
 
 
 def _len_lcs(x, y):
   """Returns the length of the Longest Common Subsequence between two seqs.
 
-  Source: http://www.algorithmist.com/index.php/Longest_Common_Subsequence
+  Computes the rows of the _lcs table with numpy, looping over the shorter
+  sequence: for each word, a row is the running maximum of the row above and
+  of the row above shifted by one where the words match.
 
   Args:
     x: sequence of words
@@ -41,9 +45,18 @@ def _len_lcs(x, y):
   Returns
     integer: Length of LCS between x and y
   """
-  table = _lcs(x, y)
-  n, m = len(x), len(y)
-  return table[n, m]
+  if len(x) > len(y):
+    x, y = y, x
+  if not len(x):  # pylint: disable=g-explicit-length-test
+    return 0
+  vocab = {}
+  y_ids = np.array([vocab.setdefault(word, len(vocab)) for word in y])
+  x_ids = [vocab.get(word, -1) for word in x]
+  row = np.zeros(len(y) + 1, dtype=np.int64)
+  for word_id in x_ids:
+    row[1:] = np.maximum(row[1:], row[:-1] + (y_ids == word_id))
+    np.maximum.accumulate(row, out=row)
+  return int(row[-1])
 
 
 def _lcs(x, y):
@@ -96,7 +109,7 @@ def _f_lcs(llcs, m, n):
   return f_lcs
 
 
-def rouge_l_sentence_level(eval_sentences, ref_sentences):
+def rouge_l_sentence_level(eval_sentences, ref_sentences, num_workers=None):
   """Computes ROUGE-L (sentence level) of two collections of sentences.
 
   Source: https://www.microsoft.com/en-us/research/publication/
@@ -116,18 +129,28 @@ def rouge_l_sentence_level(eval_sentences, ref_sentences):
   Args:
     eval_sentences: The sentences that have been picked by the summarizer
     ref_sentences: The sentences from the reference set
+    num_workers: Number of processes computing LCS, None for one.
 
   Returns:
     A float: F_lcs
   """
 
   f1_scores = []
-  for eval_sentence, ref_sentence in zip(eval_sentences, ref_sentences):
+  for scores in bleu_hook.map_chunks(
+      _rouge_l_scores, list(zip(eval_sentences, ref_sentences)), num_workers):
+    f1_scores.extend(scores)
+  return np.mean(f1_scores, dtype=np.float32)
+
+
+def _rouge_l_scores(sentence_pairs):
+  """Returns the F_lcs of each (eval, reference) sentence pair."""
+  f1_scores = []
+  for eval_sentence, ref_sentence in sentence_pairs:
     m = len(ref_sentence)
     n = len(eval_sentence)
     lcs = _len_lcs(eval_sentence, ref_sentence)
     f1_scores.append(_f_lcs(lcs, m, n))
-  return np.mean(f1_scores, dtype=np.float32)
+  return f1_scores
 
 
 def rouge_l_fscore(predictions, labels, **unused_kwargs):
@@ -185,29 +208,34 @@ def rouge_n(eval_sentences, ref_sentences, n=2):
     f1 score for ROUGE-N
   """
 
-  f1_scores = []
-  for eval_sentence, ref_sentence in zip(eval_sentences, ref_sentences):
-    eval_ngrams = _get_ngrams(n, eval_sentence)
-    ref_ngrams = _get_ngrams(n, ref_sentence)
-    ref_count = len(ref_ngrams)
-    eval_count = len(eval_ngrams)
-
-    # Gets the overlapping ngrams between evaluated and reference
-    overlapping_ngrams = eval_ngrams.intersection(ref_ngrams)
-    overlapping_count = len(overlapping_ngrams)
-
-    # Handle edge case. This isn't mathematically correct, but it's good enough
-    if eval_count == 0:
-      precision = 0.0
-    else:
-      precision = overlapping_count / eval_count
-
-    if ref_count == 0:
-      recall = 0.0
-    else:
-      recall = overlapping_count / ref_count
-
-    f1_scores.append(2.0 * ((precision * recall) / (precision + recall + 1e-8)))
+  num_pairs = min(len(eval_sentences), len(ref_sentences))
+  if not num_pairs:
+    return np.mean([], dtype=np.float32)
+
+  # Distinct n-grams of each sentence, keyed by sentence pair.
+  ids, sentence = bleu_hook.ngram_ids(
+      list(eval_sentences[:num_pairs]) + list(ref_sentences[:num_pairs]), n)[-1]
+  num_ngrams = ids.max() + 1 if len(ids) else 1
+  keys = np.unique(sentence * num_ngrams + ids)
+  sentence = keys // num_ngrams
+  is_ref = sentence >= num_pairs
+  counts = np.bincount(sentence, minlength=2 * num_pairs)
+  eval_count = counts[:num_pairs]
+  ref_count = counts[num_pairs:]
+
+  # Gets the overlapping ngrams between evaluated and reference
+  overlapping_keys = np.intersect1d(
+      keys[~is_ref], keys[is_ref] - num_pairs * num_ngrams, assume_unique=True)
+  overlapping_count = np.bincount(overlapping_keys // num_ngrams,
+                                  minlength=num_pairs)
+
+  # Handle edge case. This isn't mathematically correct, but it's good enough
+  precision = np.where(eval_count == 0, 0.0,
+                       overlapping_count / np.maximum(eval_count, 1))
+  recall = np.where(ref_count == 0, 0.0,
+                    overlapping_count / np.maximum(ref_count, 1))
+
+  f1_scores = 2.0 * ((precision * recall) / (precision + recall + 1e-8))
 
   # return overlapping_count / reference_count
   return np.mean(f1_scores, dtype=np.float32)
@@ -74,6 +74,21 @@ class TestRougeLMetric(tf.test.TestCase):
     self.assertAllClose(
         rouge.rouge_l_sentence_level(hypotheses, references), 0.837, atol=1e-03)
 
+  def testLenLcsMatchesTable(self):
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+      x = list(rng.randint(4, size=rng.randint(10)))
+      y = list(rng.randint(4, size=rng.randint(10)))
+      self.assertEqual(rouge._lcs(x, y)[len(x), len(y)], rouge._len_lcs(x, y))
+
+  def testRougeLParallel(self):
+    rng = np.random.RandomState(0)
+    hypotheses = rng.randint(10, size=[20, 15])
+    references = rng.randint(10, size=[20, 12])
+    self.assertEqual(
+        rouge.rouge_l_sentence_level(hypotheses, references),
+        rouge.rouge_l_sentence_level(hypotheses, references, num_workers=2))
+
 
 class TestRougeMetricsE2E(tf.test.TestCase):
   """Tests the rouge metrics end-to-end."""
@@ -32,6 +32,7 @@ from tensor2tensor.layers import modalities  # pylint: disable=unused-import
 from tensor2tensor.utils import beam_search
 from tensor2tensor.utils import decoding
 from tensor2tensor.utils import expert_utils as eu
+from tensor2tensor.utils import graph_cache
 from tensor2tensor.utils import learning_rate
 from tensor2tensor.utils import metrics
 from tensor2tensor.utils import optimize
@@ -1189,6 +1190,28 @@ class T2TModel(base.Layer):
     data_parallelism = None
     if not use_tpu and config:
       data_parallelism = config.data_parallelism
+
+    # PREDICT mode, importing the graph from the cache if enabled
+    graph_cache_dir = getattr(decode_hparams, "graph_cache_dir", None)
+    if (mode == tf.estimator.ModeKeys.PREDICT and graph_cache_dir and
+        not use_tpu):
+
+      def build_predict_spec(features):
+        model = cls(
+            copy.deepcopy(hparams),
+            mode,
+            data_parallelism=data_parallelism,
+            decode_hparams=decode_hparams)
+        return model.estimator_spec_predict(features)
+
+      cache_key = graph_cache.graph_cache_key(
+          cls.REGISTERED_NAME or registry.default_name(cls), hparams,
+          decode_hparams, features, data_parallelism)
+      spec = graph_cache.cached_predict_spec(graph_cache_dir, cache_key,
+                                             features, build_predict_spec)
+      if spec is not None:
+        return spec
+
     model = cls(
         hparams,
         mode,
@@ -0,0 +1,78 @@
+import unittest
+import numpy as np
+
+import sys
+
+sys.path.append("..")
+
+from data import data_utils
+from model.utils.pruning import pruning_utils
+
+class RestorePrunedClassesTest(unittest.TestCase):
+    def test_round_trip_prediction(self):
+        rng = np.random.RandomState(0)
+        probs = rng.dirichlet(np.ones(6), size=20).astype(np.float32)
+        # the pruned model only keeps the classes the full model predicts
+        label_index = sorted(set(np.argmax(probs, axis=-1).tolist()) | set([5]))
+        embedding_info = {"label_index":label_index, "num_classes":6}
+
+        pruned_probs = probs[:, label_index]
+        restored = data_utils.restore_pruned_classes(pruned_probs, embedding_info)
+
+        self.assertEqual(restored.shape, probs.shape)
+        self.assertEqual(np.argmax(restored, axis=-1).tolist(),
+                         np.argmax(probs, axis=-1).tolist())
+        self.assertTrue(np.all(restored[:, label_index] == pruned_probs))
+
+    def test_unpruned_model(self):
+        probs = np.eye(3, dtype=np.float32)
+        self.assertIs(data_utils.restore_pruned_classes(probs, {}), probs)
+
+class PruneValueTest(unittest.TestCase):
+    def prune(self, var_name, value, var_shape):
+        # 10 tokens with 4 extra symbols, 6 classes
+        return pruning_utils.prune_value(var_name, value, var_shape,
+                            [0, 1, 2, 3, 5, 8], [0, 2, 5], 10, 4)
+
+    def test_center_loss_variables(self):
+        centers = np.arange(24, dtype=np.float32).reshape([6, 4])
+        for var_name in ["ESIM_center_loss/centers",
+                        "ESIM_center_loss/centers/ExponentialMovingAverage"]:
+            pruned = self.prune(var_name, centers, [3, 4])
+            self.assertTrue(np.all(pruned == centers[[0, 2, 5]]))
+
+        # feature size equal to the kept classes is still gathered by class
+        centers = np.arange(18, dtype=np.float32).reshape([6, 3])
+        pruned = self.prune("ESIM_center_loss/centers", centers, [3, 3])
+        self.assertTrue(np.all(pruned == centers[[0, 2, 5]]))
+
+    def test_output_projection(self):
+        kernel = np.arange(24, dtype=np.float32).reshape([4, 6])
+        pruned = self.prune("ESIM/output/kernel/Adam", kernel, [4, 3])
+        self.assertTrue(np.all(pruned == kernel[:, [0, 2, 5]]))
+        bias = np.arange(6, dtype=np.float32)
+        pruned = self.prune("ESIM/output/bias", bias, [3])
+        self.assertTrue(np.all(pruned == bias[[0, 2, 5]]))
+
+    def test_embedding_rows(self):
+        emb = np.arange(12, dtype=np.float32).reshape([6, 2])
+        pruned = self.prune("gene_token_emb_mat/emb_mat", emb, [2, 2])
+        self.assertTrue(np.all(pruned == emb[[1, 4]]))
+
+    def test_appended_rows(self):
+        # tokens 8 and 9 were appended by a vocab update
+        appended = np.arange(4, dtype=np.float32).reshape([2, 2])
+        pruned = pruning_utils.prune_value("gene_token_emb_mat/emb_appended", 
+                            appended, [1, 2], [0, 1, 2, 3, 5, 8], [0, 2, 5], 10, 4, 2)
+        self.assertTrue(np.all(pruned == appended[[0]]))
+        emb = np.arange(8, dtype=np.float32).reshape([4, 2])
+        pruned = pruning_utils.prune_value("gene_token_emb_mat/emb_mat", 
+                            emb, [1, 2], [0, 1, 2, 3, 5, 8], [0, 2, 5], 10, 4, 2)
+        self.assertTrue(np.all(pruned == emb[[1]]))
+
+    def test_shape_mismatch(self):
+        with self.assertRaises(ValueError):
+            self.prune("ESIM_center_loss/centers", np.zeros([6, 4]), [3, 5])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import numpy as np
+import pickle as pkl
+import shutil, tempfile, os
+
+import sys
+
+sys.path.append("..")
+
+from data import data_utils
+
+class UpdatePretrainedEmbeddingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.w2v_path = os.path.join(self.tmp_dir, "w2v.pkl")
+        self.vocab_path = os.path.join(self.tmp_dir, "emb_mat.pkl")
+        w2v = {"a":np.ones(3, dtype=np.float32), "b":np.full(3, 3.0, dtype=np.float32)}
+        pkl.dump(w2v, open(self.w2v_path, "wb"), protocol=2)
+        data_utils.read_pretrained_embedding(self.w2v_path, {"a":3, "b":3}, 
+                                    self.vocab_path, min_freq=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def load(self):
+        return pkl.load(open(self.vocab_path, "rb"))
+
+    def test_appended_rows(self):
+        new_token = data_utils.update_pretrained_embedding(self.w2v_path, 
+                                {"x":3, "y":3}, self.vocab_path, update_id="update_1")
+        embedding_info = self.load()
+        self.assertEqual(new_token, ["x", "y"])
+        self.assertEqual(embedding_info["appended_symbol"], ["x", "y"])
+        self.assertEqual(embedding_info["applied_updates"], ["update_1"])
+
+        word_mat = embedding_info["embedding_matrix"]
+        x, y = [embedding_info["token2id"][token] for token in ["x", "y"]]
+        self.assertEqual([x, y], [word_mat.shape[0]-2, word_mat.shape[0]-1])
+        self.assertFalse(np.all(word_mat[x] == word_mat[y]))
+
+    def test_repeated_update_is_skipped(self):
+        # "z" only reaches min_freq if the same file is counted twice
+        for _ in range(2):
+            new_token = data_utils.update_pretrained_embedding(self.w2v_path, 
+                                {"z":2}, self.vocab_path, update_id="update_1")
+            self.assertEqual(new_token, [])
+        embedding_info = self.load()
+        self.assertNotIn("z", embedding_info["token2id"])
+        self.assertEqual(embedding_info["vocab_stats"]["token_freq"]["z"], 2)
+
+if __name__ == "__main__":
+    unittest.main()
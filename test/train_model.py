@@ -33,18 +33,17 @@ cut_tool = data_utils.cut_tool_api()
 
 import time
 
-[train_anchor, 
-train_check, 
-train_label, 
-train_anchor_len, 
-train_check_len] = data_utils.read_data(train_data_path, 
+[train_sent_table, 
+train_anchor_index, 
+train_check_index, 
+train_label] = data_utils.read_pair_data(train_data_path, 
                     "train", 
                     cut_tool, 
                     data_clearner_api,
                     "tab")
                 
-dic = data_utils.make_dic(train_anchor+train_check)
-data_utils.read_pretrained_embedding(w2v_path, dic, vocab_path, min_freq=3)
+data_utils.build_vocab([train_sent_table[t] for t in train_anchor_index+train_check_index], 
+                    w2v_path, vocab_path, min_freq=3)
 
 if sys.version_info < (3, ):
     embedding_info = pkl.load(open(os.path.join(vocab_path), "rb"))
@@ -56,6 +55,7 @@ token2id = embedding_info["token2id"]
 id2token = embedding_info["id2token"]
 embedding_mat = embedding_info["embedding_matrix"]
 extral_symbol = embedding_info["extra_symbol"]
+train_sent_ids = data_utils.encode_sent_table(train_sent_table, token2id)
 
 def prepare_data(data_path, w2v_path, vocab_path):
     import time
@@ -112,8 +112,9 @@ def train(FLAGS):
 
             for epoch in range(FLAGS.max_epochs):
 
-                train_data = get_batch_data.get_batches(train_anchor, 
-                    train_check, 
+                train_data = get_batch_data.get_pair_batches(train_sent_ids, 
+                    train_anchor_index, 
+                    train_check_index, 
                     train_label, FLAGS.batch_size, 
                     token2id, is_training=True)
 
@@ -0,0 +1,105 @@
+import threading
+import time
+import bisect
+from collections import OrderedDict
+
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                    0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+RATIO_BUCKETS = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(['%s="%s"' % (key, value) for key, value in labels]) + "}"
+
+class Counter(object):
+    def __init__(self, name, doc):
+        self.name = name
+        self.doc = doc
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def expose(self):
+        lines = ["# HELP %s %s" % (self.name, self.doc),
+                "# TYPE %s counter" % self.name]
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append("%s%s %s" % (self.name, format_labels(key), repr(float(value))))
+        return lines
+
+class Histogram(object):
+    """cumulative-bucket histogram, observe is a bisect and three adds"""
+    def __init__(self, name, doc, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.buckets = list(buckets)
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0]*(len(self.buckets)+1), 0.0, 0]
+            counts = self.values[key]
+            counts[0][index] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def expose(self):
+        lines = ["# HELP %s %s" % (self.name, self.doc),
+                "# TYPE %s histogram" % self.name]
+        with self.lock:
+            for key, (bucket_counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets+["+Inf"], bucket_counts):
+                    cumulative += bucket_count
+                    lines.append("%s_bucket%s %s" % (self.name,
+                                format_labels(key+(("le", bound),)), repr(float(cumulative))))
+                lines.append("%s_sum%s %s" % (self.name, format_labels(key), repr(float(total))))
+                lines.append("%s_count%s %s" % (self.name, format_labels(key), repr(float(count))))
+        return lines
+
+class Timer(object):
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.duration = time.time() - self.start
+        self.histogram.observe(self.duration, **self.labels)
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = OrderedDict()
+
+    def counter(self, name, doc):
+        if name not in self.metrics:
+            self.metrics[name] = Counter(name, doc)
+        return self.metrics[name]
+
+    def histogram(self, name, doc, buckets=LATENCY_BUCKETS):
+        if name not in self.metrics:
+            self.metrics[name] = Histogram(name, doc, buckets)
+        return self.metrics[name]
+
+    def expose(self):
+        """prometheus text exposition format 0.0.4"""
+        lines = []
+        for name in self.metrics:
+            lines.extend(self.metrics[name].expose())
+        return "\n".join(lines) + "\n"
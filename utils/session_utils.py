@@ -0,0 +1,74 @@
+import tensorflow as tf
+import os
+
+ENV_PREFIX = "CLASSIFYNET_"
+
+SESSION_DEFAULTS = {
+    "intra_op_parallelism_threads":0,
+    "inter_op_parallelism_threads":0,
+    "inter_op_pool_name":"",
+    "graph_opt_level":"DEFAULT",
+    "log_device_placement":False,
+    "allow_soft_placement":True,
+    "gpu_memory_fraction":0.95,
+    "gpu_allow_growth":False
+}
+
+OPT_LEVELS = {
+    "L0":tf.OptimizerOptions.L0,
+    "L1":tf.OptimizerOptions.L1,
+    "DEFAULT":tf.OptimizerOptions.DEFAULT
+}
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.lower() in ["1", "true", "yes"]
+    return bool(value)
+
+def session_options(config=None):
+    """
+    resolve session options, CLASSIFYNET_<KEY> environment variables
+    override the model config which overrides SESSION_DEFAULTS
+    """
+    config = config or {}
+    options = {}
+    for key, default in SESSION_DEFAULTS.items():
+        value = os.environ.get(ENV_PREFIX+key.upper(), config.get(key, default))
+        if isinstance(default, bool):
+            value = parse_bool(value)
+        elif isinstance(default, int):
+            value = int(value)
+        elif isinstance(default, float):
+            value = float(value)
+        options[key] = value
+    return options
+
+def create_session_config(config=None):
+    options = session_options(config)
+
+    gpu_options = tf.GPUOptions(
+        per_process_gpu_memory_fraction=options["gpu_memory_fraction"],
+        allow_growth=options["gpu_allow_growth"])
+    graph_options = tf.GraphOptions(
+        optimizer_options=tf.OptimizerOptions(
+            opt_level=OPT_LEVELS[options["graph_opt_level"].upper()]))
+
+    session_conf = tf.ConfigProto(
+        allow_soft_placement=options["allow_soft_placement"],
+        log_device_placement=options["log_device_placement"],
+        intra_op_parallelism_threads=options["intra_op_parallelism_threads"],
+        gpu_options=gpu_options,
+        graph_options=graph_options)
+
+    if options["inter_op_pool_name"]:
+        # sessions naming the same pool share one process-wide inter-op pool,
+        # sized by whichever session creates it first
+        session_conf.session_inter_op_thread_pool.add(
+            num_threads=options["inter_op_parallelism_threads"],
+            global_name=options["inter_op_pool_name"])
+    else:
+        session_conf.inter_op_parallelism_threads = options["inter_op_parallelism_threads"]
+    return session_conf
+
+def create_session(graph, config=None):
+    return tf.Session(config=create_session_config(config), graph=graph)